@@ -4,23 +4,32 @@
 #   continually anouncing arrival times.
 #
 
+#   Modules needing requests, aiohttp or zipfile are imported
+#   when first used, and the MBTA object is made on a background
+#   thread, so loading the skill stays quick on small devices.
+#
+
 from adapt.intent import IntentBuilder
-from mycroft import MycroftSkill, intent_file_handler
-from mycroft.util.parse import match_one
-#from mycroft.util.parse import fuzzy_match
-import mycroft.util
+from mycroft import MycroftSkill
 from mycroft.audio import wait_while_speaking
 from mycroft import intent_handler
-# import requests
-import datetime
-from pytz import timezone
-import pickle
-import re
-import copy
-from . mbta import MBTA
-
-TZ_STR_IDX = len('-05:00') * (-1) # time zone string, used to strip tz from api dates
-ROUTE_FILE = 'savedroutes'  # file for saving route information
+import os
+import threading
+import time
+from . gtfs import GtfsCatalog
+from . shortcuts import ShortcutStore
+from . metrics import Metrics, PrometheusFile, LogSnapshot
+from . arrivals import waitBuckets, pollDelay, MIN_POLL_SECS
+from . warmup import WarmUp, parseWindows
+
+ROUTE_FILE = 'savedroutes'  # shortcuts pickled by earlier versions, imported once
+SHORTCUT_FILE = 'shortcuts.db' # saved route shortcuts
+CATALOG_FILE = 'gtfs.db'    # routes and stops imported from GTFS feed
+MIN_STOP_CONFIDENCE = 0.5   # stop matches below this are prompted for again
+METRICS_LOG_SECS = 300      # shortest time between metrics summaries in the log
+PREFETCH_WORKERS = 2        # threads reading stops and predictions ahead of the dialogue
+NEARBY_ROUTES = 4           # routes announced for arrivals near the device
+BOARD_ROUTES = 6            # routes announced on a stop's arrivals board
 
 class MbtaBusTracking(MycroftSkill):
 
@@ -39,8 +48,23 @@ class MbtaBusTracking(MycroftSkill):
         if self.useownkey:
           self.apiKey = self.settings.get('api_key')
 
-        # create MBTA object to handle api calls
-        self.t = MBTA(self.apiKey,self.settings.get('maxTrack', 3))
+        # routes and stops from GTFS feed, if one has been imported
+        self.catalog = GtfsCatalog(os.path.join(self.file_system.path, CATALOG_FILE))
+        self.importCatalog()
+
+        # request, cache and tracking instrumentation shared with MBTA object
+        self.metrics = Metrics()
+        self.readMetricsSettings()
+
+        # MBTA object to handle api calls is made in background
+        self.loopThread = None
+        self.client = None
+        self.clientReady = threading.Event()
+        self.warmUp = None              # background warm up of shortcuts
+        self.executor = None            # runs prefetches, made on first use
+        self.prefetches = []            # futures for dialogue in progress
+        self.stopFutures = []           # stop lists being read for current route
+        self.requestTime = None         # when last answer needed for request was heard
 
         self.routeName = None           # bus route
         self.requestTracking = False    # True => last request was for tracking, not arrivals
@@ -48,25 +72,146 @@ class MbtaBusTracking(MycroftSkill):
         self.stopName = None            # bus stop
         self.dirName = None             # direction of travel
         self.destName = None            # terminus for direction
-        self.savedRoutes = dict()       # routes saved to disk
-        self.trackingInterval = max(30, (self.settings.get('trackingUpateFreq', 30))) # enforce min tracking updates
+        self.stopRetried = False        # True => already asked again for stop
+        self.routeNamesAdded = False    # True => spoken route names are in vocabulary
+        self.readTrackingSettings()
 
         # watch for changes on HOME
         self.settings_change_callback = self.on_websettings_changed
 
-      # try to read saved routes
-        try:
-            with self.file_system.open(ROUTE_FILE , 'rb') as f:
-                self.savedRoutes =  pickle.load(f)
+        # saved routes, read from disk as they are used
+        self.shortcuts = ShortcutStore(os.path.join(self.file_system.path, SHORTCUT_FILE))
+
+        threading.Thread(target=self.startup, daemon=True).start()
+
+    # slow part of initialize, run in background
+    # intents wait for the MBTA object if it is not ready yet
+    def startup(self):
+
+      try:
+
+        self.client = self.makeClient()
+
+      except Exception as e:
+
+        # blocking client needs nothing optional, skill still works
+        self.log.error('MBTA skill could not create client: {}'.format(e))
+
+        from . mbta import MBTA
+
+        self.client = MBTA(self.apiKey, self.settings.get('maxTrack', 3),
+                           fileSystem=self.file_system, catalog=self.catalog,
+                           apiUrl=self.apiUrl(), metrics=self.metrics)
+
+      finally:
+
+        self.clientReady.set()
+
+      # import shortcuts saved by earlier versions
+      try:
+        count = self.shortcuts.migrate(os.path.join(self.file_system.path, ROUTE_FILE))
+        if count > 0:
+          self.log.info('MBTA skill imported {} saved routes'.format(count))
+      except Exception as e:
+        self.log.error('MBTA skill could not import saved routes: {}'.format(e))
+
+      # make a vocabulary from saved routes, names are read in one query
+      for s in self.shortcuts.names():
+        self.register_vocabulary(s, 'SavedRouteNames')
+
+      self.addRouteNames()
+
+      self.readWarmUpSettings()
+
+    # add route names as words, "fifty seven a", to those in Route.Name.voc
+    # only routes at hand are used, if none are they are added once
+    # a route has been read for a request
+    def addRouteNames(self):
+
+      try:
+
+        names = self.t.getSpokenRouteNames()
+
+        for name in names:
+          self.register_vocabulary(name, 'Route.Name')
+
+        self.routeNamesAdded = len(names) > 0
+
+      except Exception as e:
+        self.log.error('MBTA skill could not add route names: {}'.format(e))
+
+    # create MBTA object to handle api calls
+    def makeClient(self):
+
+      retVal = None
+
+      if self.settings.get('asyncClient'):
 
-            # make a vocabulary from saved routes
-            if self.savedRoutes:
-              for s in self.savedRoutes:
-                  self.register_vocabulary(s, 'SavedRouteNames')
+        from . asyncmbta import AsyncMBTA, LoopThread, LoopDriver
 
-        except:
-            pass
+        if AsyncMBTA.available():
 
+          # asyncio client driven from its own event loop thread
+          self.loopThread = LoopThread()
+          retVal = LoopDriver(AsyncMBTA(self.apiKey,self.settings.get('maxTrack', 3),
+                                        fileSystem=self.file_system,
+                                        catalog=self.catalog,
+                                        apiUrl=self.apiUrl(),
+                                        metrics=self.metrics,
+                                        spokenRoutes=self.spokenRoutes()),
+                              self.loopThread)
+
+      if retVal == None:
+
+        from . mbta import MBTA
+
+        retVal = MBTA(self.apiKey,self.settings.get('maxTrack', 3),
+                      fileSystem=self.file_system, catalog=self.catalog,
+                      apiUrl=self.apiUrl(), metrics=self.metrics,
+                      spokenRoutes=self.spokenRoutes())
+
+      return retVal
+
+    # route names as the skill's vocabulary lists them
+    def spokenRoutes(self):
+
+      from . routegrammar import readVoc
+
+      return readVoc(os.path.join(self.root_dir, 'vocab', self.lang, 'Route.Name.voc'))
+
+    # server API calls are sent to, a shared proxy if one is set
+    def apiUrl(self):
+
+      from . mbta import API_URL
+
+      return self.settings.get('apiUrl') or API_URL
+
+    # MBTA object, waits for it if skill is still starting
+    @property
+    def t(self):
+
+      self.clientReady.wait()
+
+      return self.client
+
+    # close connections to the API when skill is unloaded
+    def shutdown(self):
+
+      self.endTracking()
+      self.cancelPrefetch()
+
+      if self.executor != None:
+        self.executor.shutdown(wait=False)
+
+      if self.warmUp != None:
+        self.warmUp.stop()
+
+      self.t.close()
+      self.shortcuts.close()
+      self.metrics.export()
+
+      if self.loopThread != None:
+        self.loopThread.stop()
 
     # handle change of setting on home
     def on_websettings_changed(self):
@@ -86,81 +231,207 @@ class MbtaBusTracking(MycroftSkill):
       self.t.updateSettings(self.apiKey,self.settings.get('maxTrack', 3))
 
       # get tracking interval
+      self.readTrackingSettings()
+      self.readMetricsSettings()
+
+      # GTFS feed may have changed
+      self.importCatalog()
+
+      self.readWarmUpSettings()
+
+    # import GTFS feed named in settings if it is newer than catalog
+    # import runs in background, catalog is swapped in when done
+    def importCatalog(self):
+
+      feedPath = self.settings.get('gtfsFeed')
+
+      if feedPath and os.path.exists(feedPath):
+
+        if (not self.catalog.available() or
+            os.path.getmtime(feedPath) > os.path.getmtime(self.catalog.dbPath)):
+
+          threading.Thread(target=self._importCatalog, args=(feedPath,), daemon=True).start()
+
+    def _importCatalog(self, feedPath):
+
+      from . gtfs import importFeed
+
+      try:
+        count = importFeed(feedPath, self.catalog.dbPath)
+        self.log.info('MBTA skill imported {} routes from {}'.format(count, feedPath))
+      except Exception as e:
+        self.log.error('MBTA skill could not import GTFS feed: {}'.format(e))
+
+    # read tracking update settings
+    def readTrackingSettings(self):
+
       self.trackingInterval = max(30, (self.settings.get('trackingUpateFreq', 30))) # enforce min tracking updates
 
+      # adaptive tracking polls between floor and ceiling seconds
+      self.adaptiveTracking = self.settings.get('adaptiveTracking', True)
+      self.trackingFloor = max(MIN_POLL_SECS, self.settings.get('trackingFloor', 30))
+      self.trackingCeiling = max(self.trackingFloor, self.settings.get('trackingCeiling', 300))
 
-    # speak list of passed arrival times
-    def announceArrivals(self,eta):
+    # start or stop warm up of shortcuts as selected in settings
+    def readWarmUpSettings(self):
 
-      # get current datetime for east coast without timecode
-      currentTime = datetime.datetime.now((timezone('America/New_York'))).replace(tzinfo=None)
+      if self.settings.get('warmUp') and self.warmUp == None:
 
-      # build datetime objets from strings in predection list
-      # strip timezone first since we cannot count on fromisoformat() being available (3.7+)
-      eta = [datetime.datetime.strptime(x[0:TZ_STR_IDX], '%Y-%m-%dT%H:%M:%S') for x in eta]
+        self.warmUp = WarmUp(self.t, self.shortcuts, [], self.log)
+        self.warmUp.start()
 
-      # calculate waiting times
-      wt = [x-currentTime for x in eta if x > currentTime]
+      elif not self.settings.get('warmUp') and self.warmUp != None:
 
-      arrivalCount = len(wt)
+        self.warmUp.stop()
+        self.warmUp = None
 
-      # speak prefix if necessary
-      if arrivalCount > 0:
+      # predictions are only prefetched during commute windows
+      if self.warmUp != None:
+        self.warmUp.windows = parseWindows(self.settings.get('commuteWindows'))
 
-        # add stop to prefix string
-        prefix = {'stop': self.stopName}
+    # where metrics are exported, summary is always logged
+    # and written in Prometheus format to file named in settings
+    def readMetricsSettings(self):
 
-        # might be updating arrivals while Mycroft is speaking, so wait
-        wait_while_speaking()
+      self.metrics.sinks = [LogSnapshot(self.log, METRICS_LOG_SECS)]
 
-        self.speak_dialog("Bus.Arrival.Prefix", prefix)
+      if self.settings.get('metricsFile'):
+        self.metrics.addSink(PrometheusFile(self.settings.get('metricsFile')))
 
-        for waitTime in wt:
+    # seconds until next tracking poll, from predicted arrivals of
+    # tracked buses with adaptive tracking, otherwise fixed interval
+    def nextPollDelay(self):
 
-          # wait for previous arrival announcement to finish
-          wait_while_speaking()
+      retVal = self.trackingInterval
 
-          # calculate hour and minutes from datetime timedelta seconds
-          arrival = {
-             'hour': waitTime.seconds // 3600,
-             'minutes' : (waitTime.seconds % 3600) // 60
-          }
+      if self.adaptiveTracking:
+        trackers = self.t.getTrackers()
+        retVal = pollDelay([t.eta for t in trackers], self.trackingFloor, self.trackingCeiling,
+                           max([t.drift for t in trackers], default=0))
 
-          #  one hour or longer
-          if (arrival['hour'] > 0):
+      return retVal
 
-            # round down to one hour if only one minute over
-            if(arrival['minutes'] < 2 ):
+    # schedule next tracking poll
+    def scheduleTracking(self):
 
-              self.speak_dialog("Arriving.Hour", arrival )
+      self.cancel_scheduled_event('BusTracker')
+      self.schedule_event(self.updateTracking,
+                          self.nextPollDelay(),
+                          name='BusTracker')
 
-            else:
+    # run fn in background for the dialogue in progress
+    # return future, cancelled if the dialogue is abandoned
+    def prefetch(self, fn, *args):
 
-              # arrives in 1 hour and some minutes
+      if self.executor == None:
+        from concurrent.futures import ThreadPoolExecutor
+        self.executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
 
-              self.speak_dialog("Arriving.Hour.Minutes", arrival )
+      future = self.executor.submit(fn, *args)
+      self.prefetches = [f for f in self.prefetches if not f.done()] + [future]
 
-          elif arrival['minutes'] > 1:
+      return future
 
-            # arrives in more than one minute
+    # drop background work of an abandoned dialogue
+    # work already running is left to finish
+    def cancelPrefetch(self):
 
-            self.speak_dialog("Arriving.Minutes", arrival )
+      for future in self.prefetches:
+        future.cancel()
 
-          elif arrival['minutes'] == 1:
+      self.prefetches = []
+      self.stopFutures = []
 
-            # arrives in one minute
+    # wait for stop lists of current route being read in background
+    def awaitStops(self):
 
-            self.speak_dialog("Arriving.Minute", arrival )
+      if len(self.stopFutures) > 0:
+        from concurrent.futures import wait
+        wait(self.stopFutures)
 
-          else:
+    # record time from last answer of a request to first arrival spoken
+    def arrivalSpoken(self):
+
+      if self.requestTime != None:
+
+        secs = time.monotonic() - self.requestTime
+        self.requestTime = None
+
+        self.metrics.observe('mbta_time_to_first_arrival_seconds', secs)
+        self.log.debug('MBTA first arrival spoken after {:.2f}s'.format(secs))
+
+    # speak one wait, an (hour, minutes) tuple
+    def speakWait(self, waitTime):
+
+      arrival = {
+         'hour': waitTime[0],
+         'minutes' : waitTime[1]
+      }
+
+      #  one hour or longer
+      if (arrival['hour'] > 0):
+
+        # round down to one hour if only one minute over
+        if(arrival['minutes'] < 2 ):
+
+          self.speak_dialog("Arriving.Hour", arrival )
+
+        else:
+
+          # arrives in 1 hour and some minutes
 
-            # arrives in less than a minute
-            self.speak_dialog("Arriving.Now")
+          self.speak_dialog("Arriving.Hour.Minutes", arrival )
+
+      elif arrival['minutes'] > 1:
+
+        # arrives in more than one minute
+
+        self.speak_dialog("Arriving.Minutes", arrival )
+
+      elif arrival['minutes'] == 1:
+
+        # arrives in one minute
+
+        self.speak_dialog("Arriving.Minute", arrival )
+
+      else:
+
+        # arrives in less than a minute
+        self.speak_dialog("Arriving.Now")
+
+    # speak list of passed arrival times, epoch seconds
+    # stop name defaults to stop of current request
+    # prefix is dialog spoken before the times
+    def announceArrivals(self,eta,stopName=None,prefix="Bus.Arrival.Prefix"):
+
+      # hours and minutes to wait, arrivals in the past are dropped
+      wt = waitBuckets(eta)
+
+      arrivalCount = len(wt)
+      self.metrics.inc('mbta_announced_arrivals_total', arrivalCount)
+
+      # speak prefix if necessary
+      if arrivalCount > 0:
+
+        # add stop to prefix string
+        stopInfo = {'stop': stopName or self.stopName}
+
+        # might be updating arrivals while Mycroft is speaking, so wait
+        wait_while_speaking()
+
+        self.speak_dialog(prefix, stopInfo)
+        self.arrivalSpoken()
+
+        for waitTime in wt:
+
+          # wait for previous arrival announcement to finish
+          wait_while_speaking()
 
+          self.speakWait(waitTime)
 
         return arrivalCount
 
-    # call to stop tracking
+    # call to stop all tracking
     def endTracking(self):
 
         # stop updates
@@ -169,23 +440,69 @@ class MbtaBusTracking(MycroftSkill):
         # tell T object that we are no longer tracking
         self.t.stopTracking()
 
+        self.metrics.export()
+
+    # speak changes to a tracking session since its last update
+    # only buses newly predicted and arrivals that moved by a minute
+    # or more are spoken, buses that have left get one short line
+    def announceChanges(self, tracker):
+
+      diff = tracker.diff
+
+      if len(diff.departed) > 0:
+
+        wait_while_speaking()
+        self.speak_dialog("Bus.Departed", {'stop': tracker.stopName})
+
+      # arrival times reported for the trips, in arrival order
+      changed = sorted(tracker.trips[t] for t in diff.added + diff.changed)
+
+      if len(changed) > 0:
+        self.announceArrivals(changed, tracker.stopName, "Tracking.Changed")
+
     # calllback for tracking updates
+    # all tracking sessions are updated with one API call
+    # a session is only announced when a bus was added or has
+    # gone, or a predicted arrival moved by a minute or more
     def updateTracking(self):
 
-      # get predictions
-      eta = self.t.updateTracking()
+      start = time.perf_counter()
 
-      # if any arrivals predicted for our stop
-      if eta != None:
+      # get predictions for each session
+      for tracker, eta in self.t.updateTrackers():
 
-        # speak times
-        self.announceArrivals(eta)
+        # if any arrivals predicted for the session's stop
+        # speak changes, otherwise last tracked bus has passed
+        if eta != None and not tracker.diff.empty():
+          self.announceChanges(tracker)
+          self.metrics.inc('mbta_tracking_updates_total', result='announced')
+        elif eta != None:
+          self.metrics.inc('mbta_tracking_updates_total', result='unchanged')
 
-      else:
+      self.metrics.observe('mbta_tracking_tick_seconds', time.perf_counter() - start)
 
-        # last tracked bus has passed the stop, end updates
+      # size of tracking poll, see t.getTransferStats() for totals
+      self.log.debug('MBTA tracking poll received {} bytes'.format(self.t.lastBytes))
+
+      # all tracked buses have passed, end updates
+      if self.t.trackerCount() == 0:
         self.endTracking()
+      else:
+        self.metrics.export()
+        self.scheduleTracking()
+
 
+    # callback for streamed tracking updates
+    # only called when an arrival time changes
+    def streamUpdate(self, tracker, eta):
+
+      # speak changes unless last tracked bus has passed
+      if eta != None:
+        self.announceChanges(tracker)
+
+      # all tracked buses have passed, end updates
+      if self.t.trackerCount() == 0:
+        self.endTracking()
 
     # call to start tracking arrivals
     # after route, direction and stop have been set
@@ -200,11 +517,13 @@ class MbtaBusTracking(MycroftSkill):
           # speak times
           self.announceArrivals(eta)
 
-          # schedule updates
-          self.schedule_repeating_event(self.updateTracking,
-                                        None,
-                                        self.trackingInterval,
-                                        name='BusTracker')
+          # stream updates instead of polling if selected in settings
+          # sessions whose stream is down are still polled
+          if self.settings.get('streamTracking'):
+            self.t.streamTrackers(self.streamUpdate)
+
+          # schedule updates, one event polls every session
+          self.scheduleTracking()
         else:
 
           # no buses running
@@ -215,8 +534,8 @@ class MbtaBusTracking(MycroftSkill):
     # stop have been set
     def getArrivals(self):
 
-      # ask API for arrival times
-      eta = self.t.getArrivals()
+      # ask API for arrival times while service is announced
+      arrivals = self.prefetch(self.t.getArrivals)
 
       # begin arrival announcments
       announcement = {
@@ -225,6 +544,14 @@ class MbtaBusTracking(MycroftSkill):
                       }
       self.speak_dialog("Service.Announcement",announcement)
 
+      from concurrent.futures import CancelledError
+
+      try:
+        eta = arrivals.result()
+      except CancelledError:
+        # dialogue was stopped while service was announced
+        return
+
       # speak arrival times if we got any
       if eta != None:
         self.announceArrivals(eta)
@@ -233,52 +560,155 @@ class MbtaBusTracking(MycroftSkill):
         self.speak_dialog("No.buses.Found",stopInfo)
 
 
-    # write route to file
-    def writeRoutes(self):
+    # latitude, longitude of device from settings, otherwise the
+    # location set for the device on home, None if neither is set
+    def deviceLocation(self):
+
+      retVal = None
+
+      try:
+
+        if self.settings.get('latitude') and self.settings.get('longitude'):
+
+          retVal = (float(self.settings.get('latitude')), float(self.settings.get('longitude')))
+
+        else:
+
+          coordinate = (self.location or dict()).get('coordinate') or dict()
+
+          if coordinate.get('latitude') != None and coordinate.get('longitude') != None:
+            retVal = (float(coordinate['latitude']), float(coordinate['longitude']))
+
+      except (TypeError, ValueError):
+        retVal = None
+
+      return retVal
+
+    # speak next arrival of each route stopping near the device
+    def getNearbyArrivals(self, location):
+
+      nearby = self.t.getNearbyArrivals(*location)
+
+      if self.t.callError():
+
+        self.speak_dialog("Error.Calling.Server")
+
+      elif len(nearby) == 0:
+
+        self.speak_dialog("No.Nearby.Busses")
+
+      else:
+
+        for arrivals in nearby[:NEARBY_ROUTES]:
+
+          # arrivals already past are dropped
+          wt = waitBuckets(arrivals.arrivals)
+
+          if len(wt) > 0:
+
+            wait_while_speaking()
+
+            self.speak_dialog("Nearby.Route", {'route': arrivals.route.short_name,
+                                               'dest': arrivals.route.dest[arrivals.direction],
+                                               'stop': arrivals.stop.name})
+            self.arrivalSpoken()
+
+            wait_while_speaking()
+            self.speakWait(wt[0])
+
+    # speak next arrival of every route at the stop best matching
+    # stop name, asking for the stop again if not sure we heard it
+    # of stops with that name, those closest to the device are used
+    def getBoard(self, stopName, retried=False):
+
+      stops = self.t.matchAnyStop(stopName, self.deviceLocation())
 
-        # open file in /home/pi/.mycroft/skills
-        with self.file_system.open(ROUTE_FILE , 'wb') as f:
+      if self.t.callError():
 
-          # serialize dictionary
-          pickle.dump(self.savedRoutes, f, pickle.HIGHEST_PROTOCOL)
+        self.speak_dialog("Error.Calling.Server")
+
+      elif len(stops) == 0 or self.t.getStopConfidence() < MIN_STOP_CONFIDENCE:
+
+        stopName = None if retried else self.get_response('Which.Stop')
+
+        if stopName:
+          self.getBoard(stopName, True)
+        else:
+          self.speak_dialog("Board.Stop.Not.Found")
+
+      else:
 
+        board = self.t.getBoard(stops)
+
+        if self.t.callError():
+
+          self.speak_dialog("Error.Calling.Server")
+
+        elif len(board) == 0:
+
+          self.speak_dialog("No.Busses.Found", {'name': stops[0].name})
+
+        else:
+
+          wait_while_speaking()
+          self.speak_dialog("Board.Prefix", {'stop': stops[0].name})
+          self.arrivalSpoken()
+
+          for row in board[:BOARD_ROUTES]:
+
+            # arrivals already past are dropped
+            wt = waitBuckets(row.arrivals)
+
+            if len(wt) > 0:
+
+              wait_while_speaking()
+              self.speak_dialog("Board.Route", {'route': row.route.short_name,
+                                                'dest': row.destination()})
+
+              wait_while_speaking()
+              self.speakWait(wt[0])
 
     # save the current route as a shortcut
+    # return True if there was a route to save
     def saveRoute(self, name):
 
-        # add current route to saved routes dictionary
-        self.savedRoutes[name] = self.t.getRouteSettings()
+        settings = self.t.getRouteSettings()
 
-        # write it to disk
-        self.writeRoutes()
+        # only this shortcut is written to disk
+        if settings != None:
 
-        # add to vocabulary
-        self.register_vocabulary(name, 'SavedRouteNames')
+          self.shortcuts.save(name, settings)
 
+          # add to vocabulary
+          self.register_vocabulary(name, 'SavedRouteNames')
 
-    # remove saved route from file
+        return settings != None
+
+
+    # remove saved route from disk
     def removeRoute(self, name):
 
-      # if route is in dict, remove and save
-      if self.savedRoutes.pop(name, None) != None:
-        self.writeRoutes()
+      self.shortcuts.remove(name)
 
     # try to restore route with passed name, return True if successful
     def restoreRoute(self, name):
 
       retVal = False
 
-
       # look up route associated with this name
-      restoredRoute = self.savedRoutes.get(name)
+      restoredRoute = self.shortcuts.get(name)
 
-      # if we got one
-      if restoredRoute != None:
+      # set up API class if we got one, route is looked up
+      # by its id and may no longer run
+      routeName = None if restoredRoute == None else self.t.restoreRoute(restoredRoute)
 
-        # set up API class with copy of route object
-        self.routeName = self.t.restoreRoute(copy.deepcopy(restoredRoute))
+      if routeName:
+
+        # most used shortcuts are warmed up first
+        self.shortcuts.used(name)
 
         # set class variables
+        self.routeName = routeName
         self.stopName = self.t.getStopName()
         self.dirName, self.destName = self.t.getDirDest()
 
@@ -290,24 +720,27 @@ class MbtaBusTracking(MycroftSkill):
     # and get directions for route
     def setRouteAndDirection(self, routeName):
 
-        # Silver Line and Crosstown must be abreviated for API calls
-        routeName = routeName.replace('crosstown ','CT')
-        routeName = routeName.replace('silverline ','SL')
+        # tell API which route we are riding, words heard such as
+        # "silverline to" are resolved to a route name like SL2
+        self.routeName = self.t.setSpokenRoute(routeName)
 
-        # quirks fround in testing
-        routeName = routeName.replace('to', '2')
-        routeName = routeName.replace('for', '4')
+        # read directions for this route
+        if self.routeName:
 
-        # convert any alpha characters to uppercase
-        routeName = routeName.upper()
+          from . governor import BACKGROUND
 
-        # tell API which route we are riding
-        self.routeName = self.t.setRoute(routeName)
+          # routes were not at hand when skill started
+          if not self.routeNamesAdded:
+            self.routeNamesAdded = True
+            threading.Thread(target=self.addRouteNames, daemon=True).start()
 
-        # read directions for this route
-        if self.routeName:
           self.directions = self.t.getDirections()
 
+          # read stops for both directions while user picks one, a
+          # failure is not reported, stops are read again when needed
+          self.stopFutures = [self.prefetch(self.t.loadStops, self.t.getRouteId(), d, BACKGROUND)
+                              for d in range(len(self.directions))]
+
         return self.routeName
 
     # prompt for direction
@@ -329,6 +762,8 @@ class MbtaBusTracking(MycroftSkill):
       # if we got a direction, carry on
       if directionUtterance != None:
           self.handle_direction_intent(directionUtterance)
+      else:
+          self.cancelPrefetch()
 
     # prompt for stop
     def setStop(self):
@@ -338,6 +773,8 @@ class MbtaBusTracking(MycroftSkill):
       # if we got a stop name, handle the utterance
       if stopUtterance != None:
           self.handle_stop_intent(stopUtterance)
+      else:
+          self.cancelPrefetch()
 
     # remove all contexts we may have set
     def removeContexts(self):
@@ -350,14 +787,16 @@ class MbtaBusTracking(MycroftSkill):
       # may have set context in previous call
       self.removeContexts()
 
-      # may already be tracking
-      self.endTracking()
+      # previous dialogue may have been abandoned
+      self.cancelPrefetch()
+      self.requestTime = time.monotonic()
 
       # init class variables
       self.routeName = None
       self.dirName = None
       self.destName = None
       self.stopName = None
+      self.stopRetried = False
       self.requestTracking = tracking
 
       # get fields from utterance
@@ -393,6 +832,7 @@ class MbtaBusTracking(MycroftSkill):
       # only accept stop name if we have route and direction
       if routeName and direction and stop:
 
+        self.awaitStops()
         self.stopName = self.t.setStop(stop)
         #print('Direction set to {} toward {} at {}'.format(self.dirName,self.destName,self.stopName))
 
@@ -470,9 +910,18 @@ class MbtaBusTracking(MycroftSkill):
     # set stop
     def handle_stop_intent(self, message):
 
-      # set stop from utterance
+      self.requestTime = time.monotonic()
+
+      # set stop from utterance, stops may still be read in background
+      self.awaitStops()
       self.stopName = self.t.setStop(message)
 
+      # not sure we heard the stop correctly, ask one more time
+      if self.t.getStopConfidence() < MIN_STOP_CONFIDENCE and not self.stopRetried:
+        self.stopRetried = True
+        self.setStop()
+        return
+
       # good to go - list arrivals or start tracking
       if self.requestTracking:
        self.startTracking()
@@ -505,6 +954,41 @@ class MbtaBusTracking(MycroftSkill):
       # process tracking request
       self.processRequest(message, True)
 
+    # arrivals at stops near the device
+    @intent_handler(IntentBuilder('')
+        .require('T.Bus')
+        .require('Arrivals')
+        .require('Nearby').build())
+    def handle_nearby_arrivals_intent(self, message):
+
+      location = self.deviceLocation()
+
+      if location == None:
+
+        # nowhere to look for stops
+        self.speak_dialog("No.Location")
+
+      else:
+
+        self.requestTime = time.monotonic()
+        self.getNearbyArrivals(location)
+
+    # every route coming to a stop
+    @intent_handler(IntentBuilder('')
+        .require('T.Bus')
+        .require('Board')
+        .optionally('BoardStop').build())
+    def handle_board_intent(self, message):
+
+      # previous dialogue may have been abandoned
+      self.cancelPrefetch()
+      self.requestTime = time.monotonic()
+
+      stopName = message.data.get("BoardStop", None) or self.get_response('Which.Stop')
+
+      if stopName:
+        self.getBoard(stopName)
+
     # save shortcut
     @intent_handler(IntentBuilder('')
         .require('Save').require('T.Bus').require('Shortcut').build())
@@ -520,10 +1004,14 @@ class MbtaBusTracking(MycroftSkill):
         if shortcutName:
 
           # save route under passed name
-          self.saveRoute(shortcutName)
+          if self.saveRoute(shortcutName):
+
+            shortcutInfo = {'shortcut': shortcutName}
+            self.speak_dialog("Save.Complete", shortcutInfo)
+
+          else:
 
-          shortcutInfo = {'shortcut': shortcutName}
-          self.speak_dialog("Save.Complete", shortcutInfo)
+            self.speak_dialog("Not.Enough.Info")
 
       else:
 
@@ -550,7 +1038,7 @@ class MbtaBusTracking(MycroftSkill):
         .require('List').require('T.Bus').require('Shortcuts').build())
     def handle_list_saved_route_intent(self, message):
       # build list of rotue names
-      routeList = [s for s in self.savedRoutes]
+      routeList = self.shortcuts.names()
 
       if len(routeList) > 0:
 
@@ -567,13 +1055,13 @@ class MbtaBusTracking(MycroftSkill):
         .require('T.Bus').require('Tracking').optionally('Route').require('SavedRouteNames').build())
     def handle_saved_tracking_intent(self, message):
 
-      # may already be tracking
-      self.endTracking()
-
       # restore named route and start tracking
+      # sessions already being tracked continue
       routeName = message.data.get("SavedRouteNames", None)
-      self.restoreRoute(routeName)
-      self.startTracking()
+      self.requestTime = time.monotonic()
+
+      if self.restoreRoute(routeName):
+        self.startTracking()
 
     # arrivals for a saved route
     @intent_handler(IntentBuilder('')
@@ -584,14 +1072,10 @@ class MbtaBusTracking(MycroftSkill):
       shortCut = message.data.get("SavedRouteNames", None)
       # if shortcut has been deleted it will still be
       # in vocablulary until restart
+      self.requestTime = time.monotonic()
 
-      if self.savedRoutes.get(shortCut, None):
-
-        # may already be tracking
-        self.endTracking()
-
-         # restore route and list arrivals
-        self.restoreRoute(shortCut)
+      # restore route and list arrivals
+      if self.restoreRoute(shortCut):
         self.getArrivals()
 
     # stop tracking
@@ -602,8 +1086,9 @@ class MbtaBusTracking(MycroftSkill):
       # stop tracking
       self.endTracking()
 
-      # reset contexts
+      # reset contexts and abandon any dialogue in progress
       self.removeContexts()
+      self.cancelPrefetch()
 
       self.speak_dialog('Shutdown.Message')
 
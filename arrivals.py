@@ -0,0 +1,102 @@
+# Arrival times as epoch seconds
+#
+# The API gives arrival times as ISO 8601 strings with a UTC
+# offset.  They are parsed once, when predictions are read, into
+# integer seconds since the epoch using the offset in the string,
+# so wait times are a subtraction from time.time() and stay right
+# across daylight saving changes without a time zone lookup.  The
+# same strings come back on every tracking poll, so parses are cached.
+
+from array import array
+from functools import lru_cache
+import calendar
+import time
+
+PARSE_CACHE_SIZE = 2048   # arrival strings remembered, a few polls worth
+MIN_POLL_SECS = 15        # adaptive tracking never polls more often than this
+PASSED_MARGIN = 10        # seconds after last tracked bus is due to check it has passed
+NEAR_SECS = 300           # first bus is this close, poll as often as allowed
+DRIFT_MARGIN = 2          # times recent drift first bus may still come early by
+DRIFT_HALVES = 60         # seconds of drift that halve the longest delay
+
+
+# epoch seconds for ISO 8601 time like 2020-01-31T17:05:00-05:00
+# None if time is None
+@lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parseArrival(iso):
+
+  if iso == None:
+    return None
+
+  local = calendar.timegm((int(iso[0:4]), int(iso[5:7]), int(iso[8:10]),
+                           int(iso[11:13]), int(iso[14:16]), int(iso[17:19]), 0, 0, 0))
+
+  # offset follows seconds, Z or [+-]HH:MM
+  tz = iso[19:]
+
+  if tz and tz[0] in '+-':
+    offset = int(tz[1:3]) * 3600 + int(tz[4:6]) * 60
+    local -= offset if tz[0] == '+' else -offset
+
+  return local
+
+
+# compact array of arrival times
+def arrivalArray(times=()):
+  return array('q', times)
+
+
+# seconds to wait for each arrival not already past, in one pass
+def waitSeconds(etas, now=None):
+
+  now = int(time.time()) if now == None else now
+
+  return [t - now for t in etas if t > now]
+
+
+# hours and minutes to wait for each arrival not already past
+# return list of (hour, minutes) tuples
+def waitBuckets(etas, now=None):
+
+  return [(w // 3600, (w % 3600) // 60) for w in waitSeconds(etas, now)]
+
+
+# seconds until next tracking poll for arrival predictions of
+# each tracked session, polling between floor and ceiling seconds
+# drift is the seconds tracked arrivals recently moved between polls
+# poll at the floor once the first bus was predicted near, before
+# then early enough that it is not near yet even if it comes early
+# by twice the drift, and sooner the more predictions move, so
+# announcements stay current, poll right after a last tracked bus
+# is due so tracking stops as soon as it has passed
+def pollDelay(etaLists, floor, ceiling, drift=0, now=None):
+
+  firstWaits = []
+  lastWaits = []
+
+  for etas in etaLists:
+
+    wt = waitSeconds(etas or [], now)
+
+    if len(wt) > 0:
+      firstWaits.append(wt[0])
+      lastWaits.append(wt[-1])
+
+  if len(firstWaits) > 0:
+
+    first = min(firstWaits)
+
+    if first <= NEAR_SECS:
+      retVal = floor
+    else:
+      retVal = min(first - NEAR_SECS - drift * DRIFT_MARGIN, ceiling * DRIFT_HALVES / (DRIFT_HALVES + drift))
+      retVal = min(max(retVal, floor), ceiling)
+
+    retVal = min(retVal, min(lastWaits) + PASSED_MARGIN)
+
+  else:
+
+    # no arrivals ahead, check right away if buses have passed
+    retVal = MIN_POLL_SECS
+
+  return retVal
@@ -0,0 +1,519 @@
+# Handle MBTA API calls with asyncio
+#
+# AsyncMBTA has the same methods as MBTA but those that call
+# the API are coroutines, so several requests can be in flight
+# at once and any of them can be cancelled.  LoopThread runs
+# an event loop in a background thread and LoopDriver lets the
+# skill call AsyncMBTA as if it were the blocking MBTA class.
+
+from . mbta import MBTA, ROUTE_ARGS, BACKOFF_BASE, MAX_RATE_WAITS
+from . mbta import STOP_LOCATION_ARGS, NEARBY_STOPS, NEARBY_METERS
+from . governor import INTERACTIVE, BACKGROUND
+from . stopindex import StopIndex
+import threading
+import asyncio
+import random
+import time
+
+try:
+  import aiohttp
+except ImportError:
+  aiohttp = None
+
+DEADLINE = 15   # seconds allowed for a request, including retries but not rate limit waits
+
+
+class AsyncMBTA(MBTA):
+
+  def __init__(self, apiKey, trackCount, deadline=DEADLINE, **kwargs):
+
+    self.headers = dict()         # headers sent on every request
+    self.aioSession = None        # created on first request, inside event loop
+    self.tasks = set()            # background tasks, cancelled on close
+    self.deadline = deadline      # seconds allowed for each request
+
+    MBTA.__init__(self, apiKey, trackCount, **kwargs)
+
+  # aiohttp is optional, check before creating client
+  @staticmethod
+  def available():
+    return aiohttp != None
+
+  # no requests session, aiohttp session is made when loop is running
+  def _makeSession(self):
+
+    self.headers = {'Accept': 'application/vnd.api+json'}
+    self._setKeyHeader()
+
+    return None
+
+  # add or remove API key header
+  def _setKeyHeader(self):
+
+    if self.apiKey:
+      self.headers['x-api-key'] = self.apiKey
+    else:
+      self.headers.pop('x-api-key', None)
+
+  # headers sent with every request
+  def _requestHeaders(self):
+    return dict(self.headers)
+
+  # session for all calls to the API, connections are kept alive
+  def _getSession(self):
+
+    if self.aioSession == None or self.aioSession.closed:
+
+      timeout = aiohttp.ClientTimeout(sock_connect=self.timeout[0],
+                                      sock_read=self.timeout[1])
+
+      self.aioSession = aiohttp.ClientSession(
+                          connector=aiohttp.TCPConnector(limit=4),
+                          timeout=timeout)
+
+    return self.aioSession
+
+  # wait before retrying a request
+  # exponential backoff with full jitter
+  async def _backoff(self, attempt):
+
+    await asyncio.sleep(random.uniform(0, BACKOFF_BASE * (2 ** attempt)))
+
+  # run coroutine in background, it is cancelled on close
+  def _background(self, coro):
+
+    task = asyncio.ensure_future(coro)
+    self.tasks.add(task)
+    task.add_done_callback(self.tasks.discard)
+
+    return task
+
+  # close session and cancel background work
+  async def close(self):
+
+    for task in list(self.tasks):
+      task.cancel()
+
+    if self.aioSession != None:
+      await self.aioSession.close()
+
+  # wait until rate limit budget has a token for priority, the
+  # governor's file is read and written off the event loop
+  async def _acquire(self, priority=INTERACTIVE):
+
+    loop = asyncio.get_event_loop()
+    wait = await loop.run_in_executor(None, self.governor.tryAcquire, priority)
+
+    while wait > 0:
+      await asyncio.sleep(wait)
+      wait = await loop.run_in_executor(None, self.governor.tryAcquire, priority)
+
+  # one HTTP exchange, return response and its body
+  # body is None unless the request succeeded
+  async def _exchange(self, api_url, headers):
+
+    async with self._getSession().get(api_url, headers=headers) as r:
+      return r, (await r.read() if r.status < 300 else None)
+
+  # send request to MBTA API at given endpoint with passed arguments
+  # exchanges and retries must be done in deadline seconds, time
+  # spent waiting for rate limit budget does not count
+  # return status, headers, decoded body (None when not modified)
+  async def _send(self, endPoint, args=None, headers=None, priority=INTERACTIVE,
+                  deadline=DEADLINE):
+
+    api_url = self._url(endPoint, args)
+
+    allHeaders = dict(self.headers, **(headers or {}))
+
+    loop = asyncio.get_event_loop()
+    attempt = 0
+    rateWaits = 0
+    spent = 0
+
+    while True:
+
+      await self._acquire(priority)
+
+      if spent >= deadline:
+        raise asyncio.TimeoutError()
+
+      start = time.perf_counter()
+
+      try:
+
+        r, raw = await asyncio.wait_for(self._exchange(api_url, allHeaders), deadline - spent)
+
+        self._recordRequest(endPoint, r.status, time.perf_counter() - start)
+        await loop.run_in_executor(None, self.governor.update, r.status, r.headers)
+
+        # rate limited, governor now waits for the window to reset
+        if r.status == 429 and rateWaits < MAX_RATE_WAITS:
+          rateWaits += 1
+          continue
+
+        # server errors may be transient, try again
+        if r.status >= 500 and attempt < self.maxRetries:
+          await self._backoff(attempt)
+          attempt += 1
+          continue
+
+        r.raise_for_status()
+
+        body = None if r.status == 304 else self._decode(endPoint, raw)
+
+        return r.status, r.headers, body
+
+      except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+
+        self._recordRequest(endPoint, None, time.perf_counter() - start)
+
+        # connection problems may be transient, try again
+        if attempt >= self.maxRetries or spent + time.perf_counter() - start >= deadline:
+          raise
+
+        await self._backoff(attempt)
+        attempt += 1
+
+      finally:
+
+        spent += time.perf_counter() - start
+
+  # send request, failing if deadline passes before it completes
+  async def _request(self, endPoint, args=None, headers=None, deadline=None,
+                     priority=INTERACTIVE):
+
+    return await self._send(endPoint, args, headers, priority, deadline or self.deadline)
+
+  # get data from MBTA API at given endpoint with passed arguments
+  async def _getData(self, endPoint, args=None, deadline=None, priority=INTERACTIVE):
+
+    retVal = None;
+
+    body = await self._getBody(endPoint, args, deadline, priority)
+
+    # check if we got any data before setting return value
+    if body != None and len(body['data']) > 0:
+      retVal = body['data']
+
+    return retVal
+
+  # get whole response document, data and any included resources
+  # return decoded body or None if the request failed
+  async def _getBody(self, endPoint, args=None, deadline=None, priority=INTERACTIVE):
+
+    retVal = None
+
+    # clear error flag
+    self._setError(priority, False)
+
+    try:
+
+      status, headers, body = await self._request(endPoint, args, deadline=deadline,
+                                                  priority=priority)
+
+      # a document without data is an error too
+      if 'data' in body:
+        retVal = body
+
+    except asyncio.CancelledError:
+
+      raise
+
+    except:
+      pass
+
+    # set error flag
+    self._setError(priority, retVal == None)
+
+    return retVal
+
+  # get info on all bus routes from server
+  # only changes since cached copy are sent
+  async def refreshRoutes(self, priority=INTERACTIVE):
+
+    try:
+
+      status, headers, body = await self._request('routes', ROUTE_ARGS,
+                                                  self._routeHeaders(),
+                                                  priority=priority)
+
+      self._updateRoutes(status, body, headers.get('Last-Modified'))
+
+    except asyncio.CancelledError:
+
+      raise
+
+    except:
+
+      self._routesFailed(priority)
+
+  # load route information, from disk if saved by a previous run
+  async def readRoutes(self, priority=INTERACTIVE):
+
+    # if route info has not been read yet
+    if( self.routeInfo == None ):
+
+      # clear error flag
+      self._setError(priority, False)
+
+      if not self._readLocalRoutes():
+
+        self.metrics.inc('mbta_cache_requests_total', cache='routes', result='miss')
+        await self.refreshRoutes(priority)
+
+    if self.routesUnchecked:
+      self._revalidateRoutes()
+
+  # check saved routes for changes without making caller wait
+  def _revalidateRoutes(self):
+
+    self.routesUnchecked = False
+    self._background(self.refreshRoutes(BACKGROUND))
+
+  # set current route based on passed name
+  # return route name or None
+  async def setRoute(self, routeName):
+
+    self.currentRoute = None;
+
+    # make certain routes are loaded
+    await self.readRoutes()
+
+    return(self._selectRoute(routeName))
+
+  # every way of saying every route the grammar knows
+  # routes are not asked of the server, run on the loop with the
+  # other calls that read routes
+  async def getSpokenRouteNames(self):
+
+    return MBTA.getSpokenRouteNames(self)
+
+  # set current route from route name as heard
+  # return route name or None
+  async def setSpokenRoute(self, spoken):
+
+    self.currentRoute = None;
+
+    # make certain routes are loaded
+    await self.readRoutes()
+
+    return(self._selectSpokenRoute(spoken))
+
+  # restore a SavedRoute
+  # return route name or None if route no longer runs
+  async def restoreRoute(self, saved):
+
+    # make certain routes are loaded
+    await self.readRoutes()
+
+    return(self._restoreRoute(saved))
+
+  # read stops for route in direction into cache
+  # return (stops dictionary, stop index)
+  async def loadStops(self, routeId, directionId, priority=INTERACTIVE):
+
+    key = (routeId, str(directionId))
+
+    # use stops from cache if we have them
+    cached = self._cachedStops(key)
+
+    if cached == None:
+
+      # use offline catalog if we have one, otherwise ask API for stops
+      stopList = self._catalogStops(key)
+
+      if stopList == None:
+        stopList = self._stopList(await self._getData('stops', self._stopArgs(*key),
+                                                      priority=priority))
+
+      cached = self._storeStops(key, stopList)
+
+    return cached
+
+  # read stops for several directions of a route at once
+  async def loadAllStops(self, routeId, directionIds):
+
+    return await asyncio.gather(*[self.loadStops(routeId, d) for d in directionIds])
+
+  # build dictionary of bus stops for current route in selected direction
+  async def getStops(self):
+
+    # no stops without a route
+    if self.currentRoute == None:
+      self.busStops, self.stopIndex = dict(), StopIndex([])
+    else:
+      self.busStops, self.stopIndex = await self.loadStops(self.currentRoute.id,
+                                                           self.currentDirection)
+
+    return(self.busStops)
+
+  # a bus stop name is passed, match to stop on route and set stop id
+  #  return name found
+  async def setStop(self, stopName):
+
+    await self.getStops()
+
+    return(self._matchStop(stopName))
+
+  # build spatial index of all bus stops, only done once
+  async def loadStopLocations(self):
+
+    retVal = self.stopGrid
+
+    if retVal == None:
+
+      locations = self._savedStopLocations()
+
+      if locations == None:
+        locations = self._stopLocationList(await self._getData('stops', STOP_LOCATION_ARGS))
+
+      retVal = self._buildStopGrid(locations)
+
+    return retVal
+
+  # stops nearest latitude, longitude as list of (meters, Stop)
+  async def nearbyStops(self, latitude, longitude, count=NEARBY_STOPS):
+
+    return (await self.loadStopLocations()).nearest(latitude, longitude, count, NEARBY_METERS)
+
+  # arrival predictions of every bus route stopping near latitude, longitude
+  # return list of NearbyArrivals, soonest arrival first
+  async def getNearbyArrivals(self, latitude, longitude):
+
+    retVal = []
+
+    await self.readRoutes()
+
+    nearby = await self.nearbyStops(latitude, longitude)
+
+    if len(nearby) > 0:
+      retVal = self._nearbyArrivals(nearby, await self._getData('predictions',
+                                                                self._nearbyArgs(nearby)))
+
+    return retVal
+
+  # match stop name against every bus stop
+  async def matchAnyStop(self, stopName, location=None):
+
+    return self._matchAnyStop(await self.loadStopLocations(), stopName, location)
+
+  # arrival predictions of every bus route at stops, in one request
+  # pass stops found by matchAnyStop
+  # return list of BoardRows, soonest arrival first
+  async def getBoard(self, stops):
+
+    retVal = []
+
+    if len(stops) > 0:
+      retVal = self._buildBoard(await self._getBody('predictions', self._boardArgs(stops)))
+
+    return retVal
+
+  # get arrival predictions for current route in the selected direcation at the chosen stop
+  # return (possibly empty) list of arrival time, trip id tuples
+  async def getPredictions(self):
+
+    # use predictions fetched ahead of time if they are recent
+    retVal = self._snapshotPredictions()
+
+    if retVal == None:
+
+      predictions = await self._getData('predictions', self._predictionArgs())
+
+      retVal = self._buildPredictions(predictions)
+
+    return(retVal)
+
+  # get predictions for several keys in one background request
+  async def prefetchPredictions(self, keys):
+
+    if len(keys) > 0:
+
+      body = await self._getBody('predictions', self._batchArgs(keys), priority=BACKGROUND)
+
+      if body != None:
+        self._storeSnapshots(keys, body['data'])
+
+  # return arrival predictions as list
+  async def getArrivals(self):
+
+    self.predTimes = await self.getPredictions()
+
+    return(self._arrivalTimes())
+
+  # begin tracking buses, return list of arrival predictions
+  async def startTracking(self):
+
+    self.predTimes = await self.getPredictions()
+
+    return(self._beginTracking())
+
+  # call periodically for current predictions of bus being tracked
+  async def updateTracking(self):
+
+    self.predTimes = await self.getPredictions()
+
+    return(self._continueTracking())
+
+  # one API call for current predictions of all tracking sessions
+  async def updateTrackers(self):
+
+    retVal = []
+
+    if len(self._polledTrackers()) > 0:
+
+      body = await self._getBody('predictions', self._trackerArgs(), priority=BACKGROUND)
+      self.metrics.inc('mbta_tracking_polls_total')
+
+      # keep sessions going if server could not be reached
+      if body != None:
+        retVal = self._applyTrackers(body['data'])
+
+    return retVal
+
+
+class LoopThread():
+
+  # start event loop in a background thread
+  def __init__(self):
+
+    self.loop = asyncio.new_event_loop()
+    self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+    self.thread.start()
+
+  # run coroutine on loop, wait for and return its result
+  # coroutine is cancelled if timeout passes
+  def run(self, coro, timeout=None):
+
+    future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    try:
+      return future.result(timeout)
+    except:
+      future.cancel()
+      raise
+
+  # stop loop, call after all work on it is done
+  def stop(self):
+
+    self.loop.call_soon_threadsafe(self.loop.stop)
+    self.thread.join()
+
+
+class LoopDriver():
+
+  # make coroutine methods of client blocking calls run on loop
+  def __init__(self, client, loopThread):
+
+    self.client = client
+    self.loopThread = loopThread
+
+  def __getattr__(self, name):
+
+    attr = getattr(self.client, name)
+
+    if asyncio.iscoroutinefunction(attr):
+      return lambda *args, **kwargs: self.loopThread.run(attr(*args, **kwargs))
+
+    return attr
@@ -0,0 +1,173 @@
+# Keep MBTA API calls inside the rate limit
+#
+# The API reports how many requests are left in the current
+# window in x-ratelimit-remaining and when the window resets in
+# x-ratelimit-reset.  A token bucket seeded from those headers is
+# kept in a small file so every skill instance and process on the
+# host using the same key and server draws from the same budget.
+# Background calls leave a few tokens for interactive ones, and calls
+# wait for the window to reset instead of failing when none are left.
+# If the file cannot be used, say another user owns it, the bucket
+# is kept in the process instead.
+
+import tempfile
+import threading
+import hashlib
+import logging
+import json
+import time
+import os
+
+try:
+  import fcntl
+except ImportError:
+  fcntl = None
+
+INTERACTIVE = 0     # user is waiting for the answer
+BACKGROUND = 1      # tracking polls, prefetch and revalidation
+
+DEFAULT_LIMIT = 20  # requests per window without an API key
+WINDOW_SECS = 60    # assumed window length until server tells us
+RESERVE = 2         # tokens background calls leave for interactive calls
+MAX_WAIT_SECS = 5   # longest single sleep while waiting for a token
+
+LOG = logging.getLogger(__name__)
+
+
+class RequestGovernor():
+
+  # governors already made, one per state file
+  governors = dict()
+  governorsLock = threading.Lock()
+
+  # governor shared by everything using passed API key with server
+  # at apiUrl, each server has its own limit - a local proxy's limit
+  # says nothing about what the proxy may ask of the MBTA
+  @classmethod
+  def forKey(cls, apiKey, apiUrl=''):
+
+    name = hashlib.sha1('{} {}'.format(apiUrl, apiKey or '').encode()).hexdigest()[:12]
+    path = os.path.join(tempfile.gettempdir(), 'mbta-ratelimit-{}.json'.format(name))
+
+    with cls.governorsLock:
+
+      if path not in cls.governors:
+        cls.governors[path] = RequestGovernor(path)
+
+      return cls.governors[path]
+
+  def __init__(self, path):
+
+    self.path = path                # state shared between processes
+    self.lock = threading.Lock()    # file lock does not exclude threads
+    self.waits = 0                  # times a call had to wait for a token
+    self.local = None               # state kept in process once file failed
+
+  # state of a full bucket
+  @staticmethod
+  def _newState():
+
+    return {'limit': DEFAULT_LIMIT, 'remaining': DEFAULT_LIMIT,
+            'reset': time.time() + WINDOW_SECS}
+
+  # run fn with state read from file, save state it changed
+  # state is kept in the process from the first time the file fails
+  def _update(self, fn):
+
+    with self.lock:
+
+      if self.local == None:
+
+        try:
+          return self._updateFile(fn)
+        except OSError as e:
+          LOG.warning('MBTA rate limit kept in process, cannot use {}: {}'.format(self.path, e))
+          self.local = self._newState()
+
+      return fn(self.local)
+
+  # run fn with state read from file, save state it changed
+  def _updateFile(self, fn):
+
+    with open(self.path, 'a+') as f:
+
+      if fcntl != None:
+        fcntl.flock(f, fcntl.LOCK_EX)
+
+      try:
+
+        f.seek(0)
+
+        try:
+          state = json.loads(f.read())
+        except ValueError:
+          state = self._newState()
+
+        retVal = fn(state)
+
+        f.seek(0)
+        f.truncate()
+        f.write(json.dumps(state))
+
+      finally:
+
+        if fcntl != None:
+          fcntl.flock(f, fcntl.LOCK_UN)
+
+    return retVal
+
+  # take a token if one is available for priority
+  # return 0 if we got one, otherwise seconds to wait before trying again
+  def tryAcquire(self, priority=INTERACTIVE):
+
+    def take(state):
+
+      now = time.time()
+
+      # window has reset, bucket is full again
+      if now >= state['reset']:
+        state['remaining'] = state['limit']
+        state['reset'] = now + WINDOW_SECS
+
+      floor = RESERVE if priority == BACKGROUND else 0
+
+      if state['remaining'] > floor:
+        state['remaining'] -= 1
+        return 0
+
+      return min(MAX_WAIT_SECS, max(state['reset'] - now, 0.1))
+
+    return self._update(take)
+
+  # wait until a token is available for priority
+  def acquire(self, priority=INTERACTIVE):
+
+    wait = self.tryAcquire(priority)
+
+    while wait > 0:
+      self.waits += 1
+      time.sleep(wait)
+      wait = self.tryAcquire(priority)
+
+  # seed bucket from rate limit headers of a response
+  def update(self, status, headers):
+
+    def seed(state):
+
+      try:
+
+        state['limit'] = int(headers.get('x-ratelimit-limit', state['limit']))
+        state['reset'] = float(headers.get('x-ratelimit-reset', state['reset']))
+
+        if 'x-ratelimit-remaining' in headers:
+          state['remaining'] = int(headers['x-ratelimit-remaining'])
+
+      except ValueError:
+        pass
+
+      # server says we are out, wait for reset
+      if status == 429:
+        state['remaining'] = 0
+
+    if status == 429 or 'x-ratelimit-remaining' in headers:
+      self._update(seed)
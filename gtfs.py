@@ -0,0 +1,233 @@
+# Offline catalog of MBTA bus routes and stops
+#
+# The MBTA publishes its schedule as a GTFS static feed, a zip of
+# csv files.  importFeed reads the bus routes, their direction names
+# and destinations and the stops served in each direction into an
+# indexed SQLite database.  The database is built beside the old one
+# and renamed over it, so a catalog in use always sees a complete feed.
+# GtfsCatalog answers the route and stop lookups MBTA would otherwise
+# ask the API for.
+
+from . model import Route, Stop
+from collections import defaultdict
+import threading
+import sqlite3
+import os
+
+BUS_ROUTE_TYPE = '3'                      # GTFS route_type for buses
+DEFAULT_DIRECTIONS = ('Outbound', 'Inbound')  # names when feed has no directions.txt
+
+SCHEMA = '''
+  CREATE TABLE meta (key TEXT PRIMARY KEY, value TEXT);
+  CREATE TABLE routes (id TEXT PRIMARY KEY, short_name TEXT, long_name TEXT,
+                       sort_order INTEGER);
+  CREATE TABLE directions (route_id TEXT, direction_id INTEGER, name TEXT,
+                           destination TEXT, PRIMARY KEY (route_id, direction_id));
+  CREATE TABLE stops (id TEXT PRIMARY KEY, name TEXT, lat REAL, lon REAL);
+  CREATE TABLE route_stops (route_id TEXT, direction_id INTEGER, seq INTEGER,
+                            stop_id TEXT);
+  CREATE INDEX route_stops_idx ON route_stops (route_id, direction_id, seq);
+'''
+
+
+# rows of csv file in feed as dictionaries, empty if file is missing
+def _readCsv(feed, name):
+
+  import csv
+  import io
+
+  if name not in feed.namelist():
+    return
+
+  with feed.open(name) as f:
+    for row in csv.DictReader(io.TextIOWrapper(f, encoding='utf-8-sig')):
+      yield row
+
+
+# choose one trip for each bus route and direction whose stops
+# represent the route, return dictionary of trip id -> (route id, direction id)
+def _representativeTrips(feed, routeIds):
+
+  trips = dict()
+  found = set()     # route, direction keys with a trip
+
+  # MBTA feeds mark the typical pattern of each route and direction
+  for row in _readCsv(feed, 'route_patterns.txt'):
+
+    if row['route_id'] in routeIds and row.get('route_pattern_typicality') == '1':
+
+      key = (row['route_id'], int(row['direction_id']))
+
+      if key not in found:
+        trips[row['representative_trip_id']] = key
+        found.add(key)
+
+  # otherwise use first trip found for each route and direction
+  if len(trips) == 0:
+
+    for row in _readCsv(feed, 'trips.txt'):
+
+      key = (row['route_id'], int(row.get('direction_id') or 0))
+
+      if row['route_id'] in routeIds and key not in found:
+        trips[row['trip_id']] = key
+        found.add(key)
+
+  return trips
+
+
+# import GTFS static zip at feedPath into catalog database at dbPath
+# return number of bus routes imported
+# zipfile and csv are only imported when a feed is imported
+def importFeed(feedPath, dbPath):
+
+  import zipfile
+
+  tmpPath = dbPath + '.tmp'
+
+  if os.path.exists(tmpPath):
+    os.remove(tmpPath)
+
+  db = sqlite3.connect(tmpPath)
+
+  try:
+
+    db.executescript(SCHEMA)
+
+    with zipfile.ZipFile(feedPath) as feed:
+
+      # bus routes
+      routes = [(r['route_id'], r['route_short_name'], r['route_long_name'],
+                 int(r.get('route_sort_order') or 0))
+                for r in _readCsv(feed, 'routes.txt')
+                if r['route_type'] == BUS_ROUTE_TYPE]
+      routeIds = {r[0] for r in routes}
+
+      db.executemany('INSERT INTO routes VALUES (?,?,?,?)', routes)
+
+      # direction names and destinations
+      db.executemany('INSERT OR REPLACE INTO directions VALUES (?,?,?,?)',
+                     [(r['route_id'], int(r['direction_id']), r['direction'],
+                       r['direction_destination'])
+                      for r in _readCsv(feed, 'directions.txt')
+                      if r['route_id'] in routeIds])
+
+      for routeId in routeIds:
+        for idx, name in enumerate(DEFAULT_DIRECTIONS):
+          db.execute('INSERT OR IGNORE INTO directions VALUES (?,?,?,?)',
+                     (routeId, idx, name, ''))
+
+      # stops in order for one trip of each route and direction
+      trips = _representativeTrips(feed, routeIds)
+      sequences = defaultdict(list)
+
+      for row in _readCsv(feed, 'stop_times.txt'):
+        if row['trip_id'] in trips:
+          sequences[row['trip_id']].append((int(row['stop_sequence']), row['stop_id']))
+
+      usedStops = set()
+
+      for tripId, stopTimes in sequences.items():
+
+        routeId, directionId = trips[tripId]
+
+        for seq, stopId in sorted(stopTimes):
+          db.execute('INSERT INTO route_stops VALUES (?,?,?,?)',
+                     (routeId, directionId, seq, stopId))
+          usedStops.add(stopId)
+
+      # names and locations of stops served by bus routes
+      db.executemany('INSERT INTO stops VALUES (?,?,?,?)',
+                     [(r['stop_id'], r['stop_name'],
+                       float(r['stop_lat'] or 0), float(r['stop_lon'] or 0))
+                      for r in _readCsv(feed, 'stops.txt')
+                      if r['stop_id'] in usedStops])
+
+      # remember which feed this is
+      for row in _readCsv(feed, 'feed_info.txt'):
+        db.execute('INSERT OR REPLACE INTO meta VALUES (?,?)', ('feed_version', row.get('feed_version', '')))
+
+    db.commit()
+
+  finally:
+
+    db.close()
+
+  # swap in new catalog
+  os.replace(tmpPath, dbPath)
+
+  return len(routes)
+
+
+class GtfsCatalog():
+
+  def __init__(self, dbPath):
+
+    self.dbPath = dbPath
+    self.db = None
+    self.version = None             # inode and modified time of database we opened
+    self.lock = threading.Lock()
+
+  # True if an imported catalog exists
+  def available(self):
+    return os.path.exists(self.dbPath)
+
+  # connection to catalog, reopened if a new feed was imported
+  def _connect(self):
+
+    st = os.stat(self.dbPath)
+    version = (st.st_ino, st.st_mtime)
+
+    if self.db == None or version != self.version:
+
+      if self.db != None:
+        self.db.close()
+
+      self.db = sqlite3.connect('file:{}?mode=ro'.format(self.dbPath), uri=True,
+                                check_same_thread=False)
+      self.version = version
+
+    return self.db
+
+  # run query on catalog, return all rows
+  def _query(self, sql, args=()):
+
+    with self.lock:
+      return self._connect().execute(sql, args).fetchall()
+
+  # version of imported feed, None if unknown
+  def feedVersion(self):
+
+    rows = self._query("SELECT value FROM meta WHERE key = 'feed_version'")
+
+    return rows[0][0] if rows else None
+
+  # dictionary of all bus routes in the form MBTA.readRoutes builds
+  def routeInfo(self):
+
+    dirs = defaultdict(list)
+    dest = defaultdict(list)
+
+    for routeId, name, destination in self._query(
+        'SELECT route_id, name, destination FROM directions ORDER BY route_id, direction_id'):
+
+      dirs[routeId].append(name)
+      dest[routeId].append(destination)
+
+    return {shortName: Route.make(routeId, shortName, longName, dirs[routeId], dest[routeId])
+            for routeId, shortName, longName in self._query(
+              'SELECT id, short_name, long_name FROM routes ORDER BY sort_order')}
+
+  # stops on route in direction as list of Stops in route order
+  def stops(self, routeId, directionId):
+
+    return [Stop.make(stopId, name) for stopId, name in
+            self._query('SELECT s.id, s.name FROM route_stops r JOIN stops s ON s.id = r.stop_id'
+                        ' WHERE r.route_id = ? AND r.direction_id = ? ORDER BY r.seq',
+                        (routeId, int(directionId)))]
+
+  # every bus stop with its location as list of (Stop, latitude, longitude)
+  def stopLocations(self):
+
+    return [(Stop.make(stopId, name), lat, lon) for stopId, name, lat, lon in
+            self._query('SELECT id, name, lat, lon FROM stops WHERE lat != 0 OR lon != 0')]
@@ -1,9 +1,47 @@
 # Handle MBTA API calls
 
-from mycroft.util.parse import match_one
+from . stopindex import StopIndex
+from . predstream import PredictionStream
+from . governor import RequestGovernor, INTERACTIVE, BACKGROUND
+from . stopgrid import StopGrid
+from . routegrammar import RouteGrammar
+from . model import Route, Stop, Prediction, SavedRoute, TripDiff, NearbyArrivals, BoardRow
+from . metrics import Metrics, COUNT_BUCKETS
+from . arrivals import arrivalArray
+from requests.adapters import HTTPAdapter
+from collections import OrderedDict, defaultdict
 import requests
+import threading
+import random
+import json
+import time
+import os
 import re
 
+API_URL = "https://api-v3.mbta.com"
+CONNECT_TIMEOUT = 3.05  # seconds to wait for a connection to the API server
+READ_TIMEOUT = 10       # seconds to wait for the API server to send data
+MAX_RETRIES = 2         # retries after a connection or server (5xx) error
+BACKOFF_BASE = 0.5      # seconds before first retry, doubled on each retry
+MAX_RATE_WAITS = 3      # times a rate limited (429) request is retried
+ROUTE_CACHE_FILE = 'routecache.json'  # route catalog saved between runs
+ROUTE_FIELDS = "fields[route]=short_name,long_name,direction_names,direction_destinations" # only route attributes we use
+ROUTE_ARGS = "filter[type]=3&sort=sort_order&" + ROUTE_FIELDS # all bus routes
+STOP_FIELDS = "fields[stop]=name"                    # only stop attributes we use
+PREDICTION_FIELDS = "fields[prediction]=arrival_time" # only prediction attributes we use
+PREDICTION_ARGS = "filter[direction_id]={}&filter[route]={}&filter[stop]={}&" + PREDICTION_FIELDS # one direction, route and stop
+STOP_CACHE_SIZE = 32    # max number of (route, direction) stop lists cached
+STOP_CACHE_TTL = 86400  # seconds a cached stop list is used before refetching
+CHANGE_SECS = 60        # a tracked arrival must move this much to be announced again
+DRIFT_DECAY = 0.9       # share of tracked arrival drift still counted after an update
+WARM_MAX_AGE = 90       # seconds prefetched predictions are used instead of asking the API
+STOP_LOCATION_FILE = 'stoplocations.json'  # locations of all bus stops saved between runs
+STOP_LOCATION_ARGS = "filter[route_type]=3&fields[stop]=name,latitude,longitude" # all bus stops
+STOP_LOCATION_TTL = 7 * 86400  # seconds saved stop locations are used before refetching
+NEARBY_STOPS = 8        # closest stops whose predictions are fetched for arrivals near the user
+NEARBY_METERS = 800     # stops farther than this from the user are not considered
+BOARD_METERS = 150      # stops of one name this close together are one board
+
 
 class MBTA():
 
@@ -15,9 +53,18 @@ class MBTA():
   # MassDOT or its agencies and authorities
 
 
-  def __init__(self, apiKey, trackCount):
+  def __init__(self, apiKey, trackCount, connectTimeout=CONNECT_TIMEOUT,
+               readTimeout=READ_TIMEOUT, maxRetries=MAX_RETRIES, fileSystem=None,
+               catalog=None, apiUrl=API_URL, metrics=None, spokenRoutes=()):
 
     self.routeInfo = None;        # dictionary with info on all bus routes
+    self.routesModified = None    # Last-Modified header of server route data
+    self.routesUnchecked = False  # routes read from saved copy not yet checked for changes
+    self.fileSystem = fileSystem  # skill file system, route catalog is cached here
+    self.catalog = catalog        # GtfsCatalog, used instead of API for routes and stops
+    self.spokenRoutes = spokenRoutes  # extra spoken route names, Route.Name vocabulary
+    self.grammar = None           # RouteGrammar for routeInfo, built when first needed
+    self.routeAlternatives = []   # (route name, confidence) for last spoken route
 
     # error flag valid after API is called
     self.serverError = False
@@ -25,16 +72,53 @@ class MBTA():
     # save API key
     self.apiKey = apiKey;
 
-    self.currentRoute = None      # entry from routInfo for selected route
-    self.currentDirections = None # direction options for current route - list of tuples
+    # server to send requests to, the MBTA unless testing
+    self.apiUrl = apiUrl.rstrip('/')
+
+    self.currentRoute = None      # Route from routInfo for selected route
+    self.currentDirections = None # direction options for current route - list of Direction
     self.currentDirection = ""    # used in queries, index into current route directions as string
     self.stopId = ""              # internal ID of selected bus stop, used to get predicitons
     self.stopName =""             # text name of bus stop
-    self.busStops = dict()        # dictionary of stop names, ids in slected direction
-    self.predTimes = dict()       # dictionary of trip ids, predictated arrival times
+    self.busStops = dict()        # dictionary of stop names, Stops in slected direction
+    self.stopIndex = None         # fuzzy match index of stop names in busStops
+    self.stopConfidence = 0.0     # confidence of last stop name match
+    self.dirIndex = None          # fuzzy match index of current directions
+    self.predTimes = []           # list of Predictions, arrival times and trip ids
     self.maxTrackCnt = int(trackCount) # max # of buses to track
     self.lastTrack = ""           # last trip to track - stop when no longer in predictions
+    self.trackers = dict()        # tracking sessions, key is (route id, direction id, stop id)
+    self.trackerLock = threading.Lock()
     self.savedrequet = ''
+    self.transferStats = dict()   # calls, bytes and decode time per endpoint
+    self.lastBytes = 0            # size of last response body
+
+    # request, cache and tracking instrumentation
+    self.metrics = metrics if metrics != None else Metrics()
+
+    # transport - one pooled, keep-alive session for all API calls
+    self.timeout = (connectTimeout, readTimeout)
+    self.maxRetries = maxRetries
+    self.session = self._makeSession()
+
+    # rate limit budget shared by all users of the key and server on this host
+    self.governor = RequestGovernor.forKey(apiKey, self.apiUrl)
+
+    # stop lists for (route id, direction id) - LRU order, oldest first
+    self.stopCache = OrderedDict()
+    self.stopCacheLock = threading.Lock()
+    self.stopCacheSize = STOP_CACHE_SIZE
+    self.stopCacheTTL = STOP_CACHE_TTL
+    self.stopCacheHits = 0
+    self.stopCacheMisses = 0
+
+    # predictions fetched ahead of time by prefetchPredictions,
+    # key is (route id, direction id, stop id)
+    self.snapshots = dict()
+
+    # spatial index of all bus stops, built when first needed
+    self.stopGrid = None
+    self.stopNames = None   # (stop name -> list of Stops, StopIndex) for all bus stops
 
   # settings have been changed on Home
   def updateSettings(self, apiKey, trackCount):
@@ -42,6 +126,49 @@ class MBTA():
     self.apiKey = apiKey
     self.maxTrackCnt = int(trackCount) # max # of buses to track
 
+    # key is sent as a header on every request
+    self._setKeyHeader()
+
+    # rate limit depends on key
+    self.governor = RequestGovernor.forKey(apiKey, self.apiUrl)
+
+  # create session used for all calls to the API
+  # connections are kept alive so TLS handshake is only paid once
+  def _makeSession(self):
+
+    session = requests.Session()
+
+    # we retry ourselves so backoff can be jittered
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+
+    session.headers.update({'Accept': 'application/vnd.api+json'})
+
+    self.session = session
+    self._setKeyHeader()
+
+    return session
+
+  # add or remove API key header on session
+  def _setKeyHeader(self):
+
+    if self.apiKey:
+      self.session.headers['x-api-key'] = self.apiKey
+    else:
+      self.session.headers.pop('x-api-key', None)
+
+  # sleep before retrying a request
+  # exponential backoff with full jitter
+  def _backoff(self, attempt):
+
+    time.sleep(random.uniform(0, BACKOFF_BASE * (2 ** attempt)))
+
+  # close pooled connections, call when skill shuts down
+  def close(self):
+
+    self.session.close()
+
 
   # reset class, call when stopping tracking
   def reset(self):
@@ -50,49 +177,165 @@ class MBTA():
     self.currentDirection = ""
     self.stopId = ""
 
-  # get data from MBTA API at given endpoint with passed arguments
-  def _getData(self,endPoint, args=None):
+  # url for endpoint with passed arguments
+  def _url(self, endPoint, args=None):
 
-    retVal = None;
+    # base url
+    api_url = "{}/{}".format(self.apiUrl, endPoint)
 
-    # clear error flag
-    self.serverError = False
+    # api key is sent in header, only args go in query string
+    if args != None :
 
-    # base url
-    api_url = "https://api-v3.mbta.com/{}".format(endPoint)
+      # url?args
+      api_url = "{}?{}".format(api_url,args)
 
-    # if we are using an api key and have args
-    if self.apiKey != None and args != None:
+    return api_url
 
-      # url?key%args
-       api_url = "{}?api_key={}&{}".format(api_url,self.apiKey,args)
+  # headers sent with every request
+  def _requestHeaders(self):
+    return dict(self.session.headers)
 
-    elif self.apiKey != None:
+  # send request to MBTA API at given endpoint with passed arguments
+  # connection and server errors are retried, exception raised
+  # if request still fails, otherwise response is returned
+  # requests wait their turn when the rate limit is used up,
+  # background requests leave some of the limit for interactive ones
+  def _request(self, endPoint, args=None, headers=None, priority=INTERACTIVE):
 
-      # url?key
-      api_url = "{}?api_key={}".format(api_url,self.apiKey)
+    api_url = self._url(endPoint, args)
 
-    elif args != None :
+    attempt = 0
+    rateWaits = 0
 
-      # url?args
-      api_url = "{}?{}".format(api_url,args)
+    while True:
+
+      # wait for rate limit budget
+      self.governor.acquire(priority)
+
+      start = time.perf_counter()
+
+      try:
+
+        # get requested data
+        r = self.session.get(api_url, headers=headers, timeout=self.timeout)
 
+        self._recordRequest(endPoint, r.status_code, time.perf_counter() - start)
+        self.governor.update(r.status_code, r.headers)
+
+        # rate limited, governor now waits for the window to reset
+        if r.status_code == 429 and rateWaits < MAX_RATE_WAITS:
+          rateWaits += 1
+          continue
+
+        # server errors may be transient, try again
+        if r.status_code >= 500 and attempt < self.maxRetries:
+          self._backoff(attempt)
+          attempt += 1
+          continue
+
+        r.raise_for_status()
+
+        return r
+
+      except (requests.ConnectionError, requests.Timeout):
+
+        self._recordRequest(endPoint, None, time.perf_counter() - start)
+
+        # connection problems may be transient, try again
+        if attempt >= self.maxRetries:
+          raise
+
+        self._backoff(attempt)
+        attempt += 1
+
+  # record outcome and time of one request, status is None
+  # if server could not be reached
+  def _recordRequest(self, endPoint, status, secs):
+
+    if status == None:
+      result = 'error'
+    elif status == 429:
+      result = 'rate_limited'
+    elif status >= 500:
+      result = 'server_error'
+    elif status >= 400:
+      result = 'client_error'
+    elif status == 304:
+      result = 'not_modified'
+    else:
+      result = 'ok'
+
+    self.metrics.inc('mbta_requests_total', endpoint=endPoint, result=result)
+    self.metrics.observe('mbta_request_seconds', secs, endpoint=endPoint)
+
+  # get data from MBTA API at given endpoint with passed arguments
+  def _getData(self,endPoint, args=None, priority=INTERACTIVE):
+
+    retVal = None;
+
+    body = self._getBody(endPoint, args, priority)
+
+    # check if we got any data before setting return value
+    if body != None and len(body['data']) > 0:
+      retVal = body['data']
+
+    return retVal
+
+  # get whole response document, data and any included resources
+  # return decoded body or None if the request failed
+  def _getBody(self, endPoint, args=None, priority=INTERACTIVE):
+
+    retVal = None
+
+    # clear error flag
+    self._setError(priority, False)
 
     try:
 
-      # get requested data
-      r = requests.get(api_url)
+      r = self._request(endPoint, args, priority=priority)
+
+      body = self._decode(endPoint, r.content)
 
-      # check if we got any data before setting return value
-      retVal = r.json()['data'] if len(r.json()['data']) > 0 else None
+      # a document without data is an error too
+      if 'data' in body:
+        retVal = body
 
     except:
+      pass
 
-      # set error flag
-      self.serverError = True
+    # set error flag
+    self._setError(priority, retVal == None)
 
     return retVal
 
+  # set error flag read by callError, only for calls the user
+  # is waiting on - background calls run while a request is
+  # being answered and report failure by what they return
+  def _setError(self, priority, error):
+
+    if priority == INTERACTIVE:
+      self.serverError = error
+
+
+  # decode response body, recording its size and decode time
+  def _decode(self, endPoint, content):
+
+    start = time.perf_counter()
+    body = json.loads(content)
+
+    stats = self.transferStats.setdefault(endPoint, {'calls': 0, 'bytes': 0, 'decodeSecs': 0.0})
+    stats['calls'] += 1
+    stats['bytes'] += len(content)
+    stats['decodeSecs'] += time.perf_counter() - start
+
+    self.lastBytes = len(content)
+    self.metrics.inc('mbta_response_bytes_total', len(content), endpoint=endPoint)
+
+    return body
+
+  # return calls, bytes received and decode time for each endpoint
+  def getTransferStats(self):
+    return self.transferStats
 
   # API calls die silently, return true if last call
   # resulted in an error
@@ -100,34 +343,192 @@ class MBTA():
     return self.serverError
 
 
+  # build dictionary with the info we need on each route
+  # key is short name
+  def _buildRouteInfo(self, routes):
+
+    routeInfo = dict()
+
+    for rt in routes:
+      routeInfo[rt['attributes']['short_name']] = self._routeFromResource(rt)
+
+    return routeInfo
+
+  # Route from API route resource
+  def _routeFromResource(self, rt):
+
+    return Route.make(rt['id'],                                    # id
+                      rt['attributes']['short_name'],              # short name
+                      rt['attributes']['long_name'],               # long name
+                      rt['attributes']['direction_names'],         # directions
+                      rt['attributes']['direction_destinations'])  # terminus
+
+  # read route catalog saved by a previous run
+  # return True if routes were loaded
+  def _loadRouteCache(self):
+
+    retVal = False
+
+    if self.fileSystem != None and self.fileSystem.exists(ROUTE_CACHE_FILE):
+
+      try:
+
+        with self.fileSystem.open(ROUTE_CACHE_FILE, 'r') as f:
+          cache = json.load(f)
+
+        # routes are saved as lists, caches written before Route existed as dicts
+        routeInfo = {k: Route.make(**v) if isinstance(v, dict) else Route.make(*v)
+                     for k, v in cache['routes'].items()}
+
+        # an empty copy is no better than none
+        if len(routeInfo) > 0:
+          self.routesModified = cache['modified']
+          self.routeInfo = routeInfo
+          retVal = True
+
+      except:
+
+        # unreadable cache will be rebuilt from server
+        self.routesModified = None
+
+    return retVal
+
+  # write obj as JSON to path, to a temp file that is then renamed
+  # so a crash never leaves a partial file
+  @staticmethod
+  def _atomicWriteJson(path, obj):
+
+    with open(path + '.tmp', 'w') as f:
+      json.dump(obj, f, separators=(',', ':'))
+
+    os.replace(path + '.tmp', path)
+
+  # save route catalog so next run can skip downloading it
+  def _saveRouteCache(self, routeInfo):
+
+    if self.fileSystem != None:
+      self._atomicWriteJson(os.path.join(self.fileSystem.path, ROUTE_CACHE_FILE),
+                            {'modified': self.routesModified, 'routes': routeInfo})
+
+  # get info on all bus routes from server
+  # if we have a cached copy, the server is asked to send
+  # routes only if they changed since the copy was made
+  def refreshRoutes(self, priority=INTERACTIVE):
+
+    try:
+
+      r = self._request('routes', ROUTE_ARGS, self._routeHeaders(), priority)
+
+      self._updateRoutes(r.status_code,
+                         self._decode('routes', r.content) if r.status_code != 304 else None,
+                         r.headers.get('Last-Modified'))
+
+    except:
+
+      self._routesFailed(priority)
+
+  # headers for route request, conditional if we have a cached copy
+  def _routeHeaders(self):
+
+    headers = None
+
+    if self.routeInfo and self.routesModified:
+      headers = {'If-Modified-Since': self.routesModified}
+
+    return headers
+
+  # apply response to route request
+  def _updateRoutes(self, status, body, modified):
+
+    # routes have changed or were never read
+    if status != 304:
+
+      routeInfo = self._buildRouteInfo(body['data'])
+      self.routesModified = modified
+
+      # replace whole dictionary so readers never see it half built
+      self.routeInfo = routeInfo
+
+      self._saveRouteCache(routeInfo)
+
+  # route request failed
+  # routes that were never read are left unread, so they are
+  # asked for again by the next call needing them
+  def _routesFailed(self, priority=INTERACTIVE):
+
+    if self.routeInfo == None:
+      self._setError(priority, True)
+
+  # True if an offline catalog has been imported
+  def _catalogReady(self):
+    return self.catalog != None and self.catalog.available()
+
+  # stops on route in direction from offline catalog
+  # return list of Stops or None if no catalog
+  def _catalogStops(self, key):
+
+    retVal = None
+
+    if self._catalogReady():
+      retVal = self.catalog.stops(*key) or None
+
+    return retVal
+
   # information on all MBTA bus routes is read from server
   # not all information is relevant to skill, we build a
   # dictionary with the info we need
   # this API call is necessary before getting any predictions
   # and will only be done once
-  def readRoutes(self):
+  # routes are saved to disk, after a restart the saved copy
+  # is used and checked for changes in the background when
+  # routes are first used
+  def readRoutes(self, priority=INTERACTIVE):
 
     # if route info has not been read yet
     if( self.routeInfo == None ):
 
-      # create empty dicitonary
-      self.routeInfo = dict()
+      # clear error flag
+      self._setError(priority, False)
+
+      if not self._readLocalRoutes():
+
+        # get info on all bus routes - only called once
+        self.metrics.inc('mbta_cache_requests_total', cache='routes', result='miss')
+        self.refreshRoutes(priority)
+
+    if self.routesUnchecked:
+      self._revalidateRoutes()
 
-      # get info on all bus routes - only called once
-      routes = self._getData('routes',"filter[type]=3&sort=sort_order")
+  # read routes from offline catalog or copy saved by a previous run
+  # without asking the server, a saved copy is left to be checked
+  # for changes when routes are first used
+  # return True if routes were read
+  def _readLocalRoutes(self):
 
-      if routes != None:
+    retVal = True
 
-        # build dictionary with the info we need on each route
-        # key is short name
-        for rt in routes:
-          self.routeInfo[rt['attributes']['short_name']] = {
-                                         'id': rt['id'],                               # id
-                                         'short_name' : rt['attributes']['short_name'],# short name
-                                         'long_name' : rt['attributes']['long_name'],  # long name
-                                         'dirs' : rt['attributes']['direction_names'], # directions
-                                         'dest' : rt['attributes']['direction_destinations'] # terminus
-                                      }
+    if self._catalogReady():
+
+      # offline catalog imported from GTFS feed
+      self.routeInfo = self.catalog.routeInfo()
+      self.metrics.inc('mbta_cache_requests_total', cache='routes', result='hit')
+
+    elif self._loadRouteCache():
+
+      self.metrics.inc('mbta_cache_requests_total', cache='routes', result='hit')
+      self.routesUnchecked = True
+
+    else:
+
+      retVal = False
+
+    return retVal
+
+  # check saved routes for changes in the background
+  def _revalidateRoutes(self):
+
+    self.routesUnchecked = False
+    threading.Thread(target=self.refreshRoutes, args=(BACKGROUND,), daemon=True).start()
 
 
   # set current route based on passed name
@@ -139,50 +540,125 @@ class MBTA():
     # make certain routes are loaded
     self.readRoutes()
 
-    # look in the dictionary
-    rt = self.routeInfo.get(routeName)
+    return(self._selectRoute(routeName))
+
+  # set current route from route name as heard, for example
+  # "silverline to" or "fifty seven a"
+  # return route name or None
+  def setSpokenRoute(self, spoken):
+
+    self.currentRoute = None;
+
+    # make certain routes are loaded
+    self.readRoutes()
+
+    return(self._selectSpokenRoute(spoken))
+
+  # resolve spoken route name and make best match current
+  # no route matches if routes could not be read
+  def _selectSpokenRoute(self, spoken):
+
+    self.routeAlternatives = self._routeGrammar().resolve(spoken)
+
+    return(self._selectRoute(self.routeAlternatives[0][0]) if self.routeAlternatives else None)
+
+  # routes a spoken route name may be, as list of (route name, confidence)
+  # best first, valid after setSpokenRoute
+  def getRouteAlternatives(self):
+    return self.routeAlternatives
+
+  # every way of saying every route the grammar knows
+  # routes are only read from the offline catalog or saved copy,
+  # the server is not asked, the network may not be up yet, and
+  # a saved copy is not checked until routes are used
+  # return empty list if neither has routes
+  def getSpokenRouteNames(self):
+
+    retVal = []
+
+    if self.routeInfo or self._readLocalRoutes():
+      retVal = self._routeGrammar().vocabulary()
+
+    return retVal
+
+  # grammar of spoken route names, rebuilt if routes were replaced
+  def _routeGrammar(self):
+
+    grammar = self.grammar
+    routes = self.routeInfo or dict()
+
+    if grammar == None or grammar.routes is not routes:
+      grammar = RouteGrammar(routes, self.spokenRoutes)
+
+      # keep grammar of routes that were read
+      if self.routeInfo != None:
+        self.grammar = grammar
+
+    return grammar
+
+  # look up route in loaded routes and make it current
+  def _selectRoute(self, routeName):
+
+    # look in the dictionary, empty if routes could not be read
+    rt = (self.routeInfo or dict()).get(routeName)
 
     # if we got a valid route
     if rt != None:
-      self.currentRoute = self.routeInfo[routeName]
+      self.currentRoute = rt
 
-    return(None if not rt else self.currentRoute['short_name'])
+    return(None if not rt else self.currentRoute.short_name)
 
-  # return object that can be saved to settings
-  # to remember current route and direction
+  # return SavedRoute that can be saved to settings
+  # to remember current route, direction and stop
+  # None if no route is set
   def getRouteSettings(self):
 
-    # current route basic info
-    currRoute = self.currentRoute
+    if self.currentRoute == None:
+      return None
+
+    return(SavedRoute(self.currentRoute.id, self.currentRoute.short_name,
+                      self.currentDirection, self.stopId, self.stopName))
+
+  # restore a SavedRoute
+  # return route name or None if route no longer runs
+  def restoreRoute(self, saved):
+
+    # make certain routes are loaded
+    self.readRoutes()
+
+    return(self._restoreRoute(saved))
 
-    # add current direction and stop id
-    currRoute["direction"] = self.currentDirection
-    currRoute["stopid"] = self.stopId
-    currRoute["stopName"] = self.stopName
-    return(currRoute)
+  # make route, direction and stop of SavedRoute current
+  def _restoreRoute(self, saved):
 
-  # restore a root saved in settings
-  # return route name
-  def restoreRoute(self, rt):
+    routes = self.routeInfo or dict()
 
-    # current direction, stop id and stop name are not in route dict
-    self.currentDirection = rt.pop('direction', None)
-    self.stopId = rt.pop('stopid', None);
-    self.stopName = rt.pop('stopName')
+    # route may have been renamed since it was saved
+    route = routes.get(saved.routeName)
 
-    # now route is reduced to proper contents of current route
-    self.currentRoute = rt
+    if route == None or route.id != saved.routeId:
+      route = next((r for r in routes.values() if r.id == saved.routeId), None)
 
+    if route == None:
+      return None
+
+    self.currentRoute = route
+    self.currentDirection = int(saved.direction)
+    self.stopId = saved.stopId
+    self.stopName = saved.stopName
 
     # fill current directions array
     self.getDirections()
 
-    return self.currentRoute['short_name'];
+    return self.currentRoute.short_name;
 
   # getters for info on restored route
   def getStopName(self):
     return self.stopName
 
+  def getRouteId(self):
+    return self.currentRoute.id
+
   def getDirDest(self):
     return(self.currentDirections[self.currentDirection])
 
@@ -192,11 +668,11 @@ class MBTA():
   #   directions are usually Inbound and Outbound
   def getDirections(self):
 
-    self.currentDirections = []
+    # Direction for each direction id
+    self.currentDirections = self.currentRoute.directions()
 
-    # append tuple for each direction
-    for idx, d in enumerate(self.currentRoute["dirs"]):
-      self.currentDirections.append((self.currentRoute["dirs"][idx],self.currentRoute["dest"][idx]))
+    # index for matching utterances to directions and destinations
+    self.dirIndex = StopIndex([' '.join(x) for x in self.currentDirections])
 
     return(self.currentDirections)
 
@@ -204,14 +680,12 @@ class MBTA():
   # a tuple of (direction name, destination name) for best match is returned
   def setDirection(self, str):
 
-    # build list of directions and destinations as strings
-    dirList = [' '.join(x).upper() for x in self.currentDirections]
-
     # select one destinaiton
-    dirKey, dirConfidence = match_one(str.upper(), dirList)
+    dirKey, dirConfidence = self.dirIndex.match(str)
 
-    # set direction id to index of selected destination
-    self.currentDirection = dirList.index(dirKey)
+    # set direction id to index of selected destination, the first
+    # when nothing was heard in common with either
+    self.currentDirection = self.dirIndex.names.index(dirKey) if dirKey != None else 0
 
     return(self.currentDirections[self.currentDirection])
 
@@ -232,70 +706,475 @@ class MBTA():
   # value is id, to use for API calls
   def getStops(self):
 
-    # ask API for stops
-    routeStops = self._getData('stops',
-                                "filter[direction_id]={}&filter[route]={}"
-                                .format(self.currentDirection, self.currentRoute["id"]))
+    # no stops without a route
+    if self.currentRoute == None:
+      self.busStops, self.stopIndex = dict(), StopIndex([])
+    else:
+      self.busStops, self.stopIndex = self.loadStops(self.currentRoute.id, self.currentDirection)
+
+    return(self.busStops)
+
+  # read stops for route in direction into cache
+  # return (stops dictionary, stop index)
+  def loadStops(self, routeId, directionId, priority=INTERACTIVE):
+
+    key = (routeId, str(directionId))
+
+    # use stops from cache if we have them
+    cached = self._cachedStops(key)
+
+    if cached == None:
+
+      # use offline catalog if we have one, otherwise ask API for stops
+      stopList = self._catalogStops(key)
 
+      if stopList == None:
+        stopList = self._stopList(self._getData('stops', self._stopArgs(*key), priority))
+
+      cached = self._storeStops(key, stopList)
+
+    return cached
+
+  # query string for stops on route in direction
+  def _stopArgs(self, routeId, directionId):
+
+    return("filter[direction_id]={}&filter[route]={}&{}".format(directionId, routeId, STOP_FIELDS))
+
+  # list of Stops from API stop data, None if no data
+  def _stopList(self, routeStops):
+
+    return(None if routeStops == None
+           else [Stop.make(stop['id'], stop['attributes']['name']) for stop in routeStops])
+
+  # build dictionary and index of stops from list of Stops
+  # return (stops dictionary, stop index)
+  def _storeStops(self, key, stopList):
 
     # empty dictionary
-    self.busStops = dict()
+    busStops = dict()
+
+    if stopList != None:
+
+      # create entry in dictionary for each bus stop
+      for stop in stopList:
+        stopKey = self.formatStopName(stop.name)
+        stopKey = stopKey.lower()
+        busStops[stopKey] = stop
+
+    # index for matching utterances to stop names
+    stopIndex = StopIndex(busStops)
+
+    # only cache good results
+    if stopList != None:
+      self._cacheStops(key, busStops, stopIndex)
+
+    return (busStops, stopIndex)
+
+  # look up stops for (route id, direction id) in cache
+  # return (stops dictionary, stop index) or None if not cached or expired
+  def _cachedStops(self, key):
+
+    retVal = None
+
+    with self.stopCacheLock:
+
+      entry = self.stopCache.get(key)
+
+      if entry != None and time.monotonic() - entry[0] < self.stopCacheTTL:
+
+        # most recently used entries are kept at the end
+        self.stopCache.move_to_end(key)
+        retVal = entry[1:]
+        self.stopCacheHits += 1
+
+      else:
+
+        self.stopCacheMisses += 1
+
+    self.metrics.inc('mbta_cache_requests_total', cache='stops',
+                     result='miss' if retVal == None else 'hit')
+
+    return retVal
+
+  # add stops for (route id, direction id) to cache
+  # least recently used entry is dropped when cache is full
+  def _cacheStops(self, key, stops, index):
 
-    # create entry in dictionary for each bus stop
-    for stop in routeStops:
-      stopKey = self.formatStopName(stop['attributes']['name'])
-      stopKey = stopKey.lower()
-      self.busStops[stopKey] = stop['id']
+    with self.stopCacheLock:
+
+      self.stopCache[key] = (time.monotonic(), stops, index)
+      self.stopCache.move_to_end(key)
+
+      while len(self.stopCache) > self.stopCacheSize:
+        self.stopCache.popitem(last=False)
+
+  # getter for confidence of last stop match, 0.0 to 1.0
+  def getStopConfidence(self):
+    return self.stopConfidence
+
+  # return stop cache hits and misses
+  def stopCacheStats(self):
+
+    return {'hits': self.stopCacheHits,
+            'misses': self.stopCacheMisses,
+            'size': len(self.stopCache)}
 
 
   # a bus stop name is passed, match to stop on route and set stop id
   #  return name found
   def setStop(self, stopName):
 
-    # build dictionay of stops if necessary
+    # build dictionay of stops if not cached
     self.getStops()
 
+    return(self._matchStop(stopName))
+
+  # match stop name to loaded stops and set stop id
+  def _matchStop(self, stopName):
+
     # find closest match on route
-    theStop = key, confidence = match_one(stopName, list(self.busStops))
-    self.stopId = self.busStops.get(key);
+    theStop = key, self.stopConfidence = self.stopIndex.match(stopName)
+    self.stopId = self.busStops[key].id if key in self.busStops else None;
 
     # record stop name
     self.stopName = theStop[0]
 
     return(self.stopName)
 
+  # locations of all bus stops from offline catalog or saved copy
+  # return list of (Stop, latitude, longitude) or None if neither has them
+  def _savedStopLocations(self):
+
+    retVal = None
+
+    if self._catalogReady():
+
+      retVal = self.catalog.stopLocations() or None
+
+    elif self.fileSystem != None and self.fileSystem.exists(STOP_LOCATION_FILE):
+
+      try:
+
+        with self.fileSystem.open(STOP_LOCATION_FILE, 'r') as f:
+          cache = json.load(f)
+
+        if time.time() - cache['read'] < STOP_LOCATION_TTL:
+          retVal = [(Stop.make(stopId, name), lat, lon) for stopId, name, lat, lon in cache['stops']]
+
+      except:
+
+        # unreadable copy will be replaced from server
+        retVal = None
+
+    self.metrics.inc('mbta_cache_requests_total', cache='stop_locations',
+                     result='miss' if retVal == None else 'hit')
+
+    return retVal
+
+  # list of (Stop, latitude, longitude) from API stop data, saved
+  # so next run can skip downloading it, None if no data
+  def _stopLocationList(self, stops):
+
+    retVal = None
+
+    if stops != None:
+
+      retVal = [(Stop.make(stop['id'], stop['attributes']['name']),
+                 stop['attributes']['latitude'], stop['attributes']['longitude'])
+                for stop in stops if stop['attributes']['latitude'] != None]
+
+      if self.fileSystem != None:
+        self._atomicWriteJson(os.path.join(self.fileSystem.path, STOP_LOCATION_FILE),
+                              {'read': time.time(),
+                               'stops': [(s.id, s.name, lat, lon) for s, lat, lon in retVal]})
+
+    return retVal
+
+  # build spatial index of all bus stops, only done once
+  # return StopGrid, empty if stop locations could not be read
+  def loadStopLocations(self):
+
+    retVal = self.stopGrid
+
+    if retVal == None:
+
+      locations = self._savedStopLocations()
+
+      if locations == None:
+        locations = self._stopLocationList(self._getData('stops', STOP_LOCATION_ARGS))
+
+      retVal = self._buildStopGrid(locations)
+
+    return retVal
+
+  # index stop locations, index is kept unless locations could not be read
+  # return StopGrid
+  def _buildStopGrid(self, locations):
+
+    retVal = StopGrid(locations or [])
+
+    # try server again next time
+    if locations != None:
+      self.stopGrid = retVal
+
+    return retVal
+
+  # stops nearest latitude, longitude
+  # return list of (meters, Stop), closest first
+  def nearbyStops(self, latitude, longitude, count=NEARBY_STOPS):
+
+    return self.loadStopLocations().nearest(latitude, longitude, count, NEARBY_METERS)
+
+  # array of arrival times not already past, so rows are ordered by the next bus
+  def _upcoming(self, times):
+
+    now = time.time()
+
+    return arrivalArray(t for t in times if t > now)
+
+  # query string for bus predictions at all nearby stops
+  def _nearbyArgs(self, nearby):
+
+    return("filter[stop]={}&filter[route_type]=3&sort=arrival_time&{},direction_id"
+           .format(','.join(stop.id for meters, stop in nearby), PREDICTION_FIELDS))
+
+  # arrivals of each route and direction at the closest nearby stop serving it
+  # return list of NearbyArrivals, soonest arrival first
+  def _nearbyArrivals(self, nearby, predictions):
+
+    distance = {stop.id: (meters, stop) for meters, stop in nearby}
+    routes = {r.id: r for r in (self.routeInfo or dict()).values()}
+    closest = dict()    # (route id, direction id) -> NearbyArrivals
+
+    for (routeId, directionId, stopId), preds in self._groupPredictions(predictions).items():
+
+      meters, stop = distance.get(stopId, (None, None))
+      route = routes.get(routeId)
+      arrivals = self._upcoming(p.arrival_time for p in preds)
+
+      if stop != None and route != None and len(arrivals) > 0:
+
+        found = closest.get((routeId, directionId))
+
+        if found == None or meters < found.meters:
+          closest[(routeId, directionId)] = NearbyArrivals(route, int(directionId), stop, meters,
+                                                           arrivals)
+
+    return sorted(closest.values(), key=lambda n: n.arrivals[0])
+
+  # arrival predictions of every bus route stopping near latitude, longitude
+  # in one request for all nearby stops
+  # return list of NearbyArrivals, soonest arrival first
+  def getNearbyArrivals(self, latitude, longitude):
+
+    retVal = []
+
+    # routes are needed to name what is arriving
+    self.readRoutes()
+
+    nearby = self.nearbyStops(latitude, longitude)
+
+    if len(nearby) > 0:
+      retVal = self._nearbyArrivals(nearby, self._getData('predictions', self._nearbyArgs(nearby)))
+
+    return retVal
+
+  # names of all bus stops in grid, built once with a good grid
+  # return (stop name -> list of Stops with that name, StopIndex)
+  def _stopNameIndex(self, grid):
+
+    retVal = self.stopNames
+
+    if retVal == None:
+
+      stops = defaultdict(list)
+
+      # stops on either side of a street share a name
+      for stop in grid.stops():
+        stops[self.formatStopName(stop.name).lower()].append(stop)
+
+      retVal = (stops, StopIndex(stops))
+
+      if grid is self.stopGrid:
+        self.stopNames = retVal
+
+    return retVal
+
+  # match stop name against every bus stop
+  # location is latitude, longitude of user or None if not known
+  # return list of Stops with the best matching name close together
+  def matchAnyStop(self, stopName, location=None):
+
+    return self._matchAnyStop(self.loadStopLocations(), stopName, location)
+
+  def _matchAnyStop(self, grid, stopName, location=None):
+
+    stops, index = self._stopNameIndex(grid)
+    key, self.stopConfidence = index.match(stopName)
+
+    return self._stopGroup(grid, stops.get(key, []), location)
+
+  # stops sharing a name within BOARD_METERS of the first stop of
+  # their group, names like "Main St @ Elm St" are used in several
+  # towns and only one place is wanted on a board
+  # return group nearest location if known, otherwise the largest
+  def _stopGroup(self, grid, stops, location):
+
+    groups = []
+
+    for stop in stops:
+
+      group = next((g for g in groups if grid.distance(g[0], stop) <= BOARD_METERS), None)
+
+      if group == None:
+        groups.append([stop])
+      else:
+        group.append(stop)
+
+    retVal = []
+
+    if len(groups) > 0 and location != None:
+      retVal = min(groups, key=lambda g: grid.distanceTo(location[0], location[1], g[0]))
+    elif len(groups) > 0:
+      retVal = max(groups, key=len)
+
+    return retVal
+
+  # query string for predictions of every bus route at stops
+  # routes are included so the board can be named without the route catalog
+  def _boardArgs(self, stops):
+
+    return("filter[stop]={}&filter[route_type]=3&include=route&sort=arrival_time&{},direction_id&{}"
+           .format(','.join(stop.id for stop in stops), PREDICTION_FIELDS, ROUTE_FIELDS))
+
+  # group predictions at a stop by route and direction
+  # return list of BoardRows, soonest arrival first
+  def _buildBoard(self, body):
+
+    retVal = []
+
+    if body != None:
+
+      routes = {r.id: r for r in (self.routeInfo or dict()).values()}
+      routes.update({rt['id']: self._routeFromResource(rt)
+                     for rt in body.get('included', []) if rt['type'] == 'route'})
+
+      arrivals = defaultdict(list)  # (route id, direction id) -> arrival times
+
+      # stops of one name are merged, each side serves its own direction
+      for (routeId, directionId, stopId), preds in self._groupPredictions(body['data']).items():
+        arrivals[(routeId, directionId)].extend(p.arrival_time for p in preds)
+
+      rows = [BoardRow(routes[routeId], int(directionId), self._upcoming(sorted(times)))
+              for (routeId, directionId), times in arrivals.items() if routeId in routes]
+
+      retVal = sorted([row for row in rows if len(row.arrivals) > 0],
+                      key=lambda row: row.arrivals[0])
+
+    return retVal
+
+  # arrival predictions of every bus route at stops, in one request
+  # pass stops found by matchAnyStop
+  # return list of BoardRows, soonest arrival first
+  def getBoard(self, stops):
+
+    retVal = []
+
+    if len(stops) > 0:
+      retVal = self._buildBoard(self._getBody('predictions', self._boardArgs(stops)))
+
+    return retVal
+
   # get arrival predictions for current route in the selected direcation at the chosen stop
-  # return (possibly empty) list of arrival time, trip id tuples
+  # return (possibly empty) list of Predictions
   def getPredictions(self):
 
-    predList = []
+    # use predictions fetched ahead of time if they are recent
+    retVal = self._snapshotPredictions()
+
+    if retVal == None:
+
+      # ask API for predictions
+      predictions = self._getData('predictions', self._predictionArgs())
+
+      retVal = self._buildPredictions(predictions)
+
+    return(retVal)
+
+  # prefetched predictions for current route, direction and stop
+  # None if there are none, they are too old to use or no route is set
+  def _snapshotPredictions(self):
+
+    retVal = None
+    entry = None
+
+    if self.currentRoute != None:
+      entry = self.snapshots.get(Tracker.makeKey(self.currentRoute.id, self.currentDirection,
+                                                 self.stopId))
+
+    if entry != None and time.monotonic() - entry[0] < WARM_MAX_AGE:
+
+      self._setError(INTERACTIVE, False)
+      self.metrics.inc('mbta_warm_hits_total')
+      retVal = entry[1]
+
+    return retVal
+
+  # get predictions for (route id, direction id, stop id) keys in
+  # one background request, they are used by getPredictions
+  # for a while instead of asking the API
+  def prefetchPredictions(self, keys):
+
+    if len(keys) > 0:
+
+      body = self._getBody('predictions', self._batchArgs(keys), BACKGROUND)
 
-    # ask API for predictions
-    predictions = self._getData('predictions',
-                                "filter[direction_id]={}&filter[route]={}&filter[stop]={}"
-                                .format(self.currentDirection,self.currentRoute["id"],self.stopId))
+      if body != None:
+        self._storeSnapshots(keys, body['data'])
+
+  # keep predictions for each key, stamped with time they were read
+  def _storeSnapshots(self, keys, predictions):
+
+    grouped = self._groupPredictions(predictions)
+    now = time.monotonic()
+
+    for key in [Tracker.makeKey(*k) for k in keys]:
+      self.snapshots[key] = (now, grouped.get(key, []))
+
+  # query string for predictions on current route, direction and stop
+  def _predictionArgs(self):
+
+    return(PREDICTION_ARGS.format(self.currentDirection, self.currentRoute.id, self.stopId))
+
+  # build list of Predictions from API data
+  def _buildPredictions(self, predictions):
+
+    predList = []
 
     # if we got valid predictions
     if predictions != None:
 
-          # build list of arrival time, trip id tuples
-          predList = list(map(lambda x: (x['attributes']['arrival_time'],
-                                         x['relationships']['trip']['data']['id']), predictions))
+          # build list of Predictions
+          predList = list(map(Prediction.fromResource, predictions))
 
-          # remove tuples where arrival time is none
-          predList = [p for p in predList if p[0] != None ]
+          # remove predictions where arrival time is none
+          predList = [p for p in predList if p.arrival_time != None ]
 
     return(predList)
 
-  # return arrival predictions as list
-  #  predictions are datatime objects with time zone
+  # return arrival predictions as array of epoch seconds
   def getArrivals(self):
 
     # get predictions
     self.predTimes = self.getPredictions()
 
+    return(self._arrivalTimes())
+
+  # prediction times from last predictions read
+  def _arrivalTimes(self):
+
     # only return prediction times
-    return(None if len(self.predTimes) == 0 else [x[0] for x in self.predTimes])
+    return(None if len(self.predTimes) == 0 else arrivalArray(x.arrival_time for x in self.predTimes))
 
   # begin tracking buses, return list of arrival predictions
   def startTracking(self):
@@ -303,43 +1182,291 @@ class MBTA():
     # get predictions
     self.predTimes = self.getPredictions()
 
+    return(self._beginTracking())
+
+  # record last bus to track from last predictions read
+  # return list of arrival predictions for tracked buses
+  def _beginTracking(self):
+
     # if we got any predictions
     if len(self.predTimes) > 0:
 
       # record last trip we will track
-      self.lastTrack = self.predTimes[min(len(self.predTimes),self.maxTrackCnt)-1][1]
+      self.lastTrack = self.predTimes[min(len(self.predTimes),self.maxTrackCnt)-1].trip_id
 
+      # add session to those updated by updateTrackers
+      tracker = Tracker(self.currentRoute.id, self.currentRoute.short_name,
+                        self.currentDirection, self.stopId, self.stopName, self.lastTrack)
 
-    # only return prediction times
-    #  predictions are datatime objects with time zone
-    return(None if len(self.predTimes) == 0 else [x[0] for x in self.predTimes][:self.maxTrackCnt])
+      # arrival predictions already announced
+      tracker.update(self.predTimes)
+
+      with self.trackerLock:
+        self._removeTracker(tracker.key())
+        self.trackers[tracker.key()] = tracker
+        self.metrics.set('mbta_active_trackers', len(self.trackers))
+
+    # only return prediction times, as epoch seconds
+    return(None if len(self.predTimes) == 0
+           else arrivalArray(x.arrival_time for x in self.predTimes[:self.maxTrackCnt]))
 
   # call periodically for current predictions of bus being tracked
   # startTracking must be called first to record the last trip tracked
   # return list of arrival predictions
   def updateTracking(self):
 
-    idx = -1  # assume we won't find the last tracked bus
-
     # get predictions
     self.predTimes = self.getPredictions()
 
-    if self.predTimes != None:
+    return(self._continueTracking())
 
-      # get index of last tracked bus
-      try:
-        # build list with trip id of last tracked bus then find its index in prediction list
-        idx = self.predTimes.index([x for x in self.predTimes if x[1] == self.lastTrack][0])
-      except:
-       self.reset()
+  # find last tracked bus in last predictions read
+  # return list of arrival predictions up to it or None if it has passed
+  # the route, direction and stop are left alone, as by stopTracking
+  def _continueTracking(self):
+
+    retVal = None
+
+    # one pass, stopping at last tracked bus
+    for idx, x in enumerate(self.predTimes):
+      if x.trip_id == self.lastTrack:
+        retVal = arrivalArray(p.arrival_time for p in self.predTimes[:idx+1])
+        break
+
+    return retVal
+
+  # query string for predictions of one tracking session
+  def _trackerPredictionArgs(self, tracker):
+
+    return(PREDICTION_ARGS.format(tracker.directionId, tracker.routeId, tracker.stopId))
 
+  # query string for predictions of all tracking sessions
+  # direction can only be filtered on one value, so it is
+  # checked when predictions are sorted out to sessions
+  def _trackerArgs(self):
 
-    # return prediction times up to last tracked bus
-    # if we got valid predictions and last
-    # tracked trip is still in list
-    return(None if idx < 0
-           else [x[0] for x  in self.predTimes][:idx+1])
+    return self._batchArgs([t.key() for t in self._polledTrackers()])
 
-    # call when done tracking or stopped by voice command
+  # query string for predictions at several (route id, direction id, stop id) keys
+  # direction is checked when predictions are grouped by key
+  def _batchArgs(self, keys):
+
+    routes = sorted({k[0] for k in keys})
+    stops = sorted({k[2] for k in keys})
+
+    return("filter[route]={}&filter[stop]={}&sort=arrival_time&{},direction_id"
+           .format(','.join(routes), ','.join(stops), PREDICTION_FIELDS))
+
+  # group API predictions by (route id, direction id, stop id)
+  # return dictionary of key -> list of Predictions in arrival order
+  def _groupPredictions(self, predictions):
+
+    retVal = defaultdict(list)
+
+    if predictions != None:
+
+      for x in predictions:
+
+        if x['attributes']['arrival_time'] != None:
+
+          key = Tracker.makeKey(x['relationships']['route']['data']['id'],
+                                x['attributes']['direction_id'],
+                                x['relationships']['stop']['data']['id'])
+
+          retVal[key].append(Prediction.fromResource(x))
+
+    return retVal
+
+  # sort predictions for all sessions out to each session
+  # return list of (tracker, arrival predictions) tuples, arrival
+  # predictions are None for sessions whose last bus has passed
+  def _applyTrackers(self, predictions):
+
+    retVal = []
+
+    # group arrival time, trip id tuples by session key
+    sessionTimes = self._groupPredictions(predictions)
+
+    with self.trackerLock:
+
+      for tracker in self._polledTrackers():
+
+        eta = tracker.update(sessionTimes.get(tracker.key(), []))
+        tracker.polls += 1
+        retVal.append((tracker, eta))
+
+        # last tracked bus has passed the stop
+        if eta == None:
+          self._removeTracker(tracker.key())
+
+    return retVal
+
+  # one API call for current predictions of all tracking sessions
+  # return list of (tracker, arrival predictions) tuples
+  def updateTrackers(self):
+
+    retVal = []
+
+    if len(self._polledTrackers()) > 0:
+
+      body = self._getBody('predictions', self._trackerArgs(), BACKGROUND)
+      self.metrics.inc('mbta_tracking_polls_total')
+
+      # keep sessions going if server could not be reached
+      if body != None:
+        retVal = self._applyTrackers(body['data'])
+
+    return retVal
+
+  # tracking sessions not being updated by a stream
+  def _polledTrackers(self):
+    return [t for t in list(self.trackers.values()) if not t.streaming()]
+
+  # end tracking session with passed key, call with trackerLock held
+  def _removeTracker(self, key):
+
+    tracker = self.trackers.pop(key, None)
+
+    if tracker != None:
+
+      # updates the session received before it ended
+      self.metrics.observe('mbta_tracker_polls', tracker.polls, COUNT_BUCKETS)
+      self.metrics.set('mbta_active_trackers', len(self.trackers))
+
+      if tracker.stream != None:
+        tracker.stream.stop()
+
+  # stream predictions for tracking sessions instead of polling them
+  # callback is passed tracker and arrival predictions whenever
+  # an arrival time changes, predictions are None when the last
+  # tracked bus has passed
+  def streamTrackers(self, callback):
+
+    with self.trackerLock:
+
+      for tracker in self.trackers.values():
+
+        if tracker.stream == None:
+          tracker.stream = PredictionStream(self, tracker, callback)
+          tracker.stream.start()
+
+  # called by stream when its predictions change
+  def _streamUpdate(self, stream, predTimes):
+
+    tracker = stream.tracker
+
+    with self.trackerLock:
+
+      eta = tracker.update(predTimes)
+      tracker.polls += 1
+
+      # last tracked bus has passed the stop
+      if eta == None and self.trackers.get(tracker.key()) is tracker:
+        self._removeTracker(tracker.key())
+
+    if not tracker.diff.empty():
+      stream.callback(tracker, eta)
+
+  # list of active tracking sessions
+  def getTrackers(self):
+    return list(self.trackers.values())
+
+  # number of active tracking sessions
+  def trackerCount(self):
+    return len(self.trackers)
+
+  # call when done tracking or stopped by voice command
+  # ends all tracking sessions, the route, direction and stop
+  # of a request in progress are left alone
   def stopTracking(self):
-    self.reset()
+
+    with self.trackerLock:
+      for key in list(self.trackers):
+        self._removeTracker(key)
+
+
+class Tracker():
+
+  __slots__ = ('routeId', 'routeName', 'directionId', 'stopId', 'stopName',
+               'lastTrack', 'eta', 'stream', 'polls', 'trips', 'diff', 'drift')
+
+  # a tracking session for one route, direction and stop
+  def __init__(self, routeId, routeName, directionId, stopId, stopName, lastTrack):
+
+    self.routeId = routeId        # internal route id, used in queries
+    self.routeName = routeName    # short name of route
+    self.directionId = str(directionId)
+    self.stopId = stopId          # internal stop id, used in queries
+    self.stopName = stopName      # text name of bus stop
+    self.lastTrack = lastTrack    # last trip to track - stop when no longer in predictions
+    self.eta = None               # arrival predictions from last update
+    self.trips = OrderedDict()    # trip id -> arrival last reported, in arrival order
+    self.diff = TripDiff((), (), ()) # changes made by last update
+    self.stream = None            # prediction stream, None if session is polled
+    self.polls = 0                # updates received, polled or streamed
+    self.drift = 0                # seconds tracked arrivals recently moved between updates
+
+  # key of session in tracker registry
+  @staticmethod
+  def makeKey(routeId, directionId, stopId):
+    return (routeId, str(directionId), stopId)
+
+  def key(self):
+    return Tracker.makeKey(self.routeId, self.directionId, self.stopId)
+
+  # True if session is updated by a connected stream
+  def streaming(self):
+    return self.stream != None and self.stream.connected
+
+  # pass list of Predictions for this session in arrival order
+  # return prediction times up to last tracked bus or None
+  # if last tracked trip is no longer in list
+  # trips are compared with the last update and the changes are
+  # left in diff, an arrival counts as changed once it has moved
+  # CHANGE_SECS from the time last reported for it
+  # the most any arrival moved since the last update is kept in
+  # drift, which decays over updates where nothing moves as much
+  def update(self, predTimes):
+
+    previous = self.trips
+    arrivals = dict(zip(previous, self.eta or ()))
+    trips = OrderedDict()
+    added = []
+    changed = []
+    moved = 0
+    found = False
+
+    # one pass, stopping at last tracked bus
+    for x in predTimes:
+
+      reported = previous.get(x.trip_id)
+
+      if x.trip_id in arrivals:
+        moved = max(moved, abs(x.arrival_time - arrivals[x.trip_id]))
+
+      if reported == None:
+        added.append(x.trip_id)
+        reported = x.arrival_time
+      elif abs(x.arrival_time - reported) >= CHANGE_SECS:
+        changed.append(x.trip_id)
+        reported = x.arrival_time
+
+      trips[x.trip_id] = reported
+
+      if x.trip_id == self.lastTrack:
+        found = True
+        break
+
+    if found:
+      self.eta = arrivalArray(x.arrival_time for x in predTimes[:len(trips)])
+    else:
+      self.eta = None
+      trips = OrderedDict()
+      added = changed = []
+
+    self.diff = TripDiff(tuple(added), tuple(changed),
+                         tuple(t for t in previous if t not in trips))
+    self.trips = trips
+    self.drift = max(moved, int(self.drift * DRIFT_DECAY))
+
+    return self.eta
@@ -0,0 +1,241 @@
+# Instrumentation for the MBTA client and skill
+#
+# Metrics is an in-process registry of counters, gauges and
+# histograms, each named with a few label values.  Recording one
+# is a dictionary update under a lock, cheap enough for the request
+# path.  Sinks added to the registry are handed it on export: one
+# writes the Prometheus text format (for a node exporter textfile
+# collector), another logs a one line summary.
+
+import threading
+import bisect
+import time
+import os
+
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)   # seconds
+COUNT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)                 # polls, announcements
+
+
+class Histogram():
+
+  __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+  def __init__(self, buckets):
+
+    self.buckets = buckets                # upper bounds, ascending
+    self.counts = [0] * (len(buckets) + 1) # last is above every bound
+    self.sum = 0.0
+    self.count = 0
+
+  def observe(self, value):
+
+    self.counts[bisect.bisect_left(self.buckets, value)] += 1
+    self.sum += value
+    self.count += 1
+
+  # estimate value below which fraction q of observations fall
+  # upper bound of the bucket holding it, None if no observations
+  def quantile(self, q):
+
+    retVal = None
+
+    if self.count > 0:
+
+      target = q * self.count
+      seen = 0
+
+      for idx, n in enumerate(self.counts):
+
+        seen += n
+
+        if seen >= target:
+          retVal = self.buckets[idx] if idx < len(self.buckets) else float('inf')
+          break
+
+    return retVal
+
+
+class Metrics():
+
+  def __init__(self):
+
+    self.lock = threading.Lock()
+    self.counters = dict()      # (name, labels) -> value
+    self.gauges = dict()        # (name, labels) -> value
+    self.histograms = dict()    # (name, labels) -> Histogram
+    self.sinks = []             # called with registry by export
+
+  # labels are passed as keywords, kept as tuple of (name, value)
+  def inc(self, name, value=1, **labels):
+
+    key = (name, tuple(labels.items()))
+
+    with self.lock:
+      self.counters[key] = self.counters.get(key, 0) + value
+
+  def set(self, name, value, **labels):
+
+    with self.lock:
+      self.gauges[(name, tuple(labels.items()))] = value
+
+  def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+
+    key = (name, tuple(labels.items()))
+
+    with self.lock:
+
+      hist = self.histograms.get(key)
+
+      if hist == None:
+        hist = self.histograms[key] = Histogram(buckets)
+
+      hist.observe(value)
+
+  # value of counter or gauge, 0 if never recorded
+  def value(self, name, **labels):
+
+    key = (name, tuple(labels.items()))
+
+    with self.lock:
+      return self.counters.get(key, self.gauges.get(key, 0))
+
+  # sum of counter over all label values, optionally
+  # only those with the passed labels
+  def total(self, name, **labels):
+
+    wanted = set(labels.items())
+
+    with self.lock:
+      return sum(v for (n, l), v in self.counters.items() if n == name and wanted <= set(l))
+
+  def histogram(self, name, **labels):
+
+    with self.lock:
+      return self.histograms.get((name, tuple(labels.items())))
+
+  # sinks are objects with an export(metrics) method
+  def addSink(self, sink):
+    self.sinks.append(sink)
+
+  # hand registry to every sink, a failing sink does not stop the others
+  def export(self):
+
+    for sink in self.sinks:
+      try:
+        sink.export(self)
+      except Exception:
+        pass
+
+
+# label set in Prometheus form, extra is appended
+def _labelText(labels, extra=()):
+
+  pairs = list(labels) + list(extra)
+
+  if len(pairs) == 0:
+    return ''
+
+  return '{' + ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"'))
+                        for k, v in pairs) + '}'
+
+
+# registry in Prometheus text exposition format
+def prometheusText(metrics):
+
+  lines = []
+
+  with metrics.lock:
+
+    counters = sorted(metrics.counters.items())
+    gauges = sorted(metrics.gauges.items())
+    histograms = sorted(metrics.histograms.items(), key=lambda kv: kv[0])
+
+  typed = set()
+
+  for kind, items in (('counter', counters), ('gauge', gauges)):
+
+    for (name, labels), value in items:
+
+      if name not in typed:
+        lines.append('# TYPE {} {}'.format(name, kind))
+        typed.add(name)
+
+      lines.append('{}{} {}'.format(name, _labelText(labels), value))
+
+  for (name, labels), hist in histograms:
+
+    if name not in typed:
+      lines.append('# TYPE {} histogram'.format(name))
+      typed.add(name)
+
+    # bucket counts are cumulative
+    seen = 0
+
+    for bound, n in zip(list(hist.buckets) + ['+Inf'], hist.counts):
+      seen += n
+      lines.append('{}_bucket{} {}'.format(name, _labelText(labels, [('le', bound)]), seen))
+
+    lines.append('{}_sum{} {}'.format(name, _labelText(labels), hist.sum))
+    lines.append('{}_count{} {}'.format(name, _labelText(labels), hist.count))
+
+  return '\n'.join(lines) + '\n'
+
+
+# one line summary of request counts, latency, cache hit
+# ratio and tracking for the log
+def snapshot(metrics):
+
+  requests = metrics.total('mbta_requests_total')
+  errors = (metrics.total('mbta_requests_total', result='error') +
+            metrics.total('mbta_requests_total', result='server_error'))
+  limited = metrics.total('mbta_requests_total', result='rate_limited')
+  hits = metrics.total('mbta_cache_requests_total', result='hit')
+  lookups = metrics.total('mbta_cache_requests_total')
+
+  with metrics.lock:
+    latency = [h for (n, l), h in metrics.histograms.items() if n == 'mbta_request_seconds']
+
+  p50 = max([h.quantile(0.5) for h in latency if h.count > 0] or [0])
+  p99 = max([h.quantile(0.99) for h in latency if h.count > 0] or [0])
+
+  return ('requests {} errors {} rate limited {} p50<={}s p99<={}s bytes {} '
+          'cache hit {:.0%} warm hits {} active trackers {} polls {}'
+          .format(requests, errors, limited, p50, p99,
+                  metrics.total('mbta_response_bytes_total'),
+                  hits / lookups if lookups else 0,
+                  metrics.total('mbta_warm_hits_total'),
+                  metrics.value('mbta_active_trackers'),
+                  metrics.total('mbta_tracking_polls_total')))
+
+
+class PrometheusFile():
+
+  # write registry to file at path in Prometheus text format
+  # file is replaced whole so a collector never reads half of it
+  def __init__(self, path):
+    self.path = path
+
+  def export(self, metrics):
+
+    with open(self.path + '.tmp', 'w') as f:
+      f.write(prometheusText(metrics))
+
+    os.replace(self.path + '.tmp', self.path)
+
+
+class LogSnapshot():
+
+  # log one line summary with passed logger, at most once per interval seconds
+  def __init__(self, log, interval=0):
+
+    self.log = log
+    self.interval = interval
+    self.last = 0
+
+  def export(self, metrics):
+
+    now = time.monotonic()
+
+    if now - self.last >= self.interval:
+      self.last = now
+      self.log.info('MBTA metrics: ' + snapshot(metrics))
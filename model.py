@@ -0,0 +1,100 @@
+# Data types for MBTA routes, stops and predictions
+#
+# All types are immutable named tuples without an instance
+# dictionary, so a full route catalog stays small and a route
+# can be shared without being changed behind anyone's back.
+# Ids are interned since the same ones appear in every query.
+
+from . arrivals import parseArrival
+from collections import namedtuple
+import sys
+
+
+class Direction(namedtuple('Direction', 'name destination')):
+
+  # direction of travel (usually Inbound or Outbound) and terminus
+  __slots__ = ()
+
+
+class Route(namedtuple('Route', 'id short_name long_name dirs dest')):
+
+  # bus route, dirs and dest are tuples indexed by direction id
+  __slots__ = ()
+
+  @classmethod
+  def make(cls, id, short_name, long_name, dirs, dest):
+    return cls(sys.intern(id), sys.intern(short_name), long_name, tuple(dirs), tuple(dest))
+
+  # list of directions for route, index is direction id
+  def directions(self):
+    return [Direction(d, self.dest[idx]) for idx, d in enumerate(self.dirs)]
+
+
+class Stop(namedtuple('Stop', 'id name')):
+
+  # bus stop, name is as the MBTA spells it
+  __slots__ = ()
+
+  @classmethod
+  def make(cls, id, name):
+    return cls(sys.intern(id), name)
+
+
+class Prediction(namedtuple('Prediction', 'arrival_time trip_id')):
+
+  # predicted arrival of one trip, arrival time is epoch seconds
+  # or None if the trip does not stop
+  __slots__ = ()
+
+  # arrival time is ISO 8601 string as sent by the API
+  @classmethod
+  def make(cls, arrival_time, trip_id):
+    return cls(parseArrival(arrival_time), sys.intern(trip_id))
+
+  # prediction from API prediction resource
+  @classmethod
+  def fromResource(cls, resource):
+    return cls.make(resource['attributes']['arrival_time'],
+                    resource['relationships']['trip']['data']['id'])
+
+
+class TripDiff(namedtuple('TripDiff', 'added changed departed')):
+
+  # trip ids of a tracking session that are new, whose arrival
+  # moved by a minute or more, and that are no longer predicted
+  __slots__ = ()
+
+  # True if nothing worth announcing happened
+  def empty(self):
+    return not (self.added or self.changed or self.departed)
+
+
+class SavedRoute(namedtuple('SavedRoute', 'routeId routeName direction stopId stopName')):
+
+  # route, direction id and stop saved as a shortcut
+  # route is looked up by id when the shortcut is used
+  __slots__ = ()
+
+  # from dictionary pickled by earlier versions, which
+  # held a copy of the route's dictionary
+  @classmethod
+  def fromDict(cls, d):
+
+    return cls(d['id'], d['short_name'], d.get('direction'), d.get('stopid'), d.get('stopName'))
+
+
+class NearbyArrivals(namedtuple('NearbyArrivals', 'route direction stop meters arrivals')):
+
+  # arrivals of a route in one direction at the closest stop
+  # to the user serving it, meters away, arrivals are epoch seconds
+  __slots__ = ()
+
+
+class BoardRow(namedtuple('BoardRow', 'route direction arrivals')):
+
+  # arrivals of a route in one direction at a stop, epoch seconds
+  __slots__ = ()
+
+  # terminus the route is heading to
+  def destination(self):
+    return self.route.dest[self.direction]
@@ -0,0 +1,143 @@
+# Stream MBTA predictions for a tracking session
+#
+# The API can send predictions as server-sent events: a reset
+# with every prediction, then add, update and remove events as
+# predictions change.  One connection is kept open for each
+# streamed session and its predictions are kept in a table so
+# the session is only announced when an arrival time changes.
+# While the stream is down the session is polled as usual.
+
+from . governor import BACKGROUND
+from . model import Prediction
+import threading
+import requests
+import random
+import json
+
+STREAM_READ_TIMEOUT = 90  # seconds without data before reconnecting
+STREAM_RETRY_MAX = 60     # max seconds between reconnect attempts
+
+
+class PredictionStream(threading.Thread):
+
+  # client is MBTA object that owns the session, callback is passed
+  # tracker and arrival predictions when they change
+  def __init__(self, client, tracker, callback):
+
+    threading.Thread.__init__(self, daemon=True)
+
+    self.client = client
+    self.tracker = tracker
+    self.callback = callback
+
+    self.connected = False          # True => session is not polled
+    self.stopped = threading.Event()
+    self.response = None            # open streaming response
+    self.table = dict()             # prediction id -> Prediction
+
+  # end stream, session returns to polling
+  def stop(self):
+
+    self.stopped.set()
+    self.connected = False
+
+    # unblock read of stream
+    if self.response != None:
+      self.response.close()
+
+  # url for predictions of tracked route, direction and stop
+  def _url(self):
+
+    return self.client._url('predictions', self.client._trackerPredictionArgs(self.tracker))
+
+
+  # apply one event to prediction table, the table is complete
+  # and the session streamed once a reset is received
+  # return True if table changed
+  def _apply(self, event, data):
+
+    payload = json.loads(data)
+
+    if event == 'reset':
+      self.table = {p['id']: Prediction.fromResource(p) for p in payload}
+      self.connected = True
+
+    elif event in ('add', 'update'):
+      self.table[payload['id']] = Prediction.fromResource(payload)
+
+    elif event == 'remove':
+      self.table.pop(payload['id'], None)
+
+    else:
+      return False
+
+    return True
+
+  # predictions in table as list of Predictions in arrival order
+  def predTimes(self):
+
+    return sorted([p for p in self.table.values() if p.arrival_time != None],
+                  key=lambda p: p.arrival_time)
+
+  # read events until stream closes, calling back on changes
+  def _readStream(self, session):
+
+    # opening stream counts against rate limit
+    self.client.governor.acquire(BACKGROUND)
+
+    self.response = session.get(self._url(), stream=True,
+                                headers={'Accept': 'text/event-stream'},
+                                timeout=(self.client.timeout[0], STREAM_READ_TIMEOUT))
+
+    with self.response as r:
+
+      r.raise_for_status()
+
+      event = None
+      data = []
+
+      for line in r.iter_lines(chunk_size=None, decode_unicode=True):
+
+        if self.stopped.is_set():
+          break
+
+        # blank line ends an event
+        if not line:
+
+          # changes are only passed on once the table is complete
+          if event and data and self._apply(event, '\n'.join(data)) and self.connected:
+            self.client._streamUpdate(self, self.predTimes())
+
+          event = None
+          data = []
+
+        elif line.startswith('event:'):
+          event = line[len('event:'):].strip()
+
+        elif line.startswith('data:'):
+          data.append(line[len('data:'):].strip())
+
+  # keep stream open until stopped, reconnecting when it drops
+  def run(self):
+
+    attempt = 0
+    session = requests.Session()
+    session.headers.update(self.client._requestHeaders())
+
+    while not self.stopped.is_set():
+
+      try:
+
+        self._readStream(session)
+        attempt = 0
+
+      except:
+
+        attempt += 1
+
+      # poll session until we reconnect
+      self.connected = False
+
+      self.stopped.wait(random.uniform(0, min(STREAM_RETRY_MAX, 2 ** attempt)))
+
+    session.close()
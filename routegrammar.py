@@ -0,0 +1,202 @@
+# Resolve spoken route names to routes
+#
+# Route names are heard as words: "silverline to", "fifty seven a",
+# "one eleven".  RouteGrammar is built once from the route catalog.
+# Every way of saying each route's short name is spelled out as a
+# sequence of tokens - digits, number words, Silver Line and Crosstown
+# prefixes, homophones of single digits - and put in a trie.  Spoken
+# forms listed in the Route.Name vocabulary that name a route are
+# added too.  An utterance is resolved by one walk down the trie,
+# every route passed on the way is an alternative, longest match first.
+
+from itertools import product
+import re
+
+# spoken forms of letter prefixes, each a list of tokens
+PREFIX_WORDS = {
+  'sl': [['silverline'], ['silver', 'line'], ['sl'], ['s', 'l']],
+  'ct': [['crosstown'], ['cross', 'town'], ['ct'], ['c', 't']],
+}
+
+ONES = ['zero', 'one', 'two', 'three', 'four', 'five', 'six', 'seven', 'eight', 'nine',
+        'ten', 'eleven', 'twelve', 'thirteen', 'fourteen', 'fifteen', 'sixteen',
+        'seventeen', 'eighteen', 'nineteen']
+TENS = ['', '', 'twenty', 'thirty', 'forty', 'fifty', 'sixty', 'seventy', 'eighty', 'ninety']
+
+# words heard for single digits, only taken as a whole token
+HOMOPHONES = {1: ['won'], 2: ['to', 'too'], 4: ['for', 'fore'], 8: ['ate']}
+HOMOPHONE_WEIGHT = 0.8  # homophones rank below the digit itself
+
+FILLER = {'route', 'bus', 'number', 'the'}   # skipped before a route name
+MAX_ALTERNATIVES = 3    # alternatives returned by resolve
+
+
+# lower case letter and digit tokens, letters and digits are split
+# so "SL1", "sl 1" and "s l one" tokenize alike
+def tokenize(str):
+  return re.findall(r'[a-z]+|[0-9]+', str.lower())
+
+
+# number under 100 as words
+def _under100(n):
+  return [ONES[n]] if n < 20 else [TENS[n // 10]] + ([ONES[n % 10]] if n % 10 else [])
+
+
+# ways of saying number n as lists of words
+# three digit numbers are also said in two parts, "one eleven", "one oh one"
+def numberWords(n):
+
+  retVal = []
+
+  if n < 100:
+
+    retVal.append(_under100(n))
+
+  elif n < 1000:
+
+    hundreds, rest = divmod(n, 100)
+
+    if rest == 0:
+      retVal.append([ONES[hundreds], 'hundred'])
+    else:
+      retVal.append([ONES[hundreds], 'hundred'] + _under100(rest))
+      retVal.append([ONES[hundreds], 'hundred', 'and'] + _under100(rest))
+
+    if rest >= 10:
+      retVal.append([ONES[hundreds]] + _under100(rest))
+    elif rest > 0:
+      retVal.append([ONES[hundreds], 'oh', ONES[rest]])
+      retVal.append([ONES[hundreds], 'o', ONES[rest]])
+
+  return retVal
+
+
+# spoken forms of one chunk of a short name as (tokens, weight) tuples
+def _chunkForms(chunk):
+
+  if chunk.isdigit():
+
+    n = int(chunk)
+    retVal = [([chunk], 1.0)] + [(words, 1.0) for words in numberWords(n)]
+    retVal += [([h], HOMOPHONE_WEIGHT) for h in HOMOPHONES.get(n, [])]
+
+  elif chunk in PREFIX_WORDS:
+
+    retVal = [(words, 1.0) for words in PREFIX_WORDS[chunk]]
+
+  else:
+
+    # letters said as a word or one at a time
+    retVal = [([chunk], 1.0)]
+
+    if len(chunk) > 1:
+      retVal.append((list(chunk), 1.0))
+
+  return retVal
+
+
+# spoken forms of route short name as (tokens, weight) tuples
+def spokenForms(shortName):
+
+  retVal = []
+
+  for parts in product(*[_chunkForms(c) for c in tokenize(shortName)]):
+
+    weight = 1.0
+
+    for tokens, w in parts:
+      weight *= w
+
+    retVal.append(([t for tokens, w in parts for t in tokens], weight))
+
+  return retVal
+
+
+# lines of a Mycroft vocabulary file, empty if it cannot be read
+def readVoc(path):
+
+  try:
+    with open(path) as f:
+      return [line.strip() for line in f if line.strip()]
+  except OSError:
+    return []
+
+
+class _Node():
+
+  __slots__ = ('children', 'routes')
+
+  def __init__(self):
+
+    self.children = dict()    # token -> _Node
+    self.routes = dict()      # short name -> weight of routes ending here
+
+
+class RouteGrammar():
+
+  # routes is dictionary of short name -> Route, as MBTA.routeInfo
+  # spoken is list of extra spoken forms, such as Route.Name vocabulary lines
+  def __init__(self, routes, spoken=()):
+
+    self.routes = routes
+    self.root = _Node()
+    self.phrases = set()    # forms said exactly, not through a homophone
+
+    for shortName in routes:
+      for tokens, weight in spokenForms(shortName):
+        self._add(tokens, shortName, weight)
+
+    # vocabulary forms that are a route name with spaces, "57 A"
+    for line in spoken:
+
+      shortName = ''.join(line.split()).upper()
+
+      if shortName in routes:
+        self._add(tokenize(line), shortName, 1.0)
+
+  def _add(self, tokens, shortName, weight):
+
+    node = self.root
+
+    for t in tokens:
+      node = node.children.setdefault(t, _Node())
+
+    node.routes[shortName] = max(weight, node.routes.get(shortName, 0))
+
+    if weight == 1.0:
+      self.phrases.add(' '.join(tokens))
+
+  # forms worth adding to a vocabulary, phrases of several words
+  # and route numbers - a single word such as "one" or "ten" would
+  # be taken as a route name in other utterances
+  def vocabulary(self):
+
+    return sorted(p for p in self.phrases if ' ' in p or p.isdigit())
+
+  # routes utterance may name as list of (short name, confidence),
+  # best first, in one pass over the utterance
+  # confidence is share of utterance matched times weight of the form
+  def resolve(self, utterance, limit=MAX_ALTERNATIVES):
+
+    tokens = tokenize(utterance)
+
+    # skip words said before the route name
+    start = 0
+    while start < len(tokens) and tokens[start] in FILLER:
+      start += 1
+
+    words = len(tokens) - start
+    found = dict()      # short name -> confidence
+    node = self.root
+
+    for idx, t in enumerate(tokens[start:]):
+
+      node = node.children.get(t)
+
+      if node == None:
+        break
+
+      for shortName, weight in node.routes.items():
+        found[shortName] = max(found.get(shortName, 0), weight * (idx + 1) / words)
+
+    return sorted(found.items(), key=lambda f: -f[1])[:limit]
@@ -0,0 +1,165 @@
+# Saved route shortcuts
+#
+# Shortcuts are kept in a small SQLite database, one row per
+# shortcut holding the route, direction and stop ids rather than
+# a copy of the route.  Saving or removing one is a single row
+# transaction, so a crash part way through never touches the other
+# shortcuts.  Space freed by removed shortcuts is reclaimed every
+# so often.  Shortcut files pickled by earlier versions are imported
+# once and renamed.
+
+from . model import SavedRoute
+import threading
+import sqlite3
+import os
+
+COMPACT_AFTER = 50      # removals between reclaiming free space
+
+SCHEMA = '''
+  CREATE TABLE IF NOT EXISTS shortcuts (name TEXT PRIMARY KEY, route_id TEXT,
+                                        route_name TEXT, direction_id INTEGER,
+                                        stop_id TEXT, stop_name TEXT,
+                                        uses INTEGER DEFAULT 0);
+  CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+'''
+COLUMNS = 'route_id, route_name, direction_id, stop_id, stop_name'  # SavedRoute fields
+
+
+class ShortcutStore():
+
+  def __init__(self, dbPath):
+
+    self.dbPath = dbPath
+    self.db = None                  # opened on first use
+    self.lock = threading.Lock()
+
+  # connection to store, created with its tables on first use
+  def _connect(self):
+
+    if self.db == None:
+
+      self.db = sqlite3.connect(self.dbPath, check_same_thread=False)
+      self.db.executescript(SCHEMA)
+
+      # stores made before use counts were kept
+      if 'uses' not in [c[1] for c in self.db.execute('PRAGMA table_info(shortcuts)')]:
+        self.db.execute('ALTER TABLE shortcuts ADD COLUMN uses INTEGER DEFAULT 0')
+
+    return self.db
+
+  # run statements in fn(db) as one transaction, return its result
+  def _write(self, fn):
+
+    with self.lock:
+
+      db = self._connect()
+
+      with db:
+        return fn(db)
+
+  # run query on store, return all rows
+  def _query(self, sql, args=()):
+
+    with self.lock:
+      return self._connect().execute(sql, args).fetchall()
+
+  # import shortcuts pickled by earlier versions of the skill,
+  # file is renamed so it is only imported once
+  # shortcuts already in store are kept
+  # return number of shortcuts imported
+  def migrate(self, picklePath):
+
+    retVal = 0
+
+    if os.path.exists(picklePath):
+
+      import pickle
+
+      with open(picklePath, 'rb') as f:
+        saved = {name: SavedRoute.fromDict(d) for name, d in pickle.load(f).items()}
+
+      def insert(db):
+        return sum(db.execute('INSERT OR IGNORE INTO shortcuts (name, {}) VALUES (?,?,?,?,?,?)'
+                              .format(COLUMNS), (name,) + tuple(s)).rowcount
+                   for name, s in saved.items())
+
+      retVal = self._write(insert)
+
+      os.replace(picklePath, picklePath + '.migrated')
+
+    return retVal
+
+  # names of all shortcuts
+  def names(self):
+    return [row[0] for row in self._query('SELECT name FROM shortcuts ORDER BY name')]
+
+  # SavedRoute for shortcut or None if there is no such shortcut
+  def get(self, name):
+
+    rows = self._query('SELECT {} FROM shortcuts WHERE name = ?'.format(COLUMNS), (name,))
+
+    return SavedRoute(*rows[0]) if rows else None
+
+  # SavedRoutes of shortcuts, most used first
+  # return at most limit of them if limit is passed
+  def mostUsed(self, limit=-1):
+
+    return [SavedRoute(*row) for row in
+            self._query('SELECT {} FROM shortcuts ORDER BY uses DESC, name LIMIT ?'.format(COLUMNS),
+                        (limit,))]
+
+  # count a use of shortcut
+  def used(self, name):
+
+    self._write(lambda db: db.execute('UPDATE shortcuts SET uses = uses + 1 WHERE name = ?',
+                                      (name,)))
+
+  # save SavedRoute under name, replacing any shortcut with that name
+  def save(self, name, saved):
+
+    self._write(lambda db: db.execute('INSERT OR REPLACE INTO shortcuts (name, {}) VALUES (?,?,?,?,?,?)'
+                                      .format(COLUMNS), (name,) + tuple(saved)))
+
+  # remove shortcut, return True if there was one
+  def remove(self, name):
+
+    def delete(db):
+
+      removed = db.execute('DELETE FROM shortcuts WHERE name = ?', (name,)).rowcount > 0
+
+      if removed:
+        db.execute("INSERT OR IGNORE INTO meta VALUES ('removals', 0)")
+        db.execute("UPDATE meta SET value = value + 1 WHERE key = 'removals'")
+
+      return removed
+
+    retVal = self._write(delete)
+
+    if retVal:
+      self._compact()
+
+    return retVal
+
+  # reclaim space of removed shortcuts once enough have been removed
+  def _compact(self):
+
+    with self.lock:
+
+      db = self._connect()
+      rows = db.execute("SELECT value FROM meta WHERE key = 'removals'").fetchall()
+
+      if rows and rows[0][0] >= COMPACT_AFTER:
+
+        with db:
+          db.execute("UPDATE meta SET value = 0 WHERE key = 'removals'")
+
+        # cannot run inside a transaction
+        db.execute('VACUUM')
+
+  def close(self):
+
+    with self.lock:
+
+      if self.db != None:
+        self.db.close()
+        self.db = None
@@ -0,0 +1,119 @@
+# Find the bus stops nearest a location
+#
+# Stops are put in a grid of cells about CELL_METERS on a side.
+# The nearest stops to a point are found by searching rings of
+# cells outward from the point's cell, stopping once the next ring
+# is farther away than the k-th closest stop found so far.  Across
+# the MBTA service area distances are short enough to treat the
+# earth as flat around the centre of the stops.
+
+from collections import defaultdict
+import math
+
+CELL_METERS = 400               # width and height of a grid cell
+METERS_PER_DEGREE = 111195      # along a meridian
+
+
+class StopGrid():
+
+  # stops is an iterable of (Stop, latitude, longitude) tuples
+  def __init__(self, stops):
+
+    stops = list(stops)
+
+    # a degree of longitude is shorter away from the equator
+    midLat = sum(s[1] for s in stops) / len(stops) if stops else 0
+    self.latMeters = METERS_PER_DEGREE
+    self.lonMeters = METERS_PER_DEGREE * math.cos(math.radians(midLat))
+
+    self.cells = defaultdict(list)  # (row, column) -> list of (x, y, Stop)
+    self.points = dict()            # stop id -> (x, y)
+
+    for stop, lat, lon in stops:
+      x, y = self._project(lat, lon)
+      self.cells[self._cell(x, y)].append((x, y, stop))
+      self.points[stop.id] = (x, y)
+
+    # rings needed to reach every cell from any other
+    rows = [c[0] for c in self.cells] or [0]
+    cols = [c[1] for c in self.cells] or [0]
+    self.maxRing = max(max(rows) - min(rows), max(cols) - min(cols)) + 1
+
+    self.size = len(stops)
+
+  # every stop in grid
+  def stops(self):
+
+    for cell in self.cells.values():
+      for x, y, stop in cell:
+        yield stop
+
+  # meters between two stops in grid
+  def distance(self, a, b):
+
+    ax, ay = self.points[a.id]
+    bx, by = self.points[b.id]
+
+    return math.hypot(ax - bx, ay - by)
+
+  # meters from latitude, longitude to stop in grid
+  def distanceTo(self, lat, lon, stop):
+
+    x, y = self._project(lat, lon)
+    sx, sy = self.points[stop.id]
+
+    return math.hypot(sx - x, sy - y)
+
+  # meters east and north of the equator at the prime meridian
+  def _project(self, lat, lon):
+    return (lon * self.lonMeters, lat * self.latMeters)
+
+  def _cell(self, x, y):
+    return (int(math.floor(y / CELL_METERS)), int(math.floor(x / CELL_METERS)))
+
+  # cells at distance ring from (row, col), ring 0 is the cell itself
+  @staticmethod
+  def _ring(row, col, ring):
+
+    if ring == 0:
+      return [(row, col)]
+
+    cells = [(row - ring, c) for c in range(col - ring, col + ring + 1)]
+    cells += [(row + ring, c) for c in range(col - ring, col + ring + 1)]
+    cells += [(r, col - ring) for r in range(row - ring + 1, row + ring)]
+    cells += [(r, col + ring) for r in range(row - ring + 1, row + ring)]
+
+    return cells
+
+  # k stops nearest latitude, longitude as list of (meters, Stop)
+  # nearest first, stops farther than maxMeters are left out
+  def nearest(self, lat, lon, k, maxMeters=None):
+
+    x, y = self._project(lat, lon)
+    row, col = self._cell(x, y)
+
+    found = []
+    ring = 0
+
+    while ring <= self.maxRing:
+
+      for cell in self._ring(row, col, ring):
+        for sx, sy, stop in self.cells.get(cell, ()):
+          found.append((math.hypot(sx - x, sy - y), stop))
+
+      # every stop not yet seen is at least this far away
+      reach = ring * CELL_METERS
+
+      if maxMeters != None and reach >= maxMeters:
+        break
+
+      if len(found) >= k:
+        found.sort(key=lambda f: f[0])
+        if found[k - 1][0] <= reach:
+          break
+
+      ring += 1
+
+    found.sort(key=lambda f: f[0])
+
+    return [f for f in found[:k] if maxMeters == None or f[0] <= maxMeters]
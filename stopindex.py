@@ -0,0 +1,177 @@
+# Index of names for fast fuzzy matching of utterances
+#
+# Each name is broken into normalized word tokens, character
+# trigrams and a phonetic key per token. An utterance is looked
+# up in the inverted index to find likely candidates which are
+# then ranked with the same fuzzy match Mycroft uses. When none
+# of the first few match closely more candidates are ranked.
+#
+# Words found in most stop names, like street and opposite, are
+# not indexed as words, and keys shared by a large part of the
+# names are dropped, so a lookup only visits names with something
+# distinctive in common with the utterance.
+
+from collections import defaultdict
+import heapq
+import re
+
+MIN_CANDIDATES = 25    # candidates re-ranked with fuzzy match
+CANDIDATE_SHARE = 0.05 # ... or this share of names when none match closely
+CLOSE_MATCH = 0.9      # confidence that needs no more candidates
+TOKEN_WEIGHT = 3    # score for each word shared with utterance
+PHONETIC_WEIGHT = 2 # score for each word that sounds like one in utterance
+COMMON_SHARE = 0.05 # keys in more than this share of names are not indexed
+MIN_POSTINGS = 50   # ... unless they are in fewer names than this
+
+# words that say nothing about which stop is meant
+STOP_WORDS = frozenset(('street', 'st', 'avenue', 'ave', 'road', 'rd', 'boulevard', 'blvd',
+                        'highway', 'hwy', 'parkway', 'pkwy', 'drive', 'dr', 'square', 'sq',
+                        'at', 'opposite', 'opp', 'before', 'after', 'and', 'the', 'of'))
+
+# soundex digit for each consonant
+SOUNDEX_CODES = dict()
+for letters, code in (('bfpv', '1'), ('cgjkqsxz', '2'), ('dt', '3'),
+                      ('l', '4'), ('mn', '5'), ('r', '6')):
+  for c in letters:
+    SOUNDEX_CODES[c] = code
+
+_fuzzyMatch = None  # fuzzy match function, found on first use
+
+
+# fuzzy match Mycroft uses, imported when first needed so the client
+# loads without Mycroft, tools run without it get the same measure
+# from difflib
+def fuzzyMatcher():
+
+  global _fuzzyMatch
+
+  if _fuzzyMatch == None:
+
+    try:
+      from mycroft.util.parse import fuzzy_match as _fuzzyMatch
+    except ImportError:
+      from difflib import SequenceMatcher
+      _fuzzyMatch = lambda x, against: SequenceMatcher(None, x, against).ratio()
+
+  return _fuzzyMatch
+
+
+class StopIndex():
+
+  # build index over passed names
+  def __init__(self, names):
+
+    self.names = list(names)
+
+    self.grams = defaultdict(set)    # trigram -> name indexes
+    self.tokens = defaultdict(set)   # word -> name indexes
+    self.phonetic = defaultdict(set) # phonetic key -> name indexes
+
+    for idx, name in enumerate(self.names):
+
+      for w in self.keyWords(name):
+        self.tokens[w].add(idx)
+        self.phonetic[self.soundex(w)].add(idx)
+
+      for g in self.trigrams(' '.join(self.tokenize(name))):
+        self.grams[g].add(idx)
+
+    # drop keys too common to tell names apart
+    limit = max(MIN_POSTINGS, int(len(self.names) * COMMON_SHARE))
+
+    for postings in (self.grams, self.tokens, self.phonetic):
+      for key in [k for k, v in postings.items() if len(v) > limit]:
+        del postings[key]
+
+  # lower case words without punctuation
+  @staticmethod
+  def tokenize(str):
+
+    return re.findall(r'[a-z0-9]+', str.lower())
+
+  # words of string indexed as words and phonetic keys, stop
+  # words are left out unless there is nothing else
+  @staticmethod
+  def keyWords(str):
+
+    words = StopIndex.tokenize(str)
+
+    return [w for w in words if w not in STOP_WORDS] or words
+
+  # set of three character sequences in string
+  # padded so start and end of words count
+  @staticmethod
+  def trigrams(str):
+
+    str = ' {} '.format(str)
+    return {str[i:i+3] for i in range(len(str) - 2)}
+
+  # soundex key of a word, numbers are their own key
+  @staticmethod
+  def soundex(word):
+
+    if word.isdigit():
+      return word
+
+    key = word[0]
+    last = SOUNDEX_CODES.get(word[0])
+
+    for c in word[1:]:
+
+      code = SOUNDEX_CODES.get(c)
+
+      # skip repeated codes, h and w do not separate repeats
+      if code != None and code != last:
+        key += code
+
+      if c not in 'hw':
+        last = code
+
+    return (key + '000')[:4]
+
+  # indexes of up to count names most likely to match utterance, best first
+  def candidates(self, utterance, count=MIN_CANDIDATES):
+
+    scores = defaultdict(int)
+
+    for w in self.keyWords(utterance):
+
+      for idx in self.tokens.get(w, ()):
+        scores[idx] += TOKEN_WEIGHT
+
+      for idx in self.phonetic.get(self.soundex(w), ()):
+        scores[idx] += PHONETIC_WEIGHT
+
+    for g in self.trigrams(' '.join(self.tokenize(utterance))):
+      for idx in self.grams.get(g, ()):
+        scores[idx] += 1
+
+    return heapq.nlargest(count, scores, key=scores.get)
+
+  # find name that best matches utterance, nothing in common with
+  # any name is no match, equal matches go to the first name
+  # return name, confidence tuple - confidence is 0.0 to 1.0
+  def match(self, utterance):
+
+    fuzzy_match = fuzzyMatcher()
+    utterance = utterance.lower()
+    candidates = self.candidates(utterance, max(MIN_CANDIDATES, int(len(self.names) * CANDIDATE_SHARE)))
+
+    best = None
+    confidence = 0.0
+
+    for n, idx in enumerate(candidates):
+
+      # rest only ranked when no close match so far
+      if n == MIN_CANDIDATES and confidence >= CLOSE_MATCH:
+        break
+
+      c = fuzzy_match(utterance, self.names[idx].lower())
+
+      if best == None or c > confidence or (c == confidence and idx < best):
+        best, confidence = idx, c
+
+    if best == None:
+      return (None, 0.0)
+
+    return (self.names[best], confidence)
@@ -0,0 +1,1417 @@
+#!/usr/bin/env python3
+#
+# Offline benchmarks for the MBTA client and announcement hot paths
+#
+# Runs without network access or Mycroft.  The client is fed V3 JSON
+# fixtures from tools/fixtures instead of calling the API, and each
+# hot path is timed with timeit.  Results are kept in
+# tools/bench-results.json, which is not checked in since timings are
+# only comparable on one machine, so a slower run shows up against
+# the last one saved there.
+#
+#   python3 tools/bench.py                  # run all, compare with saved results
+#   python3 tools/bench.py -k stops         # only benchmarks whose name has "stops"
+#   python3 tools/bench.py --save           # save results as the new baseline
+#   python3 tools/bench.py --check          # exit 1 if a speedup or result fell short
+#
+# Timings against a saved run are only printed, they vary too much
+# from run to run to fail on.  --check instead compares timings made
+# in the same run, such as the stop index against a linear match,
+# and results that do not depend on the machine, such as how many
+# route names the grammar resolves.
+#
+# Fixtures are V3 documents in the shape api-v3.mbta.com sends.  The
+# checked in set is generated, with the real bus route names and
+# stop names built from Boston streets, by --write-fixtures.  To use
+# recorded responses instead point --record at an API server, the
+# MBTA or tools/fakeserver.py:
+#
+#   python3 tools/bench.py --record https://api-v3.mbta.com --key YOUR_API_KEY
+#
+# Timings are the best of several runs, in microseconds per call.
+# Reports are counts measured once, such as requests per session.
+
+from urllib.parse import parse_qs
+import importlib
+import argparse
+import platform
+import tracemalloc
+import tempfile
+import zipfile
+import random
+import shutil
+import atexit
+import subprocess
+import timeit
+import types
+import json
+import time
+import heapq
+import math
+import csv
+import gc
+import sys
+import io
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FIXTURES = os.path.join(ROOT, 'tools', 'fixtures')
+RESULTS = os.path.join(ROOT, 'tools', 'bench-results.json')
+
+REPEAT = 5              # timing runs, best is kept
+MIN_SECS = 0.2          # shortest time one timing run takes
+
+# (slower benchmark, faster benchmark, least times faster) checked in one run
+SPEEDUPS = (('match.linear.network', 'match.index.network', 10),
+            ('announce.strptimeBuckets', 'announce.waitBuckets', 5),
+            ('nearby.bruteForce', 'nearby.grid', 20))
+
+# (report, measurement, least value) checked on every run
+EXPECTED = (('match.candidates', 'route same pick as linear %', 100),
+            ('match.candidates', 'network same pick as linear %', 100),
+            ('announce.agreement', 'same waits', 60),
+            ('nearby.correctness', 'same nearest stop %', 100),
+            ('routes.grammar', 'total new top1', 804))
+SEED = 20200131         # random choices in fixtures and inputs
+
+# stops fixture routes, stops per direction and the street they run on
+STOP_ROUTES = (('1', 24, 'Massachusetts Ave'), ('39', 28, 'Centre St'),
+               ('57', 30, 'Commonwealth Ave'), ('66', 42, 'Harvard St'),
+               ('111', 18, 'Broadway'), ('SL4', 12, 'Washington St'))
+
+# streets stop names are built from
+STREETS = ('Massachusetts Ave', 'Washington St', 'Centre St', 'Harvard St', 'Beacon St',
+           'Commonwealth Ave', 'Tremont St', 'Columbus Ave', 'Boylston St', 'Broadway',
+           'Dorchester Ave', 'Blue Hill Ave', 'Warren St', 'Dudley St', 'Hyde Park Ave',
+           'River St', 'Cambridge St', 'Brighton Ave', 'Huntington Ave', 'South Huntington Ave',
+           'Chestnut Hill Ave', 'Brookline Ave', 'Longwood Ave', 'Melnea Cass Blvd',
+           'Malcolm X Blvd', 'Columbia Rd', 'Geneva Ave', 'Bowdoin St', 'Adams St',
+           'Gallivan Blvd', 'Morton St', 'American Legion Hwy', 'Cummins Hwy', 'Walk Hill St',
+           'Belgrade Ave', 'Spring St', 'Lagrange St', 'Vfw Pkwy', 'Arborway', 'South St',
+           'Perkins St', 'Jamaicaway', 'Heath St', 'Francis St', 'Mission St', 'Parker St',
+           'Ruggles St', 'Shawmut Ave', 'Albany St', 'Harrison Ave', 'Northampton St',
+           'Mount Auburn St', 'Brattle St', 'Prospect St', 'Hampshire St', 'Kirkland St',
+           'Somerville Ave', 'Highland Ave', 'Medford St', 'Main St', 'Elm St', 'School St',
+           'Central St', 'Pleasant St', 'Union St', 'Summer St', 'Winter St', 'Park St',
+           'Chelsea St', 'Meridian St', 'Bennington St', 'Saratoga St', 'Everett Ave',
+           'Revere Beach Pkwy', 'Salem St', 'Hancock St', 'Quincy Shore Dr', 'Newport Ave')
+STOP_FORMS = ('{} @ {}', '{} opp {}', '{} @ {}', '{} before {}', '{} after {}')
+
+# tracking replay, trips predicted for a stop and how their predictions move
+REPLAY_SESSIONS = 20    # tracking sessions replayed
+REPLAY_STEP = 5         # seconds between changes to predictions
+REPLAY_TRIPS = 6        # trips predicted at the stop, first 15 to 40 minutes away
+REPLAY_HEADWAY = (480, 900)   # seconds between trips
+REPLAY_NEAR = 300       # seconds before arrival counted as near
+POLL_FLOOR = 30         # adaptive tracking floor and fixed interval, skill default
+POLL_CEILING = 300      # adaptive tracking ceiling, skill default
+
+# service area stop locations are spread over, south west and north east corners
+SERVICE_AREA = ((42.20, -71.30), (42.55, -70.90))
+NETWORK_STOPS = 8000    # bus stops in the service area
+NEARBY_QUERIES = 200    # locations checked against brute force
+EARTH_METERS = 6371000  # mean radius of the earth
+
+# generated GTFS feed, every bus route with a day of trips
+GTFS_TRIPS = 20         # trips a day on each route and direction
+GTFS_STOPS = 40         # stops on each route
+
+BENCHES = []            # (name, setup function) in order added
+REPORTS = []            # (name, function) in order added
+
+
+# register function returning the callable to time
+def bench(name):
+
+  def register(fn):
+    BENCHES.append((name, fn))
+    return fn
+
+  return register
+
+
+# register function returning a dictionary of measured counts
+def report(name):
+
+  def register(fn):
+    REPORTS.append((name, fn))
+    return fn
+
+  return register
+
+
+# import client modules without the skill, which needs Mycroft
+def loadClient():
+
+  pkg = types.ModuleType('mbtaskill')
+  pkg.__path__ = [ROOT]
+  sys.modules['mbtaskill'] = pkg
+
+  return types.SimpleNamespace(**{name: importlib.import_module('mbtaskill.' + name)
+                                  for name in ('mbta', 'model', 'arrivals', 'stopindex', 'metrics')})
+
+
+################ fixtures ################
+
+# bus route short names, from the route names the skill knows
+def routeNames():
+
+  names = []
+
+  with open(os.path.join(ROOT, 'vocab', 'en-us', 'Route.Name.voc')) as f:
+    for line in f:
+
+      name = ''.join(line.split()).upper()
+
+      # digits with an optional letter, or a Silver Line or Crosstown route
+      if name and name not in names and (name[0].isdigit() or name[:2] in ('SL', 'CT')):
+        names.append(name)
+
+  return names
+
+
+# stop name on a street, stops on opposite sides share it
+def stopName(rnd, street):
+
+  cross = rnd.choice([s for s in STREETS if s != street])
+
+  return rnd.choice(STOP_FORMS).format(street, cross)
+
+
+# V3 route resources for every bus route
+def routeResources(rnd):
+
+  return [{'type': 'route', 'id': name,
+           'attributes': {'short_name': name,
+                          'long_name': '{} - {}'.format(*rnd.sample(STREETS, 2)),
+                          'direction_names': ['Outbound', 'Inbound'],
+                          'direction_destinations': ['{} Station'.format(rnd.choice(STREETS).split()[0]),
+                                                     '{} Square'.format(rnd.choice(STREETS).split()[0])]}}
+          for name in routeNames()]
+
+
+# V3 stop resources for both directions of the stops fixture routes
+# stops are the same in each direction, in reverse order
+def stopResources(rnd):
+
+  retVal = dict()
+
+  for routeId, count, street in STOP_ROUTES:
+
+    stops = [{'type': 'stop', 'id': '{}-{}'.format(routeId, idx),
+              'attributes': {'name': stopName(rnd, street)}}
+             for idx in range(count)]
+
+    retVal['{},0'.format(routeId)] = stops
+    retVal['{},1'.format(routeId)] = list(reversed(stops))
+
+  return retVal
+
+
+# V3 prediction resources for a few stops of each fixture route,
+# every few minutes for the next hour, sorted by arrival time
+def predictionResources(rnd, stops):
+
+  retVal = []
+  start = int(time.mktime((2020, 1, 31, 17, 0, 0, 0, 0, -1)))
+
+  for key, stopList in sorted(stops.items()):
+
+    routeId, d = key.split(',')
+
+    for stop in stopList[::6]:
+
+      at = start + rnd.randint(0, 600)
+
+      for n in range(6):
+
+        tripId = '{}-{}-{}'.format(routeId, d, n)
+        arrival = time.strftime('%Y-%m-%dT%H:%M:%S-05:00', time.gmtime(at - 5 * 3600))
+
+        retVal.append({'type': 'prediction', 'id': '{}-{}'.format(tripId, stop['id']),
+                       'attributes': {'arrival_time': arrival, 'direction_id': int(d)},
+                       'relationships': {'trip': {'data': {'type': 'trip', 'id': tripId}},
+                                         'route': {'data': {'type': 'route', 'id': routeId}},
+                                         'stop': {'data': {'type': 'stop', 'id': stop['id']}}}})
+
+        at += rnd.randint(360, 900)
+
+  retVal.sort(key=lambda p: p['attributes']['arrival_time'])
+
+  return retVal
+
+
+# write generated fixtures
+def writeFixtures():
+
+  rnd = random.Random(SEED)
+  stops = stopResources(rnd)
+
+  saveFixtures({'routes': {'data': routeResources(rnd)},
+                'stops': {k: {'data': v} for k, v in stops.items()},
+                'predictions': {'data': predictionResources(rnd, stops)}})
+
+
+# record fixtures from API server at url
+def recordFixtures(url, key):
+
+  mbta = loadClient().mbta
+  client = mbta.MBTA(key, 3, apiUrl=url)
+
+  get = lambda endPoint, args: json.loads(client._request(endPoint, args).content)
+
+  routes = get('routes', mbta.ROUTE_ARGS)
+  routeIds = {r['attributes']['short_name']: r['id'] for r in routes['data']}
+
+  stops = {'{},{}'.format(routeId, d): get('stops', client._stopArgs(routeIds[routeId], d))
+           for routeId, count, street in STOP_ROUTES if routeId in routeIds for d in (0, 1)}
+
+  # predictions at every sixth stop, as the generated fixture has
+  keys = [(k.split(',')[0], k.split(',')[1], s['id'])
+          for k, doc in stops.items() for s in doc['data'][::6]]
+
+  saveFixtures({'routes': routes, 'stops': stops,
+                'predictions': get('predictions', client._batchArgs(keys))})
+
+  client.close()
+
+
+def saveFixtures(fixtures):
+
+  os.makedirs(FIXTURES, exist_ok=True)
+
+  for name, doc in fixtures.items():
+    with open(os.path.join(FIXTURES, name + '.json'), 'w') as f:
+      json.dump(doc, f, indent=1, sort_keys=True)
+      f.write('\n')
+
+
+# fixture documents as (parsed, raw bytes) by name
+def readFixtures():
+
+  retVal = dict()
+
+  for name in ('routes', 'stops', 'predictions'):
+    with open(os.path.join(FIXTURES, name + '.json'), 'rb') as f:
+      raw = f.read()
+      retVal[name] = (json.loads(raw), raw)
+
+  return retVal
+
+
+# location of every bus stop in the service area as (Stop, latitude, longitude)
+# stops come in pairs across the street sharing a name
+def networkStops(model, count=NETWORK_STOPS):
+
+  rnd = random.Random(SEED)
+  (south, west), (north, east) = SERVICE_AREA
+  retVal = []
+
+  while len(retVal) < count:
+
+    lat, lon = rnd.uniform(south, north), rnd.uniform(west, east)
+    name = stopName(rnd, rnd.choice(STREETS))
+
+    for side in (0, 1):
+      retVal.append((model.Stop.make(str(len(retVal)), name), lat + side * 0.0002, lon))
+
+  return retVal[:count]
+
+
+################ offline client ################
+
+class FixtureResponse():
+
+  def __init__(self, content):
+
+    self.status_code = 200
+    self.content = content
+    self.headers = dict()
+
+
+# MBTA client answered from fixtures, never touching the network
+def offlineClient(mod, fixtures):
+
+  client = mod.mbta.MBTA('bench', 3)
+
+  def request(endPoint, args=None, headers=None, priority=None):
+
+    query = {k: v[0] for k, v in parse_qs(args or '').items()}
+
+    if endPoint == 'stops':
+      doc = fixtures['stops'][0].get('{},{}'.format(query.get('filter[route]'),
+                                                    query.get('filter[direction_id]')),
+                                     {'data': []})
+      return FixtureResponse(json.dumps(doc).encode())
+
+    return FixtureResponse(fixtures[endPoint][1])
+
+  client._request = request
+
+  return client
+
+
+# GTFS static zip at path with every bus route, stops from the service area
+# return number of stop_times rows
+def writeGtfsFeed(mod, path):
+
+  rnd = random.Random(SEED)
+  network = networkStops(mod.model)
+  names = routeNames()
+  tables = {name: [header] for name, header in (
+    ('routes.txt', ('route_id', 'route_short_name', 'route_long_name', 'route_type', 'route_sort_order')),
+    ('directions.txt', ('route_id', 'direction_id', 'direction', 'direction_destination')),
+    ('route_patterns.txt', ('route_id', 'direction_id', 'route_pattern_typicality', 'representative_trip_id')),
+    ('trips.txt', ('route_id', 'service_id', 'trip_id', 'direction_id')),
+    ('stop_times.txt', ('trip_id', 'arrival_time', 'departure_time', 'stop_id', 'stop_sequence')),
+    ('stops.txt', ('stop_id', 'stop_name', 'stop_lat', 'stop_lon')),
+    ('feed_info.txt', ('feed_publisher_name', 'feed_version')))}
+
+  tables['feed_info.txt'].append(('MBTA', 'bench {}'.format(SEED)))
+  tables['stops.txt'].extend((stop.id, stop.name, lat, lon) for stop, lat, lon in network)
+
+  for order, routeId in enumerate(names):
+
+    tables['routes.txt'].append((routeId, routeId, '{} - {}'.format(*rnd.sample(STREETS, 2)), 3, order))
+    stops = [stop.id for stop, lat, lon in rnd.sample(network, GTFS_STOPS)]
+
+    for d, direction in enumerate(('Outbound', 'Inbound')):
+
+      tables['directions.txt'].append((routeId, d, direction, '{} Station'.format(rnd.choice(STREETS))))
+
+      for n in range(GTFS_TRIPS):
+
+        tripId = '{}-{}-{}'.format(routeId, d, n)
+        start = 5 * 3600 + n * 3600
+
+        tables['trips.txt'].append((routeId, 'weekday', tripId, d))
+        tables['stop_times.txt'].extend(
+          (tripId, '{:02}:{:02}:00'.format(t // 3600, t // 60 % 60), '{:02}:{:02}:00'.format(t // 3600, t // 60 % 60),
+           stopId, seq + 1)
+          for seq, stopId, t in ((seq, stopId, start + seq * 90) for seq, stopId in enumerate(stops)))
+
+        if n == 0:
+          tables['route_patterns.txt'].append((routeId, d, 1, tripId))
+
+      stops.reverse()
+
+  with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as feed:
+    for name, rows in tables.items():
+      text = io.StringIO()
+      csv.writer(text, lineterminator='\n').writerows(rows)
+      feed.writestr(name, text.getvalue())
+
+  return len(tables['stop_times.txt']) - 1
+
+
+_gtfs = None    # (catalog, import report) made on first use
+
+
+# catalog imported from generated feed, made once in a directory removed on exit
+# return (GtfsCatalog, dictionary of import measurements)
+def gtfsCatalog(mod):
+
+  global _gtfs
+
+  if _gtfs == None:
+
+    gtfs = importlib.import_module('mbtaskill.gtfs')
+    tmp = tempfile.mkdtemp(prefix='mbta-bench-')
+    atexit.register(shutil.rmtree, tmp, True)
+
+    feedPath, dbPath = os.path.join(tmp, 'feed.zip'), os.path.join(tmp, 'gtfs.db')
+    rows = writeGtfsFeed(mod, feedPath)
+
+    start = time.perf_counter()
+    routes = gtfs.importFeed(feedPath, dbPath)
+    secs = time.perf_counter() - start
+
+    catalog = gtfs.GtfsCatalog(dbPath)
+    _gtfs = (catalog, {'import seconds': round(secs, 2),
+                       'feed zip KB': os.path.getsize(feedPath) // 1024,
+                       'stop_times rows': rows,
+                       'catalog KB': os.path.getsize(dbPath) // 1024,
+                       'routes': routes,
+                       'stops': len(catalog.stopLocations())})
+
+  return _gtfs
+
+
+# client with route, direction and stop of a fixture route selected
+def selectedClient(mod, fixtures, routeId='66', direction='Inbound'):
+
+  client = offlineClient(mod, fixtures)
+  client.setRoute(routeId)
+  client.getDirections()
+  client.setDirection(direction)
+  client.setStop(list(client.getStops())[len(client.busStops) // 2])
+
+  return client
+
+
+# names as heard with a word dropped, for count names picked at random
+# return list of (utterance, name) tuples
+def misheard(names, count):
+
+  rnd = random.Random(SEED)
+  retVal = []
+
+  for name in rnd.sample(sorted(names), min(count, len(names))):
+    words = name.split()
+    del words[rnd.randrange(len(words))]
+    retVal.append((' '.join(words), name))
+
+  return retVal
+
+
+# utterances for stops on route
+def stopUtterances(client, count=20):
+
+  return [u for u, name in misheard(client.busStops, count)]
+
+
+################ benchmarks ################
+
+@bench('decode.predictions')
+def benchDecode(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+
+  return lambda: client._getData('predictions', 'filter[stop]=x')
+
+
+@bench('routes.buildRouteInfo')
+def benchRouteInfo(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+  routes = fixtures['routes'][0]['data']
+
+  return lambda: client._buildRouteInfo(routes)
+
+
+@bench('stops.getStops')
+def benchGetStops(mod, fixtures):
+
+  client = selectedClient(mod, fixtures)
+  stopList = client._stopList(fixtures['stops'][0]['66,1']['data'])
+
+  # dictionary of formatted names and match index, as a cache miss builds
+  return lambda: client._storeStops(('x', '1'), stopList)
+
+
+@bench('stops.api')
+def benchStopsApi(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+
+  # decoded and listed from API document, what the catalog replaces
+  return lambda: client._stopList(client._getData('stops', client._stopArgs('66', 1)))
+
+
+@bench('stops.catalog')
+def benchStopsCatalog(mod, fixtures):
+
+  catalog = gtfsCatalog(mod)[0]
+
+  return lambda: catalog.stops('66', 1)
+
+
+@bench('routes.catalog')
+def benchRoutesCatalog(mod, fixtures):
+
+  catalog = gtfsCatalog(mod)[0]
+
+  return catalog.routeInfo
+
+
+@bench('stops.catalogLocations')
+def benchStopLocations(mod, fixtures):
+
+  catalog = gtfsCatalog(mod)[0]
+
+  return catalog.stopLocations
+
+
+@bench('stops.formatStopName')
+def benchFormatStopName(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+  names = [s['attributes']['name'] for s in fixtures['stops'][0]['66,1']['data']]
+
+  return lambda: [client.formatStopName(n) for n in names]
+
+
+@bench('match.setStop')
+def benchSetStop(mod, fixtures):
+
+  client = selectedClient(mod, fixtures)
+  utterances = stopUtterances(client)
+
+  return lambda: [client._matchStop(u) for u in utterances]
+
+
+# stop name index over every bus stop, as boards are matched with
+# return (names, StopIndex)
+def networkIndex(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+  names = sorted({client.formatStopName(stop.name).lower() for stop, lat, lon in networkStops(mod.model)})
+
+  return names, mod.stopindex.StopIndex(names)
+
+
+# best fuzzy match over all names, what matching did before the index
+def linearMatch(fuzzy_match, names, utterance):
+
+  return max(names, key=lambda name: fuzzy_match(utterance.lower(), name.lower()))
+
+
+# names an index lookup ranks with fuzzy match
+def rankedNames(mod, index, utterance):
+
+  fuzzy_match = mod.stopindex.fuzzyMatcher()
+  ranked = []
+
+  mod.stopindex._fuzzyMatch = lambda x, against: ranked.append(against) or fuzzy_match(x, against)
+
+  try:
+    index.match(utterance)
+  finally:
+    mod.stopindex._fuzzyMatch = fuzzy_match
+
+  return len(ranked)
+
+
+@bench('match.linear.route')
+def benchLinearRoute(mod, fixtures):
+
+  client = selectedClient(mod, fixtures)
+  utterances = stopUtterances(client)
+  names, fuzzy_match = list(client.busStops), mod.stopindex.fuzzyMatcher()
+
+  return lambda: [linearMatch(fuzzy_match, names, u) for u in utterances]
+
+
+@bench('match.index.network')
+def benchIndexNetwork(mod, fixtures):
+
+  names, index = networkIndex(mod, fixtures)
+  utterances = [u for u, name in misheard(names, 5)]
+
+  return lambda: [index.match(u) for u in utterances]
+
+
+@bench('match.linear.network')
+def benchLinearNetwork(mod, fixtures):
+
+  names, index = networkIndex(mod, fixtures)
+  utterances = [u for u, name in misheard(names, 5)]
+  fuzzy_match = mod.stopindex.fuzzyMatcher()
+
+  return lambda: [linearMatch(fuzzy_match, names, u) for u in utterances]
+
+
+@bench('match.setDirection')
+def benchSetDirection(mod, fixtures):
+
+  client = selectedClient(mod, fixtures)
+  utterances = ['inbound', 'outbound', client.currentRoute.dest[0].lower(),
+                client.currentRoute.dest[1].lower()]
+
+  return lambda: [client.setDirection(u) for u in utterances]
+
+
+@bench('predictions.build')
+def benchBuildPredictions(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+  predictions = fixtures['predictions'][0]['data']
+
+  return lambda: client._buildPredictions(predictions)
+
+
+@bench('predictions.group')
+def benchGroupPredictions(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+  predictions = fixtures['predictions'][0]['data']
+
+  return lambda: client._groupPredictions(predictions)
+
+
+@bench('tracking.update')
+def benchTrackingUpdate(mod, fixtures):
+
+  predictions = offlineClient(mod, fixtures)._groupPredictions(fixtures['predictions'][0]['data'])
+  key, predTimes = max(predictions.items(), key=lambda kv: len(kv[1]))
+  tracker = mod.mbta.Tracker(key[0], key[0], key[1], key[2], 'stop', predTimes[2].trip_id)
+
+  return lambda: tracker.update(predTimes)
+
+
+@bench('tracking.continue')
+def benchContinueTracking(mod, fixtures):
+
+  client = selectedClient(mod, fixtures)
+  client.predTimes = client._buildPredictions(fixtures['predictions'][0]['data'])
+  client.lastTrack = client.predTimes[len(client.predTimes) // 2].trip_id
+
+  return client._continueTracking
+
+
+@bench('announce.waitBuckets')
+def benchWaitBuckets(mod, fixtures):
+
+  eta = mod.arrivals.arrivalArray(mod.arrivals.parseArrival(p['attributes']['arrival_time'])
+                                  for p in fixtures['predictions'][0]['data'][:3])
+  now = eta[0] - 300
+
+  return lambda: mod.arrivals.waitBuckets(eta, now)
+
+
+# bytes still allocated by what fn returns, once everything else
+# it allocated is freed
+def retainedBytes(fn):
+
+  gc.collect()
+  tracemalloc.start()
+
+  try:
+    before = tracemalloc.get_traced_memory()[0]
+    result = fn()
+    gc.collect()
+    retVal = tracemalloc.get_traced_memory()[0] - before
+  finally:
+    tracemalloc.stop()
+
+  del result
+
+  return retVal
+
+
+# routes, stop lists and predictions kept from freshly decoded
+# fixture documents, as dictionaries and tuples of strings the way
+# they were kept before the model types, and as the model types
+# arrival times parsed earlier are remembered, each starts without them
+@report('memory.model')
+def reportMemory(mod, fixtures):
+
+  client = offlineClient(mod, fixtures)
+  raw = {name: json.dumps(doc).encode() for name, (doc, content) in fixtures.items()}
+  retVal = dict()
+
+  dictRoutes = lambda: {rt['attributes']['short_name']: {'id': rt['id'],
+                                                         'short_name': rt['attributes']['short_name'],
+                                                         'long_name': rt['attributes']['long_name'],
+                                                         'dirs': rt['attributes']['direction_names'],
+                                                         'dest': rt['attributes']['direction_destinations']}
+                        for rt in json.loads(raw['routes'])['data']}
+  tupleStops = lambda: {key: [(stop['attributes']['name'], stop['id']) for stop in doc['data']]
+                        for key, doc in json.loads(raw['stops']).items()}
+  tuplePredictions = lambda: [(x['attributes']['arrival_time'], x['relationships']['trip']['data']['id'])
+                              for x in json.loads(raw['predictions'])['data']]
+
+  modelPredictions = lambda: client._buildPredictions(json.loads(raw['predictions'])['data'])
+
+  # predictions without the arrival strings the parse cache remembers
+  def uncachedPredictions():
+    retVal = modelPredictions()
+    mod.arrivals.parseArrival.cache_clear()
+    return retVal
+
+  for label, before, after in (
+      ('routes', dictRoutes, lambda: client._buildRouteInfo(json.loads(raw['routes'])['data'])),
+      ('stop lists', tupleStops, lambda: {key: client._stopList(doc['data'])
+                                          for key, doc in json.loads(raw['stops']).items()}),
+      ('predictions', tuplePredictions, uncachedPredictions)):
+
+    mod.arrivals.parseArrival.cache_clear()
+
+    retVal[label + ' before bytes'] = retainedBytes(before)
+    retVal[label + ' model bytes'] = retainedBytes(after)
+
+  # parse cache is bounded, it holds a few polls worth of arrival strings
+  retVal['arrival parse cache bytes'] = retainedBytes(modelPredictions) - retVal['predictions model bytes']
+  mod.arrivals.parseArrival.cache_clear()
+
+  return retVal
+
+
+# time to import generated feed with every bus route and the sizes of feed and catalog
+@report('catalog.import')
+def reportImport(mod, fixtures):
+
+  return gtfsCatalog(mod)[1]
+
+
+# names scored by an index lookup against every name scored by a
+# linear match, and how often each finds the name misheard
+@report('match.candidates')
+def reportCandidates(mod, fixtures):
+
+  client = selectedClient(mod, fixtures)
+  fuzzy_match = mod.stopindex.fuzzyMatcher()
+  retVal = dict()
+
+  for label, (names, index), count in (('route', (list(client.busStops), client.stopIndex), 40),
+                                       ('network', networkIndex(mod, fixtures), 100)):
+
+    heard = misheard(names, count)
+
+    retVal[label + ' names'] = len(names)
+    retVal[label + ' names ranked per lookup'] = round(sum(rankedNames(mod, index, u) for u, name in heard)
+                                                        / len(heard), 1)
+    retVal[label + ' index correct %'] = round(100 * sum(index.match(u)[0] == name for u, name in heard)
+                                               / len(heard))
+    retVal[label + ' linear correct %'] = round(100 * sum(linearMatch(fuzzy_match, names, u) == name
+                                                          for u, name in heard) / len(heard))
+    retVal[label + ' same pick as linear %'] = round(100 * sum(index.match(u)[0] == linearMatch(fuzzy_match, names, u)
+                                                               for u, name in heard) / len(heard))
+
+  return retVal
+
+
+# predicted arrival of each trip at every replay step, None once it has arrived
+# a bus is sometimes held up or makes up time, about once in ten minutes
+# return list of (trip id, predictions) tuples
+def predictionTimeline(rnd, start):
+
+  retVal = []
+  eta = start + rnd.randint(900, 2400)
+  steps = (eta + REPLAY_TRIPS * REPLAY_HEADWAY[1] - start) // REPLAY_STEP
+
+  for n in range(REPLAY_TRIPS):
+
+    arrival = eta
+    predictions = []
+
+    for step in range(steps):
+
+      t = start + step * REPLAY_STEP
+
+      if t >= arrival:
+        predictions.append(None)
+        continue
+
+      chance = rnd.random() * 600 / REPLAY_STEP
+
+      if chance < 0.7:
+        arrival += rnd.randint(60, 180)
+      elif chance < 1:
+        arrival = max(t + 30, arrival - rnd.randint(60, 120))
+
+      predictions.append(arrival)
+
+    retVal.append(('replay-{}'.format(n), predictions))
+    eta += rnd.randint(*REPLAY_HEADWAY)
+
+  return retVal
+
+
+# replay one tracking session polled with adaptive delays or a fixed interval
+# return dictionary of requests, stale seconds and seconds tracked after last bus
+def replaySession(mod, fixtures, rnd, adaptive):
+
+  client = selectedClient(mod, fixtures)
+  start = int(time.time())
+  timeline = predictionTimeline(rnd, start)
+  now = start
+
+  # server document at time now, upcoming trips in arrival order
+  def request(endPoint, args=None, headers=None, priority=None):
+
+    step = min((now - start) // REPLAY_STEP, len(timeline[0][1]) - 1)
+    upcoming = sorted((p[step], tripId) for tripId, p in timeline if p[step] != None)
+    data = [{'type': 'prediction', 'id': tripId,
+             'attributes': {'arrival_time': time.strftime('%Y-%m-%dT%H:%M:%S-05:00',
+                                                          time.gmtime(at - 5 * 3600)),
+                            'direction_id': client.currentDirection},
+             'relationships': {'trip': {'data': {'type': 'trip', 'id': tripId}},
+                               'route': {'data': {'type': 'route', 'id': client.currentRoute.id}},
+                               'stop': {'data': {'type': 'stop', 'id': client.stopId}}}}
+            for at, tripId in upcoming]
+
+    return FixtureResponse(json.dumps({'data': data}).encode())
+
+  client._request = request
+  client.startTracking()
+  tracker = client.getTrackers()[0]
+  lastArrival = next(p for tripId, p in timeline if tripId == tracker.lastTrack)
+  lastArrival = start + lastArrival.index(None) * REPLAY_STEP
+
+  retVal = {'requests': 1, 'stale': 0, 'staleNear': 0, 'after': 0}
+  due = now
+
+  while client.trackerCount() > 0:
+
+    if now >= due:
+
+      if now > start:
+        client.updateTrackers()
+        retVal['requests'] += 1
+
+      delay = (mod.arrivals.pollDelay([tracker.eta], POLL_FLOOR, POLL_CEILING, tracker.drift, now)
+               if adaptive else POLL_FLOOR)
+      due = now + delay
+
+    # tracked arrivals off by enough to be announced again
+    step = (now - start) // REPLAY_STEP
+    predicted = dict((tripId, p[step]) for tripId, p in timeline)
+
+    for tripId, heard in zip(tracker.trips, tracker.eta or []):
+
+      at = predicted[tripId]
+
+      if at != None and abs(at - heard) >= mod.mbta.CHANGE_SECS:
+        retVal['stale'] += REPLAY_STEP
+        retVal['staleNear'] += REPLAY_STEP if at - now <= REPLAY_NEAR else 0
+        break
+
+    if now > lastArrival:
+      retVal['after'] += REPLAY_STEP
+
+    now += REPLAY_STEP
+
+  return retVal
+
+
+# tracking sessions replayed with fixed interval and adaptive polling
+# requests made, seconds an announced arrival was a minute or more off
+# the server's prediction, and seconds tracked after the last bus came
+@report('tracking.replay')
+def reportReplay(mod, fixtures):
+
+  retVal = dict()
+
+  for label, adaptive in (('fixed', False), ('adaptive', True)):
+
+    rnd = random.Random(SEED)
+    sessions = [replaySession(mod, fixtures, rnd, adaptive) for n in range(REPLAY_SESSIONS)]
+    average = lambda k: round(sum(s[k] for s in sessions) / len(sessions), 1)
+
+    retVal[label + ' requests per session'] = average('requests')
+    retVal[label + ' stale seconds'] = average('stale')
+    retVal[label + ' stale seconds near arrival'] = average('staleNear')
+    retVal[label + ' seconds after last bus'] = average('after')
+
+  return retVal
+
+
+# metrics registry after a session's worth of requests, as each records them
+def usedMetrics(mod):
+
+  client = mod.mbta.MBTA('bench', 3)
+
+  for n in range(200):
+    endPoint = ('predictions', 'stops', 'routes')[n % 3]
+    client._recordRequest(endPoint, (200, 200, 304, 503, None)[n % 5], n / 400)
+    client.metrics.inc('mbta_response_bytes_total', 1000 + n, endpoint=endPoint)
+
+  return client
+
+
+@bench('metrics.inc')
+def benchMetricsInc(mod, fixtures):
+
+  metrics = usedMetrics(mod).metrics
+
+  return lambda: metrics.inc('mbta_requests_total', endpoint='predictions', result='ok')
+
+
+@bench('metrics.observe')
+def benchMetricsObserve(mod, fixtures):
+
+  metrics = usedMetrics(mod).metrics
+
+  return lambda: metrics.observe('mbta_request_seconds', 0.2, endpoint='predictions')
+
+
+@bench('metrics.recordRequest')
+def benchRecordRequest(mod, fixtures):
+
+  client = usedMetrics(mod)
+
+  return lambda: client._recordRequest('predictions', 200, 0.2)
+
+
+@bench('metrics.prometheusText')
+def benchPrometheusText(mod, fixtures):
+
+  metrics = usedMetrics(mod).metrics
+
+  return lambda: mod.metrics.prometheusText(metrics)
+
+
+# time metrics add to each request, and as a share of decoding the
+# predictions fixture, the smallest part of a request a user waits for
+@report('metrics.overhead')
+def reportMetricsOverhead(mod, fixtures):
+
+  client = usedMetrics(mod)
+  record = timeCall(lambda: (client._recordRequest('predictions', 200, 0.2),
+                             client.metrics.inc('mbta_response_bytes_total', 1000, endpoint='predictions')))
+  decode = timeCall(lambda: json.loads(fixtures['predictions'][1]))
+
+  return {'us per request': round(record, 2),
+          'predictions decode us': round(decode, 1),
+          'share of decode %': round(100 * record / decode, 2)}
+
+
+# hours and minutes to wait the way announcements worked them out
+# before arrival times were parsed once, from ISO strings and the
+# time in Boston, now is naive Boston time or None for the current time
+def strptimeBuckets(eta, now=None):
+
+  from pytz import timezone
+  import datetime
+
+  currentTime = now or datetime.datetime.now(timezone('America/New_York')).replace(tzinfo=None)
+  eta = [datetime.datetime.strptime(x[0:-6], '%Y-%m-%dT%H:%M:%S') for x in eta]
+
+  return [(w.seconds // 3600, (w.seconds % 3600) // 60) for w in (x - currentTime for x in eta if x > currentTime)]
+
+
+# arrival strings of tracked buses, as one tracking tick announces
+# them, announce.waitBuckets times the same tick from epoch seconds
+def trackedArrivals(fixtures):
+
+  return [p['attributes']['arrival_time'] for p in fixtures['predictions'][0]['data'][:3]]
+
+
+@bench('announce.strptimeBuckets')
+def benchStrptimeBuckets(mod, fixtures):
+
+  try:
+    import pytz
+  except ImportError:
+    return None
+
+  eta = trackedArrivals(fixtures)
+
+  return lambda: strptimeBuckets(eta)
+
+
+# waits announced from epoch seconds against the old string arithmetic,
+# for every minute of the hour before the first fixture arrival
+@report('announce.agreement')
+def reportAgreement(mod, fixtures):
+
+  import datetime
+
+  try:
+    import pytz
+  except ImportError:
+    return {'skipped, pytz not installed': 0}
+
+  strings = trackedArrivals(fixtures)
+  eta = mod.arrivals.arrivalArray(map(mod.arrivals.parseArrival, strings))
+  first = datetime.datetime.strptime(strings[0][0:-6], '%Y-%m-%dT%H:%M:%S')
+  same = 0
+
+  for minute in range(60):
+    now = first - datetime.timedelta(minutes=minute, seconds=17)
+    same += strptimeBuckets(strings, now) == mod.arrivals.waitBuckets(eta, eta[0] - minute * 60 - 17)
+
+  return {'minutes compared': 60, 'same waits': same}
+
+
+# run in a new interpreter, times imports the skill makes when it loads
+# and those its startup thread makes, as milliseconds
+IMPORT_SCRIPT = '''
+import importlib.util, types, time, json, sys
+pkg = types.ModuleType('mbtaskill')
+pkg.__path__ = [sys.argv[1]]
+sys.modules['mbtaskill'] = pkg
+retVal = dict()
+start = time.perf_counter()
+for name in ('gtfs', 'shortcuts', 'metrics', 'arrivals', 'warmup'):
+  importlib.import_module('mbtaskill.' + name)
+retVal['skill load imports ms'] = (time.perf_counter() - start) * 1000
+retVal['requests loaded with skill'] = int('requests' in sys.modules)
+start = time.perf_counter()
+importlib.import_module('mbtaskill.mbta')
+retVal['startup thread imports ms'] = (time.perf_counter() - start) * 1000
+try:
+  import mycroft
+except ImportError:
+  pass
+else:
+  spec = importlib.util.spec_from_file_location('skill', sys.argv[1] + '/__init__.py',
+                                                submodule_search_locations=[sys.argv[1]])
+  skill = sys.modules['skill'] = importlib.util.module_from_spec(spec)
+  start = time.perf_counter()
+  spec.loader.exec_module(skill)
+  retVal['skill module ms'] = (time.perf_counter() - start) * 1000
+print(json.dumps(retVal))
+'''
+
+
+# import times at startup, best of several new interpreters
+# the skill module itself is only timed where Mycroft is installed
+@report('startup.imports')
+def reportImports(mod, fixtures):
+
+  runs = [json.loads(subprocess.check_output([sys.executable, '-c', IMPORT_SCRIPT, ROOT]))
+          for n in range(REPEAT)]
+
+  retVal = {k: round(min(r[k] for r in runs), 1) for k in runs[0]}
+
+  if 'skill module ms' not in retVal:
+    retVal['skill module ms, needs Mycroft'] = 'skipped'
+
+  return retVal
+
+
+@bench('startup.client')
+def benchClient(mod, fixtures):
+
+  return lambda: mod.mbta.MBTA('bench', 3).close()
+
+
+@bench('startup.shortcutNames')
+def benchShortcutNames(mod, fixtures):
+
+  shortcuts = importlib.import_module('mbtaskill.shortcuts')
+  tmp = tempfile.mkdtemp(prefix='mbta-bench-')
+  atexit.register(shutil.rmtree, tmp, True)
+  path = os.path.join(tmp, 'shortcuts.db')
+  store = shortcuts.ShortcutStore(path)
+
+  for n in range(20):
+    store.save('shortcut {}'.format(n), mod.model.SavedRoute('66', '66', 1, str(n), 'stop {}'.format(n)))
+
+  store.db.close()
+
+  # opened as startup does, then names read for vocabulary
+  def openNames():
+    store = shortcuts.ShortcutStore(path)
+    store.names()
+    store.db.close()
+
+  return openNames
+
+
+# random locations in the service area
+def serviceLocations(count, seed=SEED):
+
+  rnd = random.Random(seed)
+  (south, west), (north, east) = SERVICE_AREA
+
+  return [(rnd.uniform(south, north), rnd.uniform(west, east)) for n in range(count)]
+
+
+# great circle meters between two latitude, longitude points
+def haversine(lat1, lon1, lat2, lon2):
+
+  p1, p2 = math.radians(lat1), math.radians(lat2)
+  a = (math.sin((p2 - p1) / 2) ** 2 +
+       math.cos(p1) * math.cos(p2) * math.sin(math.radians(lon2 - lon1) / 2) ** 2)
+
+  return 2 * EARTH_METERS * math.asin(math.sqrt(a))
+
+
+# k stops nearest location by measuring every stop, as list of (meters, Stop)
+def bruteNearest(stops, lat, lon, k, maxMeters):
+
+  near = heapq.nsmallest(k, ((haversine(lat, lon, sLat, sLon), stop) for stop, sLat, sLon in stops),
+                         key=lambda f: f[0])
+
+  return [f for f in near if f[0] <= maxMeters]
+
+
+@bench('nearby.gridBuild')
+def benchGridBuild(mod, fixtures):
+
+  stopgrid = importlib.import_module('mbtaskill.stopgrid')
+  stops = networkStops(mod.model)
+
+  return lambda: stopgrid.StopGrid(stops)
+
+
+@bench('nearby.grid')
+def benchGridNearest(mod, fixtures):
+
+  grid = importlib.import_module('mbtaskill.stopgrid').StopGrid(networkStops(mod.model))
+  locations = serviceLocations(20)
+
+  return lambda: [grid.nearest(lat, lon, mod.mbta.NEARBY_STOPS, mod.mbta.NEARBY_METERS)
+                  for lat, lon in locations]
+
+
+@bench('nearby.bruteForce')
+def benchBruteNearest(mod, fixtures):
+
+  stops = networkStops(mod.model)
+  locations = serviceLocations(20)
+
+  return lambda: [bruteNearest(stops, lat, lon, mod.mbta.NEARBY_STOPS, mod.mbta.NEARBY_METERS)
+                  for lat, lon in locations]
+
+
+# grid answers against great circle distances to every stop, same
+# stops found and how far the grid's flat distances are off
+@report('nearby.correctness')
+def reportNearby(mod, fixtures):
+
+  stops = networkStops(mod.model)
+  grid = importlib.import_module('mbtaskill.stopgrid').StopGrid(stops)
+  k, maxMeters = mod.mbta.NEARBY_STOPS, mod.mbta.NEARBY_METERS
+  sameNearest = sameStops = 0
+  error = 0.0
+
+  for lat, lon in serviceLocations(NEARBY_QUERIES, SEED + 1):
+
+    found = grid.nearest(lat, lon, k, maxMeters)
+    expected = bruteNearest(stops, lat, lon, k, maxMeters)
+
+    sameStops += {s.id for m, s in found} == {s.id for m, s in expected}
+    sameNearest += [s.id for m, s in found[:1]] == [s.id for m, s in expected[:1]]
+
+    # nearest stops found by both
+    distances = {s.id: m for m, s in expected}
+    error = max([error] + [abs(m - distances[s.id]) for m, s in found if s.id in distances])
+
+  return {'locations': NEARBY_QUERIES,
+          'same nearest stop %': round(100 * sameNearest / NEARBY_QUERIES),
+          'same stops %': round(100 * sameStops / NEARBY_QUERIES),
+          'most meters off': round(error, 2)}
+
+
+# route name the way the skill cleaned up a spoken route before the grammar
+def replaceChain(routeName):
+
+  routeName = routeName.replace('crosstown ', 'CT')
+  routeName = routeName.replace('silverline ', 'SL')
+  routeName = routeName.replace('to', '2')
+  routeName = routeName.replace('for', '4')
+
+  return routeName.upper()
+
+
+# ways of saying each route as (form, utterance, short name) tuples
+def routeUtterances(rg, routes, vocLines):
+
+  retVal = []
+  homophones = {h: str(n) for n, words in rg.HOMOPHONES.items() for h in words}
+  spoken = {'sl': 'silverline', 'ct': 'crosstown'}
+
+  # vocabulary lines naming a route, homophones are said for digits
+  for line in vocLines:
+
+    tokens = [homophones.get(t, t) for t in line.lower().split()]
+    shortName = ''.join(tokens).replace('silverline', 'SL').replace('crosstown', 'CT').upper()
+
+    if shortName in routes:
+      retVal.append(('voc line', line, shortName))
+
+  for shortName in routes:
+
+    chunks = rg.tokenize(shortName)
+    prefix = chunks[0] if chunks[0] in spoken else None
+    number = next(c for c in chunks if c.isdigit())
+    letters = [c for c in chunks if not c.isdigit() and c != prefix]
+    words = [' '.join(w) for w in rg.numberWords(int(number))]
+    say = lambda n, p=prefix: ' '.join(([p] if p else []) + [n] + letters)
+
+    retVal.append(('digits', shortName, shortName))
+    retVal.append(('number words', say(words[0]), shortName))
+    retVal.append(('with filler', 'route ' + say(words[0]), shortName))
+
+    # said as digits in two parts, "one eleven"
+    for short in [w for w in words if int(number) >= 100 and 'hundred' not in w][:1]:
+      retVal.append(('three digit short', say(short), shortName))
+
+    if prefix:
+      retVal.append(('spoken prefix + words', say(words[0], spoken[prefix]), shortName))
+
+    for h in rg.HOMOPHONES.get(int(number), [])[:1]:
+      retVal.append(('homophone', say(h, spoken.get(prefix)), shortName))
+
+    if letters:
+      retVal.append(('letter suffix spaced', '{} {}'.format(number, ' '.join(letters)), shortName))
+
+  return retVal
+
+
+# routes from fixture and lines of route name vocabulary
+def grammarInputs(mod, fixtures):
+
+  rg = importlib.import_module('mbtaskill.routegrammar')
+  routes = offlineClient(mod, fixtures)._buildRouteInfo(fixtures['routes'][0]['data'])
+  vocLines = rg.readVoc(os.path.join(ROOT, 'vocab', 'en-us', 'Route.Name.voc'))
+
+  return rg, routes, vocLines
+
+
+@bench('routes.grammarBuild')
+def benchGrammarBuild(mod, fixtures):
+
+  rg, routes, vocLines = grammarInputs(mod, fixtures)
+
+  return lambda: rg.RouteGrammar(routes, vocLines)
+
+
+@bench('routes.grammarResolve')
+def benchGrammarResolve(mod, fixtures):
+
+  rg, routes, vocLines = grammarInputs(mod, fixtures)
+  grammar = rg.RouteGrammar(routes, vocLines)
+  utterances = [u for form, u, shortName in routeUtterances(rg, routes, vocLines)][::8]
+
+  return lambda: [grammar.resolve(u) for u in utterances]
+
+
+@bench('routes.replaceChain')
+def benchReplaceChain(mod, fixtures):
+
+  rg, routes, vocLines = grammarInputs(mod, fixtures)
+  utterances = [u for form, u, shortName in routeUtterances(rg, routes, vocLines)][::8]
+
+  return lambda: [routes.get(replaceChain(u)) for u in utterances]
+
+
+# routes found for each way of saying them by the replace chain
+# and by the grammar, as its best answer and among its alternatives
+@report('routes.grammar')
+def reportGrammar(mod, fixtures):
+
+  rg, routes, vocLines = grammarInputs(mod, fixtures)
+  grammar = rg.RouteGrammar(routes, vocLines)
+  retVal = {'phrases': len(grammar.phrases)}
+  counts = dict()
+
+  for form, utterance, shortName in routeUtterances(rg, routes, vocLines):
+
+    found = [f[0] for f in grammar.resolve(utterance)]
+    c = counts.setdefault(form, [0, 0, 0, 0])
+
+    c[0] += 1
+    c[1] += replaceChain(utterance) == shortName
+    c[2] += found[:1] == [shortName]
+    c[3] += shortName in found
+
+  counts['total'] = [sum(c[n] for c in counts.values()) for n in range(4)]
+
+  for form, c in counts.items():
+    for label, n in zip(('cases', 'old top1', 'new top1', 'new top3'), c):
+      retVal['{} {}'.format(form, label)] = n
+
+  return retVal
+
+
+################ runner ################
+
+# best time per call in microseconds
+def timeCall(fn):
+
+  timer = timeit.Timer(fn)
+  number, secs = timer.autorange()
+  number = max(1, int(number * MIN_SECS / max(secs, 1e-9)))
+
+  return min(timer.repeat(REPEAT, number)) / number * 1e6
+
+
+def readResults():
+
+  try:
+    with open(RESULTS) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {'timings': {}, 'reports': {}}
+
+
+def main():
+
+  parser = argparse.ArgumentParser(description='Offline benchmarks for the MBTA client')
+  parser.add_argument('-k', dest='only', default='', help='run benchmarks whose name contains this')
+  parser.add_argument('--save', action='store_true', help='save results as the new baseline')
+  parser.add_argument('--check', action='store_true', help='exit 1 if a speedup or result fell short')
+  parser.add_argument('--write-fixtures', action='store_true', help='generate fixtures')
+  parser.add_argument('--record', metavar='URL', help='record fixtures from API server')
+  parser.add_argument('--key', default=None, help='API key for --record')
+  args = parser.parse_args()
+
+  if args.write_fixtures:
+    return writeFixtures()
+
+  if args.record:
+    return recordFixtures(args.record, args.key)
+
+  mod = loadClient()
+  fixtures = readFixtures()
+  saved = readResults()
+  timings = dict()
+  reports = dict()
+  failed = []
+
+  print('{:<36}{:>12}{:>12}{:>9}'.format('benchmark', 'us/call', 'saved', 'change'))
+
+  for name, setup in BENCHES:
+
+    if args.only not in name:
+      continue
+
+    fn = setup(mod, fixtures)
+
+    # benchmark needs something not installed
+    if fn == None:
+      print('{:<36}{:>12}'.format(name, 'skipped'))
+      continue
+
+    us = timings[name] = round(timeCall(fn), 3)
+    before = saved['timings'].get(name)
+    change = '' if before == None else '{:+.0%}'.format(us / before - 1)
+
+    print('{:<36}{:>12.2f}{:>12}{:>9}'.format(name, us, '' if before == None else '{:.2f}'.format(before), change))
+
+  for name, fn in REPORTS:
+
+    if args.only not in name:
+      continue
+
+    reports[name] = fn(mod, fixtures)
+    before = saved['reports'].get(name)
+
+    print('\n{}'.format(name))
+
+    for k, v in reports[name].items():
+      print('  {:<34}{:>12}{:>12}'.format(k, v, '' if before == None else str(before.get(k, ''))))
+
+  # speedups measured in this run, so they hold on any machine
+  speedups = [(slow, fast, least) for slow, fast, least in SPEEDUPS if slow in timings and fast in timings]
+
+  if speedups:
+    print('\n{:<60}{:>8}{:>8}'.format('speedup', 'times', 'least'))
+
+  for slow, fast, least in speedups:
+
+    times = timings[slow] / timings[fast]
+    print('{:<60}{:>8.1f}{:>8}'.format('{} / {}'.format(slow, fast), times, least))
+
+    if times < least:
+      failed.append('{} / {}'.format(slow, fast))
+
+  for name, key, least in EXPECTED:
+    if name in reports and reports[name][key] < least:
+      failed.append('{} {}'.format(name, key))
+
+  if failed:
+    print('\nfell short: {}'.format(', '.join(failed)))
+
+  if args.save:
+
+    saved['timings'].update(timings)
+    saved['reports'].update(reports)
+    saved['machine'] = '{} {} Python {}'.format(platform.system(), platform.machine(),
+                                                platform.python_version())
+
+    with open(RESULTS, 'w') as f:
+      json.dump(saved, f, indent=1, sort_keys=True)
+      f.write('\n')
+
+  if args.check and failed:
+    sys.exit(1)
+
+
+if __name__ == '__main__':
+  main()
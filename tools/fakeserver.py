@@ -0,0 +1,312 @@
+#!/usr/bin/env python3
+#
+# Stand-in for the MBTA V3 API, for load testing the skill
+# without using up the real API's rate limit.
+#
+# Serves /routes, /stops and /predictions (also as a server-sent
+# event stream) from fixture data, with configurable latency,
+# injected server (5xx) and rate limit (429) errors and a
+# per-minute rate limit.  Predicted arrivals drift slowly over
+# time so tracking sees changes.
+#
+#   python3 tools/fakeserver.py --port 8080 --latency-mean 80 --error-rate 0.01
+#
+# then create MBTA with apiUrl='http://localhost:8080'.
+#
+# A fixture file is JSON with the "data" lists of recorded
+# /routes responses and /stops responses keyed by "route,direction":
+#   {"routes": [...], "stops": {"66,0": [...], "66,1": [...]}}
+# Without one a synthetic set of routes and stops is served.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import argparse
+import datetime
+import random
+import zlib
+import json
+import math
+import time
+
+HEADWAY_SECS = 600      # time between buses on each route
+DRIFT_SECS = 90         # how far a prediction wanders from schedule
+DRIFT_PERIOD = 900      # seconds for a prediction to wander and return
+PREDICTION_COUNT = 6    # predictions served per route, direction and stop
+STREAM_TICK = 5         # seconds between stream updates
+SYNTHETIC_ORIGIN = (42.30, -71.15)  # south west corner of synthetic stops
+STOP_SPACING = 0.003    # degrees between synthetic routes and between their stops
+
+
+# synthetic routes and stops
+def syntheticFixtures(routeCount, stopCount):
+
+  routes = []
+  stops = dict()
+
+  for r in range(1, routeCount + 1):
+
+    routeId = str(r)
+
+    routes.append({'type': 'route', 'id': routeId,
+                   'attributes': {'short_name': routeId,
+                                  'long_name': 'Route {}'.format(r),
+                                  'direction_names': ['Outbound', 'Inbound'],
+                                  'direction_destinations': ['Terminal {}A'.format(r),
+                                                             'Terminal {}B'.format(r)]}})
+
+    for d in (0, 1):
+      # routes run east-west a few hundred meters apart, stops likewise along them
+      stops['{},{}'.format(routeId, d)] = [
+        {'type': 'stop', 'id': '{}-{}'.format(routeId, s),
+         'attributes': {'name': 'Main St @ {} St'.format(s),
+                        'latitude': round(SYNTHETIC_ORIGIN[0] + r * STOP_SPACING, 6),
+                        'longitude': round(SYNTHETIC_ORIGIN[1] + s * STOP_SPACING, 6)}}
+        for s in (range(stopCount) if d == 0 else reversed(range(stopCount)))]
+
+  return {'routes': routes, 'stops': stops}
+
+
+class FakeApi():
+
+  def __init__(self, fixtures, args):
+
+    self.routes = fixtures['routes']
+    self.stops = fixtures['stops']
+    self.args = args
+    self.window = (0, 0)    # start of rate limit window, requests in it
+
+    # direction(s) and order of each stop on each route
+    self.stopOrder = dict()
+    for key, stopList in self.stops.items():
+      routeId, d = key.split(',')
+      for idx, stop in enumerate(stopList):
+        self.stopOrder[(routeId, int(d), stop['id'])] = idx
+
+  # seconds to wait before answering
+  def latency(self):
+
+    if self.args.latency_dist == 'exponential':
+      ms = random.expovariate(1 / self.args.latency_mean) if self.args.latency_mean > 0 else 0
+    else:
+      ms = random.gauss(self.args.latency_mean, self.args.latency_sd)
+
+    return max(0, ms) / 1000
+
+  # count request against rate limit
+  # return headers to send and True if request is over the limit
+  def rateLimit(self):
+
+    now = time.time()
+    start, count = self.window
+
+    if now - start >= 60:
+      start, count = now, 0
+
+    count += 1
+    self.window = (start, count)
+
+    headers = {'x-ratelimit-limit': str(self.args.rate_limit),
+               'x-ratelimit-remaining': str(max(0, self.args.rate_limit - count)),
+               'x-ratelimit-reset': str(int(start + 60))}
+
+    return headers, count > self.args.rate_limit
+
+  def getRoutes(self, query):
+    return self.routes
+
+  def getStops(self, query):
+
+    routeId = query.get('filter[route]', [''])[0]
+    d = query.get('filter[direction_id]', ['0'])[0]
+
+    # every stop, once, when not asked for one route
+    if routeId == '':
+      return list({stop['id']: stop for stopList in self.stops.values() for stop in stopList}.values())
+
+    return self.stops.get('{},{}'.format(routeId, d), [])
+
+  # predictions for every route, direction and stop matching query
+  # arrivals follow a fixed headway plus a slow drift
+  def getPredictions(self, query, now=None):
+
+    now = now or time.time()
+
+    routes = set(query.get('filter[route]', [''])[0].split(',')) if 'filter[route]' in query else None
+    stops = set(query.get('filter[stop]', [''])[0].split(','))
+    direction = query.get('filter[direction_id]', [None])[0]
+
+    retVal = []
+    tz = datetime.timezone(datetime.timedelta(hours=-4))
+
+    for (routeId, d, stopId), idx in self.stopOrder.items():
+
+      if (routes != None and routeId not in routes) or stopId not in stops:
+        continue
+
+      if direction != None and int(direction) != d:
+        continue
+
+      # buses leave terminal every headway, reach stop idx minutes later
+      offset = idx * 60 + zlib.crc32(routeId.encode()) % HEADWAY_SECS
+      first = int((now - offset) // HEADWAY_SECS) + 1
+
+      for n in range(first, first + PREDICTION_COUNT):
+
+        drift = DRIFT_SECS * math.sin(2 * math.pi * now / DRIFT_PERIOD + n)
+        arrival = datetime.datetime.fromtimestamp(n * HEADWAY_SECS + offset + drift, tz)
+        tripId = '{}-{}-{}'.format(routeId, d, n)
+
+        retVal.append({'type': 'prediction',
+                       'id': '{}-{}'.format(tripId, stopId),
+                       'attributes': {'arrival_time': arrival.isoformat(timespec='seconds'),
+                                      'direction_id': d},
+                       'relationships': {'trip': {'data': {'type': 'trip', 'id': tripId}},
+                                         'route': {'data': {'type': 'route', 'id': routeId}},
+                                         'stop': {'data': {'type': 'stop', 'id': stopId}}}})
+
+    retVal.sort(key=lambda p: p['attributes']['arrival_time'])
+
+    return retVal
+
+
+class Handler(BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True   # headers and body are written separately
+  api = None
+
+  def log_message(self, *args):
+    pass
+
+  def send(self, status, body, headers):
+
+    self.send_response(status)
+
+    for k, v in headers.items():
+      self.send_header(k, v)
+
+    self.send_header('Content-Type', 'application/vnd.api+json')
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  # write one chunk of a chunked response
+  def chunk(self, data):
+
+    self.wfile.write(b'%x\r\n%s\r\n' % (len(data), data))
+    self.wfile.flush()
+
+  # stream predictions as server-sent events until client leaves
+  def stream(self, query, headers):
+
+    self.send_response(200)
+
+    for k, v in headers.items():
+      self.send_header(k, v)
+
+    self.send_header('Content-Type', 'text/event-stream')
+    self.send_header('Transfer-Encoding', 'chunked')
+    self.end_headers()
+
+    table = {p['id']: p for p in self.api.getPredictions(query)}
+    self.chunk('event: reset\ndata: {}\n\n'.format(json.dumps(list(table.values()))).encode())
+
+    while True:
+
+      time.sleep(STREAM_TICK)
+
+      current = {p['id']: p for p in self.api.getPredictions(query)}
+      events = []
+
+      for pid, p in current.items():
+        if pid not in table:
+          events.append(('add', p))
+        elif p != table[pid]:
+          events.append(('update', p))
+
+      for pid in table:
+        if pid not in current:
+          events.append(('remove', {'type': 'prediction', 'id': pid}))
+
+      table = current
+
+      for event, data in events:
+        self.chunk('event: {}\ndata: {}\n\n'.format(event, json.dumps(data)).encode())
+
+  def do_GET(self):
+
+    url = urlparse(self.path)
+    query = parse_qs(url.query)
+
+    time.sleep(self.api.latency())
+
+    headers, limited = self.api.rateLimit()
+
+    if limited:
+      return self.send(429, b'{"errors":[{"status":"429"}]}', headers)
+
+    # injected throttle clears after a second, not at end of window
+    if random.random() < self.api.args.throttle_rate:
+      headers.update({'x-ratelimit-remaining': '0', 'x-ratelimit-reset': str(int(time.time()) + 1)})
+      return self.send(429, b'{"errors":[{"status":"429"}]}', headers)
+
+    if random.random() < self.api.args.error_rate:
+      return self.send(503, b'{"errors":[{"status":"503"}]}', headers)
+
+    endPoint = url.path.strip('/')
+
+    if endPoint == 'predictions' and self.headers.get('Accept') == 'text/event-stream':
+      try:
+        return self.stream(query, headers)
+      except (BrokenPipeError, ConnectionResetError):
+        return
+
+    handlers = {'routes': self.api.getRoutes,
+                'stops': self.api.getStops,
+                'predictions': self.api.getPredictions}
+
+    if endPoint not in handlers:
+      return self.send(404, b'{"errors":[{"status":"404"}]}', headers)
+
+    body = {'data': handlers[endPoint](query)}
+
+    # routes of predictions, as include=route asks
+    if 'route' in query.get('include', [''])[0].split(','):
+      routeIds = {p['relationships']['route']['data']['id'] for p in body['data']}
+      body['included'] = [r for r in self.api.routes if r['id'] in routeIds]
+
+    self.send(200, json.dumps(body).encode(), headers)
+
+
+def main():
+
+  parser = argparse.ArgumentParser(description='Stand-in MBTA V3 API server')
+  parser.add_argument('--port', type=int, default=8080)
+  parser.add_argument('--fixtures', help='JSON file with routes and stops')
+  parser.add_argument('--routes', type=int, default=20, help='synthetic routes')
+  parser.add_argument('--stops', type=int, default=30, help='synthetic stops per route')
+  parser.add_argument('--latency-mean', type=float, default=50, help='milliseconds')
+  parser.add_argument('--latency-sd', type=float, default=20, help='milliseconds')
+  parser.add_argument('--latency-dist', choices=('normal', 'exponential'), default='normal')
+  parser.add_argument('--error-rate', type=float, default=0.0, help='fraction answered 503')
+  parser.add_argument('--throttle-rate', type=float, default=0.0, help='fraction answered 429')
+  parser.add_argument('--rate-limit', type=int, default=100000, help='requests per minute')
+  args = parser.parse_args()
+
+  if args.fixtures:
+    with open(args.fixtures) as f:
+      fixtures = json.load(f)
+  else:
+    fixtures = syntheticFixtures(args.routes, args.stops)
+
+  Handler.api = FakeApi(fixtures, args)
+
+  server = ThreadingHTTPServer(('', args.port), Handler)
+  server.daemon_threads = True
+
+  print('Fake MBTA API on port {}'.format(args.port))
+  server.serve_forever()
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+#
+# Load generator for the MBTA client
+#
+# Drives a number of simulated skill sessions at once against an
+# API server (normally tools/fakeserver.py).  Each session does
+# what the skill does for a "when is the next bus" request - pick a
+# route, a direction and a stop, then start tracking and poll for
+# updates - and the time taken by each step is recorded.
+#
+#   python3 tools/fakeserver.py --port 8080 &
+#   python3 tools/loadgen.py --url http://localhost:8080 --sessions 50
+#
+# Reports throughput, p50/p99 latency per operation and API calls
+# per session.
+
+from concurrent.futures import ThreadPoolExecutor
+import argparse
+import importlib
+import random
+import types
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+# import client modules without the skill, which needs Mycroft
+def loadClient():
+
+  pkg = types.ModuleType('mbtaskill')
+  pkg.__path__ = [ROOT]
+  sys.modules['mbtaskill'] = pkg
+
+  return (importlib.import_module('mbtaskill.mbta'),
+          importlib.import_module('mbtaskill.metrics'))
+
+
+# value at fraction q of sorted list
+def percentile(values, q):
+  return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class Session():
+
+  def __init__(self, mbta, metrics, args, routeNames):
+
+    # requests of this session only, retried and failed ones included
+    self.metrics = metrics.Metrics()
+    self.client = mbta.MBTA(args.key, args.track, fileSystem=None, apiUrl=args.url,
+                            metrics=self.metrics)
+    self.args = args
+    self.routeNames = routeNames
+    self.timings = []       # (operation, seconds, ok)
+
+  # time one call, record operation
+  # failed tells if a result is a failure, otherwise the client's error flag does
+  def _timed(self, op, fn, *fnArgs, failed=None):
+
+    start = time.perf_counter()
+    ok = True
+
+    try:
+      retVal = fn(*fnArgs)
+      ok = not (failed(retVal) if failed != None else self.client.callError())
+    except Exception:
+      retVal = None
+      ok = False
+
+    self.timings.append((op, time.perf_counter() - start, ok))
+
+    return retVal
+
+  def run(self):
+
+    c = self.client
+
+    if self._timed('setRoute', c.setRoute, random.choice(self.routeNames)) == None:
+      return self
+
+    directions = c.getDirections()
+    self._timed('setDirection', c.setDirection, random.choice(directions).name)
+
+    stops = self._timed('getStops', c.getStops)
+
+    if not stops:
+      return self
+
+    self._timed('setStop', c.setStop, random.choice(list(stops)[:self.args.stop_pool]))
+    self._timed('startTracking', c.startTracking)
+
+    for _ in range(self.args.polls):
+
+      if c.trackerCount() == 0:
+        break
+
+      # a tracking poll runs in the background, it leaves the error
+      # flag alone and returns no sessions when it fails
+      time.sleep(self.args.poll_interval)
+      self._timed('updateTrackers', c.updateTrackers, failed=lambda r: len(r) == 0)
+
+    c.close()
+
+    return self
+
+  # requests sent, including retries, rate limited and failed ones
+  def apiCalls(self):
+    return self.metrics.total('mbta_requests_total')
+
+
+def main():
+
+  parser = argparse.ArgumentParser(description='Load generator for the MBTA client')
+  parser.add_argument('--url', default='http://localhost:8080', help='API server')
+  parser.add_argument('--key', default='loadgen', help='API key, also names rate limit state')
+  parser.add_argument('--sessions', type=int, default=20)
+  parser.add_argument('--concurrency', type=int, default=10)
+  parser.add_argument('--polls', type=int, default=3, help='tracking updates per session')
+  parser.add_argument('--poll-interval', type=float, default=1.0, help='seconds')
+  parser.add_argument('--track', type=int, default=3, help='buses tracked per session')
+  parser.add_argument('--route-pool', type=int, default=None,
+                      help='sessions pick among this many routes, fewer means more overlap')
+  parser.add_argument('--stop-pool', type=int, default=None,
+                      help='sessions pick among this many stops of a route')
+  args = parser.parse_args()
+
+  mbta, metrics = loadClient()
+
+  # route names to ask for
+  probe = mbta.MBTA(args.key, args.track, apiUrl=args.url)
+  probe.readRoutes()
+  routeNames = list(probe.routeInfo or [])[:args.route_pool]
+
+  if len(routeNames) == 0:
+    sys.exit('no routes from {}'.format(args.url))
+
+  start = time.perf_counter()
+
+  with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+    sessions = list(pool.map(lambda _: Session(mbta, metrics, args, routeNames).run(),
+                             range(args.sessions)))
+
+  elapsed = time.perf_counter() - start
+
+  # latency by operation
+  byOp = dict()
+  failures = dict()
+
+  for s in sessions:
+    for op, secs, ok in s.timings:
+      byOp.setdefault(op, []).append(secs)
+      failures[op] = failures.get(op, 0) + (0 if ok else 1)
+
+  print('{} sessions in {:.1f}s, {:.2f} sessions/s'.format(len(sessions), elapsed,
+                                                         len(sessions) / elapsed))
+  print('{:<16}{:>8}{:>8}{:>10}{:>10}'.format('operation', 'count', 'errors', 'p50 ms', 'p99 ms'))
+
+  for op, values in byOp.items():
+    values.sort()
+    print('{:<16}{:>8}{:>8}{:>10.1f}{:>10.1f}'.format(op, len(values), failures[op],
+                                                     percentile(values, 0.5) * 1000,
+                                                     percentile(values, 0.99) * 1000))
+
+  calls = sorted(s.apiCalls() for s in sessions)
+  print('API calls per session: mean {:.1f}, max {}'.format(sum(calls) / len(calls), calls[-1]))
+
+  # outcome of every request sent, retries included
+  results = dict()
+
+  for s in sessions:
+    with s.metrics.lock:
+      for (name, labels), n in s.metrics.counters.items():
+        if name == 'mbta_requests_total':
+          result = dict(labels)['result']
+          results[result] = results.get(result, 0) + n
+
+  print('API calls by result: ' + ', '.join('{} {}'.format(k, v) for k, v in sorted(results.items())))
+
+
+if __name__ == '__main__':
+  main()
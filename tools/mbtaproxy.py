@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+#
+# Shared caching proxy for the MBTA V3 API
+#
+# Several devices in one building each polling the same stops
+# multiply API traffic and share one address's rate limit.  Run
+# this proxy on one machine and enter its address as the API server
+# in each device's skill settings:
+#
+#   python3 tools/mbtaproxy.py --port 8090 --key YOUR_API_KEY
+#
+# Prediction requests naming routes and stops, as arrivals and
+# tracking make, subscribe the proxy to each (route, stop) pair.
+# While a pair has been asked for in the last SUBSCRIBE_SECS, all
+# subscribed pairs are polled upstream together in one request every
+# POLL_SECS, and every device is answered from the latest poll.  Other
+# requests are cached by query for a time depending on the endpoint,
+# and identical requests arriving together share one upstream call.
+# Streams are not proxied, streaming sessions fall back to polling.
+#
+# /_proxy/stats gives downstream and upstream request counts, the
+# fan-out ratio and added latency, /_proxy/metrics the same in
+# Prometheus text format.
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qsl, urlencode
+from collections import OrderedDict
+import importlib
+import argparse
+import threading
+import types
+import json
+import time
+import sys
+import os
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+POLL_SECS = 10          # seconds between upstream polls of subscribed predictions
+SUBSCRIBE_SECS = 120    # a (route, stop) pair is polled this long after it was last asked for
+POLL_WAIT_SECS = 15     # longest a request waits for the poll covering a new pair
+QUERY_TTL = {'routes': 3600, 'stops': 3600, 'predictions': POLL_SECS}  # seconds by endpoint
+DEFAULT_TTL = 30        # seconds other endpoints are cached
+CACHE_ENTRIES = 1000    # most responses cached by query, oldest are dropped first
+PRUNE_SECS = 60         # seconds between sweeps of expired responses
+DOWNSTREAM_LIMIT = 1000 # requests per minute devices are told they may make
+PROXY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)  # seconds
+LIST_PARAMS = ('filter[', 'fields[', 'include')  # parameters whose comma lists are unordered
+POLLED_PARAMS = {'filter[route]', 'filter[stop]', 'filter[direction_id]',
+                 'fields[prediction]', 'sort'}  # prediction queries answered from the poll
+
+
+# import client modules without the skill, which needs Mycroft
+def loadClient():
+
+  pkg = types.ModuleType('mbtaskill')
+  pkg.__path__ = [ROOT]
+  sys.modules['mbtaskill'] = pkg
+
+  return (importlib.import_module('mbtaskill.mbta'),
+          importlib.import_module('mbtaskill.metrics'))
+
+
+# query string in one form for all orderings of parameters and lists
+def normalQuery(params):
+
+  normal = []
+
+  for k, v in params:
+
+    if k.startswith(LIST_PARAMS):
+      v = ','.join(sorted(v.split(',')))
+
+    normal.append((k, v))
+
+  return urlencode(sorted(normal), safe='[],')
+
+
+class Response():
+
+  __slots__ = ('status', 'body', 'modified', 'fetched', 'expires')
+
+  def __init__(self, status, body, modified=None, ttl=0):
+
+    self.status = status
+    self.body = body              # bytes
+    self.modified = modified      # Last-Modified of upstream response
+    self.fetched = time.monotonic()
+    self.expires = self.fetched + ttl
+
+  def fresh(self):
+    return time.monotonic() < self.expires
+
+  # headers telling device how old response is and how long it stays fresh
+  def headers(self):
+
+    now = time.monotonic()
+    headers = {'Age': str(int(now - self.fetched)),
+               'Cache-Control': 'max-age={}'.format(max(0, int(self.expires - now)))}
+
+    if self.modified != None:
+      headers['Last-Modified'] = self.modified
+
+    return headers
+
+
+class Upstream():
+
+  # MBTA client makes the upstream calls, with its retries,
+  # rate limit governor and request metrics
+  def __init__(self, client):
+    self.client = client
+
+  # one upstream call, return Response, errors are returned not raised
+  def fetch(self, endPoint, query, ttl=0):
+
+    try:
+
+      r = self.client._request(endPoint, query)
+      retVal = Response(r.status_code, r.content, r.headers.get('Last-Modified'), ttl)
+
+    except Exception as e:
+
+      # forward server's answer if it gave one
+      r = getattr(e, 'response', None)
+      retVal = Response(r.status_code, r.content) if r != None else Response(502, b'{"errors":[{"status":"502"}]}')
+
+    return retVal
+
+
+class QueryCache():
+
+  # responses by endpoint and query, identical requests
+  # made while one is in flight wait for it
+  # every distinct board or nearby query is a new entry, so expired
+  # responses are swept out and at most CACHE_ENTRIES are kept
+  def __init__(self, upstream, metrics, maxEntries=CACHE_ENTRIES):
+
+    self.upstream = upstream
+    self.metrics = metrics
+    self.maxEntries = maxEntries
+    self.lock = threading.Lock()
+    self.entries = OrderedDict()  # (endpoint, query) -> Response, oldest fetch first
+    self.inflight = dict()        # (endpoint, query) -> Event set when fetched
+    self.pruned = time.monotonic()  # time of last sweep
+
+  def get(self, endPoint, query):
+
+    key = (endPoint, query)
+
+    with self.lock:
+
+      entry = self.entries.get(key)
+
+      if entry != None and entry.fresh():
+        self.metrics.inc('mbta_proxy_requests_total', endpoint=endPoint, result='hit')
+        return entry
+
+      fetching = self.inflight.get(key)
+      owner = fetching == None
+
+      if owner:
+        fetching = self.inflight[key] = threading.Event()
+
+    if not owner:
+
+      # share the call already being made
+      self.metrics.inc('mbta_proxy_requests_total', endpoint=endPoint, result='coalesced')
+      fetching.wait()
+
+      with self.lock:
+        return self.entries.get(key) or Response(502, b'{"errors":[{"status":"502"}]}')
+
+    self.metrics.inc('mbta_proxy_requests_total', endpoint=endPoint, result='miss')
+
+    try:
+
+      entry = self.upstream.fetch(endPoint, query, QUERY_TTL.get(endPoint, DEFAULT_TTL))
+
+      with self.lock:
+
+        # only good answers are kept for others
+        if entry.status == 200:
+          self.entries[key] = entry
+          self.entries.move_to_end(key)
+          self._prune()
+        else:
+          self.entries.pop(key, None)
+
+    finally:
+
+      with self.lock:
+        del self.inflight[key]
+
+      fetching.set()
+
+    return entry
+
+  # drop expired responses now and then, and the oldest ones
+  # when there are too many, call with lock held
+  def _prune(self):
+
+    now = time.monotonic()
+
+    if now - self.pruned >= PRUNE_SECS:
+
+      for key in [k for k, e in self.entries.items() if not e.fresh()]:
+        del self.entries[key]
+
+      self.pruned = now
+
+    while len(self.entries) > self.maxEntries:
+      self.entries.popitem(last=False)
+
+    self.metrics.set('mbta_proxy_cache_entries', len(self.entries))
+
+
+class PredictionPoller(threading.Thread):
+
+  # polls predictions for every subscribed (route, stop) pair in one request
+  def __init__(self, upstream, metrics):
+
+    threading.Thread.__init__(self, daemon=True)
+
+    self.upstream = upstream
+    self.metrics = metrics
+    self.cond = threading.Condition()
+    self.subscriptions = dict()   # (route id, stop id) -> time last asked for
+    self.predictions = []         # prediction resources from last good poll
+    self.polled = None            # Response of last good poll, for its age
+    self.covered = set()          # pairs in last good poll
+    self.started = 0              # number of last poll started
+    self.finished = 0             # number of last poll finished
+    self.lastOk = True            # last poll finished succeeded
+    self.wanted = False           # a new pair is waiting for a poll
+
+  # predictions for routes at stops, optionally in one direction
+  # a new pair waits for a poll that covers it
+  # return Response
+  def get(self, routes, stops, direction):
+
+    pairs = {(r, s) for r in routes for s in stops}
+
+    with self.cond:
+
+      now = time.monotonic()
+
+      for pair in pairs:
+        self.subscriptions[pair] = now
+
+      self.metrics.set('mbta_proxy_subscriptions', len(self.subscriptions))
+
+      if not pairs <= self.covered:
+
+        # poll right away, wait for one started after subscribing
+        needed = self.started + 1
+        self.wanted = True
+        self.cond.notify_all()
+
+        self.cond.wait_for(lambda: self.finished >= needed, POLL_WAIT_SECS)
+
+        if self.finished < needed or not self.lastOk:
+          self.metrics.inc('mbta_proxy_requests_total', endpoint='predictions', result='error')
+          return Response(502, b'{"errors":[{"status":"502"}]}')
+
+        self.metrics.inc('mbta_proxy_requests_total', endpoint='predictions', result='subscribed')
+
+      else:
+
+        self.metrics.inc('mbta_proxy_requests_total', endpoint='predictions', result='hit')
+
+      predictions = self.predictions
+      polled = self.polled
+
+    data = [p for p in predictions
+            if p['relationships']['route']['data']['id'] in routes
+            and p['relationships']['stop']['data']['id'] in stops
+            and (direction == None or str(p['attributes']['direction_id']) == direction)]
+
+    retVal = Response(200, json.dumps({'data': data}).encode())
+    retVal.fetched, retVal.expires = polled.fetched, polled.expires
+
+    return retVal
+
+  # drop pairs nobody has asked for lately, start a poll of the rest
+  # return (poll number, pairs) or (None, None) if nothing is subscribed
+  def _startPoll(self):
+
+    now = time.monotonic()
+
+    for pair in [p for p, t in self.subscriptions.items() if now - t > SUBSCRIBE_SECS]:
+      del self.subscriptions[pair]
+
+    self.metrics.set('mbta_proxy_subscriptions', len(self.subscriptions))
+    self.wanted = False
+
+    if len(self.subscriptions) == 0:
+      return (None, None)
+
+    self.started += 1
+
+    return (self.started, set(self.subscriptions))
+
+  def poll(self):
+
+    with self.cond:
+      number, pairs = self._startPoll()
+
+    if number != None:
+
+      # MBTA batch query, direction comes back with each prediction
+      query = self.upstream.client._batchArgs([(r, None, s) for r, s in pairs])
+      response = self.upstream.fetch('predictions', query, POLL_SECS)
+
+      with self.cond:
+
+        self.finished = number
+        self.lastOk = response.status == 200
+
+        if self.lastOk:
+          self.predictions = json.loads(response.body)['data']
+          self.polled = response
+          self.covered = pairs
+
+        self.cond.notify_all()
+
+  def run(self):
+
+    while True:
+
+      self.poll()
+
+      with self.cond:
+        self.cond.wait_for(lambda: self.wanted, POLL_SECS)
+
+
+class Handler(BaseHTTPRequestHandler):
+
+  protocol_version = 'HTTP/1.1'
+  disable_nagle_algorithm = True   # headers and body are written separately
+  cache = None
+  poller = None
+  metrics = None
+  prometheusText = None
+
+  def log_message(self, *args):
+    pass
+
+  def send(self, status, body, headers, contentType='application/vnd.api+json'):
+
+    self.send_response(status)
+
+    for k, v in headers.items():
+      self.send_header(k, v)
+
+    # devices may ask as often as they like, the proxy keeps to the real limit
+    self.send_header('x-ratelimit-limit', str(DOWNSTREAM_LIMIT))
+    self.send_header('x-ratelimit-remaining', str(DOWNSTREAM_LIMIT))
+    self.send_header('x-ratelimit-reset', str(int(time.time()) + 60))
+    self.send_header('Content-Type', contentType)
+    self.send_header('Content-Length', str(len(body)))
+    self.end_headers()
+    self.wfile.write(body)
+
+  # summary of proxy counts and latency
+  def stats(self):
+
+    downstream = self.metrics.total('mbta_proxy_requests_total')
+    upstream = self.metrics.total('mbta_requests_total')
+    latency = self.metrics.histogram('mbta_proxy_seconds')
+
+    return {'downstream': downstream,
+            'upstream': upstream,
+            'fanOut': downstream / upstream if upstream else None,
+            'hits': self.metrics.total('mbta_proxy_requests_total', result='hit'),
+            'coalesced': self.metrics.total('mbta_proxy_requests_total', result='coalesced'),
+            'subscriptions': self.metrics.value('mbta_proxy_subscriptions'),
+            'cacheEntries': self.metrics.value('mbta_proxy_cache_entries'),
+            'p50Secs': latency.quantile(0.5) if latency else None,
+            'p99Secs': latency.quantile(0.99) if latency else None}
+
+  def do_GET(self):
+
+    start = time.perf_counter()
+    url = urlparse(self.path)
+    endPoint = url.path.strip('/')
+    params = parse_qsl(url.query)
+    query = dict(params)
+
+    if endPoint == '_proxy/stats':
+      return self.send(200, json.dumps(self.stats()).encode(), {}, 'application/json')
+
+    if endPoint == '_proxy/metrics':
+      return self.send(200, self.prometheusText(self.metrics).encode(), {}, 'text/plain; version=0.0.4')
+
+    if self.headers.get('Accept') == 'text/event-stream':
+      return self.send(404, b'{"errors":[{"status":"404"}]}', {})
+
+    if (endPoint == 'predictions' and 'filter[route]' in query and 'filter[stop]' in query
+        and set(query) <= POLLED_PARAMS):
+
+      response = self.poller.get(set(query['filter[route]'].split(',')),
+                                 set(query['filter[stop]'].split(',')),
+                                 query.get('filter[direction_id]'))
+    else:
+
+      response = self.cache.get(endPoint, normalQuery(params))
+
+    # device already has current routes
+    if (response.modified != None and
+        self.headers.get('If-Modified-Since') == response.modified):
+      self.send(304, b'', response.headers())
+    else:
+      self.send(response.status, response.body, response.headers())
+
+    self.metrics.observe('mbta_proxy_seconds', time.perf_counter() - start, PROXY_BUCKETS)
+
+
+def main():
+
+  parser = argparse.ArgumentParser(description='Shared caching proxy for the MBTA V3 API')
+  parser.add_argument('--port', type=int, default=8090)
+  parser.add_argument('--bind', default='', help='address to listen on, all by default')
+  parser.add_argument('--upstream', default=None, help='API server, the MBTA by default')
+  parser.add_argument('--key', default=None, help='MBTA API key used for upstream calls')
+  args = parser.parse_args()
+
+  mbta, metrics = loadClient()
+
+  registry = metrics.Metrics()
+  client = mbta.MBTA(args.key, 3, apiUrl=args.upstream or mbta.API_URL, metrics=registry)
+  upstream = Upstream(client)
+
+  Handler.metrics = registry
+  Handler.prometheusText = staticmethod(metrics.prometheusText)
+  Handler.cache = QueryCache(upstream, registry)
+  Handler.poller = PredictionPoller(upstream, registry)
+  Handler.poller.start()
+
+  server = ThreadingHTTPServer((args.bind, args.port), Handler)
+  print('MBTA proxy on port {} for {}'.format(args.port, client.apiUrl))
+
+  try:
+    server.serve_forever()
+  except KeyboardInterrupt:
+    pass
+
+
+if __name__ == '__main__':
+  main()
@@ -0,0 +1,99 @@
+# Warm up the MBTA client for saved shortcuts
+#
+# Asking for a shortcut used to pay for reading the route catalog,
+# the stops on the route and the predictions while the user waited.
+# WarmUp reads the routes and the stops for every shortcut's route
+# and direction once, in the background.  During commute windows it
+# also fetches predictions for the most used shortcuts every minute,
+# in one background request, so answering is a memory read.
+# Background requests leave part of the rate limit for the user,
+# and do not touch the error flag of a request being answered.
+
+from . governor import BACKGROUND
+import threading
+import time
+
+WARM_SECS = 60          # seconds between prediction prefetches in a window
+WARM_SHORTCUTS = 5      # most used shortcuts whose predictions are prefetched
+
+
+# parse commute windows like "7:00-9:30, 16:30-18:30"
+# return list of (start, end) minutes after midnight
+# windows that cannot be read are skipped
+def parseWindows(text):
+
+  retVal = []
+
+  for window in (text or '').split(','):
+
+    try:
+
+      start, end = [t.strip().split(':') for t in window.split('-')]
+      retVal.append((int(start[0]) * 60 + int(start[1]), int(end[0]) * 60 + int(end[1])))
+
+    except (ValueError, IndexError):
+      pass
+
+  return retVal
+
+
+# True if local time now is inside one of the windows
+# a window may run past midnight
+def inWindow(windows, now=None):
+
+  t = time.localtime(now)
+  minute = t.tm_hour * 60 + t.tm_min
+
+  return any(start <= minute < end if start <= end else (minute >= start or minute < end)
+             for start, end in windows)
+
+
+class WarmUp(threading.Thread):
+
+  # client is MBTA object (or driver) to warm, shortcuts a ShortcutStore
+  # windows are (start, end) minutes when predictions are prefetched
+  def __init__(self, client, shortcuts, windows, log=None):
+
+    threading.Thread.__init__(self, daemon=True)
+
+    self.client = client
+    self.shortcuts = shortcuts
+    self.windows = windows
+    self.log = log
+    self.stopped = threading.Event()
+
+  def stop(self):
+    self.stopped.set()
+
+  # read routes and stops used by shortcuts
+  def warmCatalog(self):
+
+    self.client.readRoutes(BACKGROUND)
+
+    for saved in self.shortcuts.mostUsed():
+      self.client.loadStops(saved.routeId, saved.direction, BACKGROUND)
+
+  # fetch predictions for most used shortcuts
+  def warmPredictions(self):
+
+    self.client.prefetchPredictions([(s.routeId, s.direction, s.stopId)
+                                     for s in self.shortcuts.mostUsed(WARM_SHORTCUTS)])
+
+  def run(self):
+
+    try:
+
+      self.warmCatalog()
+
+      while not self.stopped.is_set():
+
+        if inWindow(self.windows):
+          self.warmPredictions()
+
+        self.stopped.wait(WARM_SECS)
+
+    except Exception as e:
+
+      # warm up only saves time, skill works without it
+      if self.log != None:
+        self.log.error('MBTA skill warm up stopped: {}'.format(e))